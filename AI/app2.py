@@ -2,7 +2,9 @@ import streamlit as st
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
-import easyocr
+from ocr_engine import get_ocr_engine
+from yolo_inference import yolo_predict
+from model_client import get_model_client
 import re
 from ultralytics import YOLO
 import tempfile
@@ -20,7 +22,10 @@ app_mode = st.sidebar.selectbox("Choisissez le module",
 # Initialisation des modèles (une seule fois)
 @st.cache_resource
 def load_models():
-    reader = easyocr.Reader(['fr'], gpu=True)
+    client = get_model_client()
+    if client is not None:  # serveur de modèles partagé (model_server.py) : modèles chargés une seule fois
+        return client.ocr(['fr']), client.yolo(os.path.abspath('yolov8n.pt'))
+    reader = get_ocr_engine(['fr'])  # moteur OCR partagé, chargé une seule fois par processus
     # Chargement d'un modèle spécialisé dans les fruits (à remplacer par votre modèle personnalisé si disponible)
     fruit_model = YOLO('yolov8n.pt')  # Modèle de base (à remplacer par un modèle fruits si possible)
     return reader, fruit_model
@@ -168,14 +173,11 @@ elif app_mode == "Détection de Fruits":
         # Affichage image originale
         st.image(img_enhanced, caption="Image originale améliorée", use_column_width=True)
         
-        # Sauvegarde temporaire
-        temp_path = "temp_image.jpg"
-        cv2.imwrite(temp_path, cv2.cvtColor(img_enhanced, cv2.COLOR_RGB2BGR))
-        
         try:
-            # Détection avec paramètres optimisés
-            results = fruit_model.predict(
-                temp_path,
+            # Détection avec paramètres optimisés (image passée en mémoire)
+            results = yolo_predict(
+                fruit_model,
+                img_enhanced,
                 conf=conf_threshold,
                 iou=0.25,
                 imgsz=640,
@@ -270,11 +272,6 @@ elif app_mode == "Détection de Fruits":
         
         except Exception as e:
             st.error(f"Erreur lors de l'analyse: {str(e)}")
-        
-        finally:
-            # Nettoyage
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
 
 # Module mesure de hauteur
 elif app_mode == "Mesure de hauteur":
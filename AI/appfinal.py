@@ -41,7 +41,12 @@ import streamlit as st
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
-import easyocr
+from ocr_engine import get_ocr_engine
+from yolo_inference import yolo_predict
+from model_client import get_model_client
+from tree_db import get_tree_db
+from tree_registry import get_tree_registry, records_from_dataframe
+from measurement_session import get_measurement_session
 import re
 from ultralytics import YOLO
 import tempfile
@@ -52,8 +57,7 @@ from datetime import datetime
 import base64
 from io import BytesIO
 from PIL import Image, ImageDraw
-import pyzbar
-from pyzbar import pyzbar
+from label_reader import decode_label_codes, read_label_text
 from streamlit_drawable_canvas import st_canvas
 import math
 
@@ -260,6 +264,10 @@ def initialize_session_state():
         st.session_state.validation_data = {}
     if 'uploaded_tree_image' not in st.session_state:
         st.session_state.uploaded_tree_image = None
+    if 'uploaded_tree_bytes' not in st.session_state:
+        st.session_state.uploaded_tree_bytes = None
+    if 'tree_image_enhanced' not in st.session_state:
+        st.session_state.tree_image_enhanced = False
     if 'final_results' not in st.session_state:
         st.session_state.final_results = {}
     if 'existing_trees_data' not in st.session_state:
@@ -379,45 +387,43 @@ def save_to_file(data, format_type="json"):
     
     return filename
 
-def load_existing_trees_from_excel():
-    """Charge les données d'arbres existants depuis un fichier Excel"""
+TREES_DB_FILE = "arbres_database.sqlite"   # base de travail (SQLite, WAL)
+TREES_EXCEL_FILE = "arbres_database.xlsx"  # format d'export / ancienne base importée au premier lancement
+
+def get_trees_db():
+    """Base SQLite des arbres (l'ancien fichier Excel est importé s'il existe et que la base est vide)"""
+    return get_tree_db(TREES_DB_FILE, legacy_excel=TREES_EXCEL_FILE)
+
+# Champs des arbres existants affichés dans l'application (colonne -> valeur par défaut)
+TREE_FIELDS = {
+    'tree_type': '', 'last_analysis': '', 'total_fruits_last': 0, 'total_weight_last': 0,
+    'height_m': 0, 'width_m': 0, 'coordinates': '', 'comments': ''
+}
+
+def load_tree_registry():
+    """Index des arbres partagé entre les sessions, reconstruit seulement quand la base change"""
+    db = get_trees_db()
+    return get_tree_registry(
+        TREES_DB_FILE,
+        lambda: records_from_dataframe(db.to_dataframe(), fields=TREE_FIELDS),
+        extra_paths=[TREES_DB_FILE + "-wal"]
+    )
+
+def load_existing_trees():
+    """Charge les données d'arbres existants depuis la base"""
     try:
-        excel_file = "arbres_database.xlsx"
-        if os.path.exists(excel_file):
-            df = pd.read_excel(excel_file)
-            trees_dict = {}
-            for index, row in df.iterrows():
-                tree_id = str(row.get('tree_id', ''))
-                if tree_id:
-                    trees_dict[tree_id] = {
-                        'tree_id': tree_id,
-                        'tree_type': row.get('tree_type', ''),
-                        'last_analysis': row.get('last_analysis', ''),
-                        'total_fruits_last': row.get('total_fruits_last', 0),
-                        'total_weight_last': row.get('total_weight_last', 0),
-                        'height_m': row.get('height_m', 0),
-                        'width_m': row.get('width_m', 0),
-                        'coordinates': row.get('coordinates', ''),
-                        'comments': row.get('comments', '')
-                    }
-            return trees_dict
-        else:
-            return {}
+        return load_tree_registry().records
     except Exception as e:
-        st.error(f"Erreur lors du chargement des données Excel : {e}")
+        st.error(f"Erreur lors du chargement de la base d'arbres : {e}")
         return {}
 
-def save_to_excel(data, tree_id):
-    """Sauvegarde ou met à jour les données dans le fichier Excel"""
+def export_trees_to_excel(excel_file=TREES_EXCEL_FILE):
+    """Export explicite de toute la base vers un fichier Excel"""
+    return get_trees_db().export_excel(excel_file)
+
+def save_tree_record(data, tree_id):
+    """Sauvegarde ou met à jour un arbre dans la base (upsert atomique + historique des mesures)"""
     try:
-        excel_file = "arbres_database.xlsx"
-        
-        # Charger les données existantes ou créer un nouveau DataFrame
-        if os.path.exists(excel_file):
-            df = pd.read_excel(excel_file)
-        else:
-            df = pd.DataFrame()
-        
         # Préparer les nouvelles données
         new_row = {
             'tree_id': tree_id,
@@ -435,22 +441,13 @@ def save_to_excel(data, tree_id):
             'comments': data.get('validation_corrections', {}).get('quality_assessment', {}).get('comments', ''),
             'distance_cm_last': data.get('validation_corrections', {}).get('tree_measurements', {}).get('corrected_distance_cm', 0)
         }
+        new_row.pop('tree_id')
         
-        # Vérifier si l'arbre existe déjà
-        if 'tree_id' in df.columns and tree_id in df['tree_id'].values:
-            # Mise à jour
-            df.loc[df['tree_id'] == tree_id, list(new_row.keys())] = list(new_row.values())
-        else:
-            # Ajout d'un nouvel arbre
-            new_df = pd.DataFrame([new_row])
-            df = pd.concat([df, new_df], ignore_index=True)
-        
-        # Sauvegarder dans Excel
-        df.to_excel(excel_file, index=False)
-        return excel_file
+        get_trees_db().upsert(tree_id, new_row)
+        return TREES_DB_FILE
         
     except Exception as e:
-        st.error(f"Erreur lors de la sauvegarde Excel : {e}")
+        st.error(f"Erreur lors de la sauvegarde : {e}")
         return None
 
 def get_download_link(file_path, link_text):
@@ -466,7 +463,10 @@ def get_download_link(file_path, link_text):
 def load_models():
     """Charge les modèles IA une seule fois pour optimiser les performances"""
     try:
-        reader = easyocr.Reader(['fr', 'en'], gpu=False)  # Support français et anglais
+        client = get_model_client()
+        if client is not None:  # serveur de modèles partagé (model_server.py)
+            return client.ocr(['fr', 'en'], gpu=False), client.yolo(os.path.abspath('yolov8n.pt'))
+        reader = get_ocr_engine(['fr', 'en'], gpu=False)  # Support français et anglais, moteur partagé
         fruit_model = YOLO('yolov8n.pt')  # Modèle YOLO pour la détection
         return reader, fruit_model
     except Exception as e:
@@ -484,7 +484,7 @@ is_mobile = detect_mobile_device()
 
 # Chargement des données d'arbres existants
 if 'existing_trees_data' not in st.session_state or not st.session_state.existing_trees_data:
-    st.session_state.existing_trees_data = load_existing_trees_from_excel()
+    st.session_state.existing_trees_data = load_existing_trees()
 
 # ==================== INTERFACE MOBILE PRINCIPALE ====================
 
@@ -837,6 +837,7 @@ elif app_mode == "🔍 1. Identification Arbre":
                 manual_id = st.text_input("Tapez l'ID de l'arbre:", placeholder="Ex: ARB001, A123, etc.")
                 
                 if manual_id:
+                    manual_id = manual_id.strip()
                     if manual_id in st.session_state.existing_trees_data:
                         mobile_alert(f"Arbre trouvé: **{manual_id}**", "success")
                         if st.button("✅ Sélectionner cet arbre", use_container_width=True):
@@ -851,6 +852,17 @@ elif app_mode == "🔍 1. Identification Arbre":
                             st.rerun()
                     else:
                         mobile_alert(f"Arbre **{manual_id}** non trouvé dans la base de données.", "warning")
+                        # IDs proches (casse, séparateurs, confusions O/0, I/1...) : proposés, jamais substitués
+                        for match_id in load_tree_registry().resolve(manual_id):
+                            st.caption(f"Correspondance approchée : {match_id}")
+                            if st.button(f"✅ Sélectionner {match_id}", key=f"manual_{match_id}", use_container_width=True):
+                                st.session_state.tree_id = match_id
+                                st.session_state.tree_info = {
+                                    'tree_id': match_id,
+                                    'previous_data': st.session_state.existing_trees_data.get(match_id, load_tree_registry().get(match_id)),
+                                    'timestamp': datetime.now().isoformat()
+                                }
+                                st.rerun()
                         if st.button("🆕 Créer comme nouvel arbre", use_container_width=True):
                             st.session_state.tree_type_selection = "new"
                             st.session_state.tree_id = manual_id
@@ -886,8 +898,9 @@ elif app_mode == "🔍 1. Identification Arbre":
                     if st.button("🔍 Analyser l'image", type="primary", use_container_width=True):
                         with st.spinner("Lecture de l'ID..."):
                             try:
-                                results = reader.readtext(image_rgb)
-                                detected_ids = []
+                                detected_ids = [{'text': code.strip().upper(), 'confidence': 1.0}
+                                                for code in decode_label_codes(image) if code.strip()]
+                                results = [] if detected_ids else read_label_text(reader, image)
                                 
                                 for bbox, text, confidence in results:
                                     if confidence > 0.3:
@@ -904,16 +917,20 @@ elif app_mode == "🔍 1. Identification Arbre":
                                     for id_info in detected_ids:
                                         st.write(f"• **{id_info['text']}** (confiance: {id_info['confidence']:.2f})")
                                         
-                                        # Vérifier si l'ID existe
-                                        if id_info['text'] in st.session_state.existing_trees_data:
-                                            if st.button(f"✅ Sélectionner {id_info['text']}", use_container_width=True):
-                                                st.session_state.tree_id = id_info['text']
-                                                st.session_state.tree_info = {
-                                                    'tree_id': id_info['text'],
-                                                    'previous_data': st.session_state.existing_trees_data[id_info['text']],
-                                                    'timestamp': datetime.now().isoformat()
-                                                }
-                                                st.rerun()
+                                        # Vérifier si l'ID existe (exact, puis approché : ID mal lu par l'OCR)
+                                        matches = load_tree_registry().resolve(id_info['text'])
+                                        if matches:
+                                            for match_id in matches:
+                                                if match_id != id_info['text']:
+                                                    st.caption(f"Correspondance approchée : {match_id}")
+                                                if st.button(f"✅ Sélectionner {match_id}", key=f"select_{id_info['text']}_{match_id}", use_container_width=True):
+                                                    st.session_state.tree_id = match_id
+                                                    st.session_state.tree_info = {
+                                                        'tree_id': match_id,
+                                                        'previous_data': st.session_state.existing_trees_data.get(match_id, load_tree_registry().get(match_id)),
+                                                        'timestamp': datetime.now().isoformat()
+                                                    }
+                                                    st.rerun()
                                         else:
                                             mobile_alert(f"ID **{id_info['text']}** non trouvé en base", "warning")
                                 else:
@@ -965,24 +982,13 @@ elif app_mode == "🔍 1. Identification Arbre":
                 st.image(image_rgb, caption="Image originale", use_column_width=True)
                 
                 if st.button("🔍 Analyser l'image", type="primary", use_container_width=True):
-                    with st.spinner("Analyse en cours..."):
-                        # Prétraitement pour améliorer l'OCR
-                        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                        denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-                        _, thresholded = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-                        processed_image = cv2.cvtColor(thresholded, cv2.COLOR_GRAY2RGB)
-                        
-                        st.image(processed_image, caption="Image prétraitée", width=300)
-                    
-                    # Analyse QR Code
+                    # Analyse QR Code (prioritaire : l'OCR n'est lancé que sans code lisible)
                     st.markdown("### 🔳 Détection QR Code")
-                    qr_codes = pyzbar.decode(image)
+                    with st.spinner("Analyse en cours..."):
+                        qr_data = decode_label_codes(image)
                     
-                    qr_data = []
-                    if qr_codes:
-                        for qr in qr_codes:
-                            qr_text = qr.data.decode('utf-8')
-                            qr_data.append(qr_text)
+                    if qr_data:
+                        for qr_text in qr_data:
                             mobile_alert(f"QR Code détecté: **{qr_text}**", "success")
                     else:
                         mobile_alert("Aucun QR Code détecté", "warning")
@@ -993,14 +999,8 @@ elif app_mode == "🔍 1. Identification Arbre":
                     if reader is not None:
                         with st.spinner("Analyse OCR en cours..."):
                             try:
-                                results = reader.readtext(
-                                    processed_image,
-                                    batch_size=4,
-                                    text_threshold=0.3,
-                                    low_text=0.3,
-                                    link_threshold=0.3,
-                                    decoder='beamsearch'
-                                )
+                                # Détection des zones de texte, puis reconnaissance sur ces zones seules
+                                results = [] if qr_data else read_label_text(reader, image)
                                 
                                 # Extraction et structuration des informations
                                 extracted_info = {
@@ -1840,13 +1840,17 @@ elif app_mode == "🍎 3. Détection Fruits":
         )
         
         if tree_image is not None:
-            # Lecture et préparation de l'image
-            file_bytes = np.asarray(bytearray(tree_image.read()), dtype=np.uint8)
-            image = cv2.imdecode(file_bytes, 1)
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            # Lecture et préparation de l'image (décodée une seule fois par image,
+            # les reruns suivants reprennent la session de mesure)
+            file_bytes = tree_image.getvalue()
+            session = get_measurement_session(file_bytes)
+            image = session.stage("bgr", None, lambda: cv2.imdecode(np.frombuffer(file_bytes, np.uint8), 1))
+            image_rgb = session.stage("rgb", None, lambda: cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
             
             # Sauvegarde de l'image dans la session
             st.session_state.uploaded_tree_image = image_rgb
+            st.session_state.uploaded_tree_bytes = file_bytes
+            st.session_state.tree_image_enhanced = False
             
             # Affichage de l'image
             col1, col2 = st.columns([3, 1])
@@ -1865,13 +1869,16 @@ elif app_mode == "🍎 3. Détection Fruits":
                 enhance_image = st.checkbox("Améliorer contraste")
                 if enhance_image:
                     # Amélioration du contraste
-                    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-                    l, a, b = cv2.split(lab)
-                    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                    l = clahe.apply(l)
-                    enhanced = cv2.merge([l, a, b])
-                    image_rgb = cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
+                    def clahe_rgb():
+                        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+                        l, a, b = cv2.split(lab)
+                        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+                        l = clahe.apply(l)
+                        enhanced = cv2.merge([l, a, b])
+                        return cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
+                    image_rgb = session.stage("clahe", (2.0, 8), clahe_rgb)
                     st.session_state.uploaded_tree_image = image_rgb
+                    st.session_state.tree_image_enhanced = True
     
     with tab2:
         st.subheader("🔍 Détection automatique par IA")
@@ -1895,13 +1902,10 @@ elif app_mode == "🍎 3. Détection Fruits":
                 if fruit_model is not None:
                     with st.spinner("🧠 Analyse IA en cours..."):
                         try:
-                            # Sauvegarde temporaire de l'image
-                            temp_path = "temp_tree_image.jpg"
-                            cv2.imwrite(temp_path, cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR))
-                            
-                            # Détection YOLO
-                            results = fruit_model.predict(
-                                temp_path,
+                            # Détection YOLO (image passée en mémoire)
+                            results = yolo_predict(
+                                fruit_model,
+                                image_rgb,
                                 conf=confidence_threshold,
                                 iou=iou_threshold,
                                 imgsz=image_size,
@@ -1984,10 +1988,6 @@ elif app_mode == "🍎 3. Détection Fruits":
                                 st.image(image_with_boxes, caption="Fruits détectés", use_column_width=True)
                             else:
                                 st.warning("⚠️ Aucun fruit détecté. Essayez d'ajuster les paramètres.")
-                            
-                            # Nettoyage
-                            if os.path.exists(temp_path):
-                                os.remove(temp_path)
                         
                         except Exception as e:
                             st.error(f"❌ Erreur lors de la détection : {str(e)}")
@@ -2116,13 +2116,23 @@ elif app_mode == "✅ 4. Validation":
             # Préparer l'image avec les détections existantes
             height, width = image_rgb.shape[:2]
             
-            # Création d'une image avec les boîtes existantes
-            canvas_image = image_rgb.copy()
-            for i, det in enumerate(detections):
-                x1, y1, x2, y2 = map(int, det['bbox'])
-                cv2.rectangle(canvas_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(canvas_image, f"Fruit {i+1}", (x1, y1-10),
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            # Création d'une image avec les boîtes existantes ; le fond du canvas est
+            # gardé dans la session de mesure tant que l'image et les boîtes ne changent pas
+            def canvas_background():
+                canvas_image = image_rgb.copy()
+                for i, det in enumerate(detections):
+                    x1, y1, x2, y2 = map(int, det['bbox'])
+                    cv2.rectangle(canvas_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                    cv2.putText(canvas_image, f"Fruit {i+1}", (x1, y1-10),
+                              cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                return Image.fromarray(canvas_image)
+            
+            boxes_key = tuple(tuple(map(int, det['bbox'])) for det in detections)
+            if st.session_state.uploaded_tree_bytes is not None:
+                session = get_measurement_session(st.session_state.uploaded_tree_bytes)
+                background = session.stage("canvas", (st.session_state.tree_image_enhanced, boxes_key), canvas_background)
+            else:
+                background = canvas_background()
             
             col1, col2 = st.columns([3, 1])
             
@@ -2132,7 +2142,7 @@ elif app_mode == "✅ 4. Validation":
                     fill_color="rgba(255, 165, 0, 0.3)",  # Orange avec transparence
                     stroke_width=3,
                     stroke_color="#00ff00",  # Vert
-                    background_image=Image.fromarray(canvas_image),
+                    background_image=background,
                     update_streamlit=True,
                     height=400,
                     width=600,
@@ -2497,19 +2507,19 @@ elif app_mode == "💾 5. Enregistrement Final":
                 help="Le fichier sera créé s'il n'existe pas"
             )
         
-        # Bouton de sauvegarde Excel
+        # Bouton de sauvegarde (base SQLite)
         st.markdown("---")
-        if st.button("💾 Enregistrer dans Excel", type="primary"):
+        if st.button("💾 Enregistrer dans la base", type="primary"):
             try:
                 with st.spinner("💾 Enregistrement en cours..."):
-                    # Sauvegarde Excel
-                    saved_file = save_to_excel(export_data, st.session_state.tree_id)
+                    # Sauvegarde dans la base
+                    saved_file = save_tree_record(export_data, st.session_state.tree_id)
                     
                     if saved_file:
                         st.success(f"✅ Données enregistrées avec succès dans {saved_file} !")
                         
                         # Mise à jour de la base de données en session
-                        st.session_state.existing_trees_data = load_existing_trees_from_excel()
+                        st.session_state.existing_trees_data = load_existing_trees()
                         
                         # Affichage du statut de la sauvegarde
                         if st.session_state.tree_type_selection == "existing":
@@ -2521,26 +2531,28 @@ elif app_mode == "💾 5. Enregistrement Final":
                         total_trees = len(st.session_state.existing_trees_data)
                         st.metric("🌳 Total d'arbres en base", total_trees)
                         
-                        # Option d'export du fichier Excel
-                        try:
-                            with open(saved_file, "rb") as file:
-                                excel_data = file.read()
-                            
-                            st.download_button(
-                                label="📥 Télécharger le fichier Excel",
-                                data=excel_data,
-                                file_name=saved_file,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            )
-                        except:
-                            st.warning("⚠️ Le téléchargement direct n'est pas disponible, mais le fichier a été sauvegardé localement.")
-                    
                     else:
-                        st.error("❌ Erreur lors de la sauvegarde Excel")
+                        st.error("❌ Erreur lors de la sauvegarde")
                 
             except Exception as e:
                 st.error(f"❌ Erreur lors de l'enregistrement : {str(e)}")
         
+        # Export Excel explicite (toute la base)
+        if st.button("📤 Exporter la base vers Excel"):
+            try:
+                exported_file = export_trees_to_excel(excel_filename)
+                with open(exported_file, "rb") as file:
+                    excel_data = file.read()
+                
+                st.download_button(
+                    label="📥 Télécharger le fichier Excel",
+                    data=excel_data,
+                    file_name=os.path.basename(exported_file),
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            except Exception as e:
+                st.error(f"❌ Erreur lors de l'export Excel : {str(e)}")
+        
         # Aperçu de la base de données mise à jour
         st.markdown("---")
         st.subheader("📊 Aperçu de la base de données")
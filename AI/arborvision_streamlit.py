@@ -121,11 +121,13 @@ try:
 except Exception:
     _EASYOCR_AVAILABLE = False
 
-try:
-    import RPi.GPIO as GPIO
-    _RPI_GPIO_AVAILABLE = True
-except Exception:
-    _RPI_GPIO_AVAILABLE = False
+from ocr_engine import get_ocr_engine
+from yolo_inference import yolo_predict
+from box_fusion import fuse_detections
+from model_client import get_model_client
+from tree_db import get_tree_db
+from capture_journal import get_capture_journal
+from sensor_sampler import get_sensor_sampler
 
 try:
     import pytesseract
@@ -162,22 +164,26 @@ def load_models():
     """
     yolo = None
     disease = None
+    # shared model server (model_server.py) when running, in-process models otherwise
+    client = get_model_client()
 
-    if _YOLO_AVAILABLE:
+    if client is not None or _YOLO_AVAILABLE:
+        load_yolo = client.yolo if client is not None else YOLO
         # prefer local weights if present
         for candidate in ("yolov8m.pt", "yolov8n.pt", "yolov8n-seg.pt", "yolov8m-seg.pt"):
             if os.path.exists(candidate):
                 try:
-                    yolo = YOLO(candidate)
+                    yolo = load_yolo(os.path.abspath(candidate))
                     break
                 except Exception:
                     yolo = None
 
-    if _TF_AVAILABLE:
+    if client is not None or _TF_AVAILABLE:
+        load_disease = client.disease if client is not None else load_model
         # try to load a saved Keras model if provided by the user
         if os.path.exists("plant_disease_pro_model.h5"):
             try:
-                disease = load_model("plant_disease_pro_model.h5")
+                disease = load_disease(os.path.abspath("plant_disease_pro_model.h5"))
             except Exception:
                 disease = None
 
@@ -187,9 +193,32 @@ def load_models():
 # load once
 yolo_model, disease_model = load_models()
 
-DB_PATH = "arbre_data.xlsx"
+
+@st.cache_resource
+def load_ocr_engine():
+    """Shared EasyOCR engine (French) loaded and warmed once per process,
+    reused by every session. Returns None when EasyOCR is unavailable.
+    """
+    client = get_model_client()
+    if client is not None:
+        try:
+            return client.ocr(('fr',))
+        except Exception:
+            pass
+    if not _EASYOCR_AVAILABLE:
+        return None
+    return get_ocr_engine(('fr',))
+
+
+# warm the OCR engine at startup so the first label scan does not pay model loading
+ocr_engine = load_ocr_engine()
+
+DB_PATH = "arbre_data.xlsx"          # Excel export / legacy import
+TREE_DB_PATH = "arbre_data.sqlite"   # working database
+DB_COLUMNS = ['id','name','type','gps','height_m','diameter_m','fruits_count','disease','timestamp']
 CAPTURES_DIR = "captures"
-CAPTURES_CSV = "captures_log.csv"
+CAPTURES_CSV = "captures_log.csv"                          # legacy log, read-only
+CAPTURES_LOG_DIR = os.path.join(CAPTURES_DIR, "log")        # append-only capture journal
 
 # ----------------------- Helpers -----------------------
 
@@ -236,7 +265,9 @@ def perform_ocr_from_image(pil_image: Image.Image):
     if _EASYOCR_AVAILABLE:
         try:
             # prefer French language for labels
-            reader = easyocr.Reader(['fr'], gpu=True)
+            reader = load_ocr_engine()
+            if reader is None:
+                raise RuntimeError('OCR engine unavailable')
             results = reader.readtext(np.array(pil_image),
                                       batch_size=4,
                                       text_threshold=0.3,
@@ -320,105 +351,32 @@ def perform_ocr_from_image(pil_image: Image.Image):
 
 
 def simulate_sensors():
-    # Read real sensors if available. Do NOT fabricate simulated values.
-    if _RPI_GPIO_AVAILABLE:
-        try:
-            real = read_sensors_real()
-            if isinstance(real, dict):
-                return real
-        except Exception:
-            # hardware read failed -> return None to indicate unavailable
-            return None
+    # Read real sensors if available. Do NOT fabricate simulated values
+    # (the simulated sampler backend is only used when ARBOR_SENSOR_BACKEND=sim).
+    try:
+        real = read_sensors_real()
+        if isinstance(real, dict):
+            return real
+    except Exception:
+        # hardware read failed -> return None to indicate unavailable
+        return None
 
     # Sensors not available on this platform -> return None (no simulated data)
     return None
 
 
 # ----- Raspberry Pi sensor helpers -----
-_GPIO_INITIALIZED = False
-_TRIG_PIN = 23
-_ECHO_PIN = 24
-_LASER_PIN = 2
-
-def _init_gpio():
-    global _GPIO_INITIALIZED
-    if _GPIO_INITIALIZED:
-        return
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(_TRIG_PIN, GPIO.OUT)
-    GPIO.setup(_ECHO_PIN, GPIO.IN)
-    GPIO.setup(_LASER_PIN, GPIO.IN)
-    # ensure trigger low
-    GPIO.output(_TRIG_PIN, False)
-    time.sleep(0.1)
-    _GPIO_INITIALIZED = True
-
-def _cleanup_gpio():
-    try:
-        GPIO.cleanup()
-    except Exception:
-        pass
-
-if _RPI_GPIO_AVAILABLE:
-    atexit.register(_cleanup_gpio)
-
-
-def get_ultrasonic_distance_once(timeout=0.02):
-    """Trigger the ultrasonic sensor and measure distance in meters.
-    Returns float meters or None on timeout/error.
-    timeout: max wait for echo in seconds (per phase)
-    """
-    try:
-        _init_gpio()
-        # trigger
-        GPIO.output(_TRIG_PIN, True)
-        time.sleep(0.00001)
-        GPIO.output(_TRIG_PIN, False)
-
-        start = time.time()
-        # wait for echo to go high
-        t0 = time.time()
-        while GPIO.input(_ECHO_PIN) == 0:
-            t1 = time.time()
-            if t1 - t0 > timeout:
-                return None
-            start = time.time()
-
-        # wait for echo to go low
-        t0 = time.time()
-        stop = time.time()
-        while GPIO.input(_ECHO_PIN) == 1:
-            t1 = time.time()
-            if t1 - t0 > timeout:
-                return None
-            stop = time.time()
-
-        elapsed = stop - start
-        # speed of sound ~34300 cm/s -> convert to meters
-        distance_cm = (elapsed * 34300) / 2
-        return round(distance_cm / 100.0, 2)
-    except Exception:
-        return None
-
+# The laser gate and the ultrasonic sensor are sampled continuously by a
+# background thread (sensor_sampler.py); the UI only reads the filtered value.
 
 def read_sensors_real():
-    """Read laser (boolean) and ultrasonic (meters) and return dict similar to simulator."""
-    _init_gpio()
-    try:
-        laser_state = GPIO.input(_LASER_PIN)
-    except Exception:
-        laser_state = 0
-
-    distance_m = None
-    if laser_state:
-        # if laser detects (beam interrupted) then measure distance
-        distance_m = get_ultrasonic_distance_once()
-
-    # If distance measurement failed, return None values so caller can decide.
-    if distance_m is None:
-        return {'ultrasound_m': None, 'laser_m': None}
-
-    return {'ultrasound_m': distance_m, 'laser_m': distance_m}
+    """Latest filtered laser/ultrasonic reading (meters) without blocking the UI thread.
+    Returns None when no sensor backend is available."""
+    sampler = get_sensor_sampler()
+    if sampler is None:
+        return None
+    reading = sampler.latest()
+    return {'ultrasound_m': reading['ultrasound_m'], 'laser_m': reading['laser_m']}
 
 
 # ----- Pi camera preview helper (single-frame) -----
@@ -620,14 +578,7 @@ def detect_fruits(image: Image.Image):
     # Prefer YOLO when available and the model provides names (custom fruit model best).
     if 'yolo_model' in globals() and yolo_model is not None:
         try:
-            tmp = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-            image.save(tmp.name)
-            results = yolo_model(tmp.name, imgsz=640, conf=0.2, verbose=False)
-            tmp.close()
-            try:
-                os.unlink(tmp.name)
-            except Exception:
-                pass
+            results = yolo_predict(yolo_model, image, imgsz=640, conf=0.2, verbose=False)
 
             detections = []
             if results and len(results) > 0:
@@ -645,6 +596,9 @@ def detect_fruits(image: Image.Image):
                             class_id, conf, xyxy, name = None, 0.0, [], None
                         detections.append({'name': name, 'class_id': class_id, 'confidence': conf, 'box': xyxy})
 
+            # one detection per fruit even when several classes fire on it
+            detections = fuse_detections(detections)
+
             # Strip class names for privacy/simplicity and return minimal estimate
             for d in detections:
                 d.pop('name', None)
@@ -723,6 +677,10 @@ def detect_fruits(image: Image.Image):
                 continue
             detections.append({'name': 'round_fruit', 'confidence': 0.4, 'box': [x-r, y-r, x+r, y+r], 'area': int(area), 'size_px': int(2*r), 'size_m': None})
 
+    # Overlapping colour ranges and Hough circles report the same fruit several
+    # times: fuse them so that min_count counts fruits, not detections
+    detections = fuse_detections(detections)
+
     # If calibration (px_per_m) is available in session, compute approximate sizes in meters
     try:
         px_per_m = st.session_state.get('px_per_m', None)
@@ -881,23 +839,22 @@ def detect_diseases(image: Image.Image):
             return {'status': 'Unknown', 'ratio': 0.0}
 
 
-def load_db(path=DB_PATH):
-    if not os.path.exists(path):
-        return pd.DataFrame(columns=['id','name','type','gps','height_m','diameter_m','fruits_count','disease','timestamp'])
+def get_db(path=TREE_DB_PATH):
+    # SQLite store; an existing Excel database is imported on first use
+    return get_tree_db(path, legacy_excel=DB_PATH, id_column='id')
+
+
+def load_db(path=TREE_DB_PATH):
     try:
-        return pd.read_excel(path)
+        return get_db(path).to_dataframe(id_column='id', columns=DB_COLUMNS)
     except Exception:
-        return pd.DataFrame(columns=['id','name','type','gps','height_m','diameter_m','fruits_count','disease','timestamp'])
+        return pd.DataFrame(columns=DB_COLUMNS)
 
 
-def save_entry(entry: dict, path=DB_PATH):
-    df = load_db(path)
-    # ensure id uniqueness: overwrite if exists
-    if entry['id'] in list(df['id']):
-        df = df[df['id'] != entry['id']]
-    df = pd.concat([df, pd.DataFrame([entry])], ignore_index=True)
-    df.to_excel(path, index=False)
-    return df
+def save_entry(entry: dict, path=TREE_DB_PATH):
+    # one atomic upsert (overwrites an existing id) + history row
+    fields = {k: v for k, v in entry.items() if k != 'id'}
+    return get_db(path).upsert(entry['id'], fields, merge=False)
 
 
 def get_db_bytes(df: pd.DataFrame):
@@ -908,9 +865,10 @@ def get_db_bytes(df: pd.DataFrame):
 
 
 def save_capture(image: Image.Image, sensors: dict, tree_id: str = None, extra: dict = None,
-                 captures_dir=CAPTURES_DIR, csv_path=CAPTURES_CSV):
-    """Save PIL image to captures_dir with a timestamped filename and append a CSV row
-    with sensors and optional metadata. Returns the saved filepath and the row dict.
+                 captures_dir=CAPTURES_DIR, log_dir=CAPTURES_LOG_DIR):
+    """Save PIL image to captures_dir with a timestamped filename and append a row
+    with sensors and optional metadata to the capture journal. Returns the saved
+    filepath and the row dict.
     """
     os.makedirs(captures_dir, exist_ok=True)
     ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -934,30 +892,20 @@ def save_capture(image: Image.Image, sensors: dict, tree_id: str = None, extra:
         for k, v in extra.items():
             row[k] = v
 
-    # append to CSV (create if missing)
+    # append to the capture journal (constant time; compacted to Parquet every few hundred rows)
     try:
-        if os.path.exists(csv_path):
-            df_existing = pd.read_csv(csv_path)
-            df = pd.concat([df_existing, pd.DataFrame([row])], ignore_index=True)
-        else:
-            df = pd.DataFrame([row])
-        df.to_csv(csv_path, index=False)
+        get_capture_journal(log_dir).append(row)
     except Exception:
-        # best-effort: write minimal CSV append
-        try:
-            import csv as _csv
-            write_header = not os.path.exists(csv_path)
-            with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-                writer = _csv.DictWriter(f, fieldnames=list(row.keys()))
-                if write_header:
-                    writer.writeheader()
-                writer.writerow(row)
-        except Exception:
-            pass
+        pass
 
     return filepath, row
 
 
+def load_captures(log_dir=CAPTURES_LOG_DIR, legacy_csv=CAPTURES_CSV):
+    """All captures (legacy CSV + compacted segments + journal tail) as a DataFrame."""
+    return get_capture_journal(log_dir).read(legacy_csv=legacy_csv)
+
+
 # ----------------------- UI -----------------------
 
 ensure_session()
@@ -978,10 +926,9 @@ if st.session_state.step == "home":
             st.session_state.step = 'existing'
             safe_rerun()
     st.markdown("\n---\n")
-    df_db = load_db()
-    st.write(f"Entrées en base: {len(df_db)}")
+    st.write(f"Entrées en base: {get_db().count()}")
     if st.button("Télécharger la base Excel"):
-        st.download_button("Télécharger Excel", data=get_db_bytes(df_db), file_name=DB_PATH, mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        st.download_button("Télécharger Excel", data=get_db_bytes(load_db()), file_name=DB_PATH, mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
 # ---------------- OCR PAGE ----------------
 elif st.session_state.step == 'ocr':
@@ -1027,7 +974,9 @@ elif st.session_state.step == 'ocr':
 
                 if _EASYOCR_AVAILABLE:
                     try:
-                        reader_local = easyocr.Reader(['fr'], gpu=True)
+                        reader_local = load_ocr_engine()
+                        if reader_local is None:
+                            raise RuntimeError('OCR engine unavailable')
                         results = reader_local.readtext(vis_image,
                                                         batch_size=4,
                                                         text_threshold=0.3,
@@ -1137,14 +1086,13 @@ elif st.session_state.step == 'ocr_review':
 # ---------------- Existing tree selection ----------------
 elif st.session_state.step == 'existing':
     st.header('Arbre existant')
-    df_db = load_db()
     tree_id = st.text_input('Entrez l\'ID de l\'arbre')
     if st.button('Charger'):
         # Always accept the provided ID and continue to analysis.
         # If the ID exists in the DB, prefill info; otherwise start with empty info for this ID.
         st.session_state.tree_id = tree_id
-        if 'id' in df_db.columns and tree_id in list(df_db['id']):
-            row = df_db[df_db['id'] == tree_id].iloc[0]
+        row = get_db().get(tree_id) if tree_id else None
+        if row is not None:
             st.session_state.tree_info = {'name': row.get('name'), 'type': row.get('type'), 'gps': row.get('gps')}
         else:
             st.session_state.tree_info = {'name': None, 'type': None, 'gps': None}
@@ -1428,7 +1376,7 @@ elif st.session_state.step == 'review':
     st.subheader('État maladies')
     st.write(analysis.get('disease', {}))
 
-    if st.button('💾 Sauvegarder dans Excel'):
+    if st.button('💾 Sauvegarder'):
         entry = {
             'id': st.session_state.tree_id,
             'name': info.get('name',''),
@@ -1440,9 +1388,8 @@ elif st.session_state.step == 'review':
             'disease': analysis.get('disease', {}).get('status'),
             'timestamp': datetime.datetime.now().isoformat()
         }
-        df = save_entry(entry)
+        save_entry(entry)
         st.success('✅ Enregistré')
-        st.download_button('Télécharger Excel', data=get_db_bytes(df), file_name=DB_PATH, mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
     if st.button('🔙 Nouvelle analyse'):
         st.session_state.step = 'home'
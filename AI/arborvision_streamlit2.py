@@ -115,6 +115,9 @@ import time
 import atexit
 import io as _io
 
+from fruit_lut import get_fruit_lut, detect_color_components
+from box_fusion import fuse_detections
+
 # Optional imports
 try:
     import easyocr
@@ -122,11 +125,15 @@ try:
 except Exception:
     _EASYOCR_AVAILABLE = False
 
-try:
-    import RPi.GPIO as GPIO
-    _RPI_GPIO_AVAILABLE = True
-except Exception:
-    _RPI_GPIO_AVAILABLE = False
+from ocr_engine import get_ocr_engine
+from yolo_inference import yolo_predict
+from model_client import get_model_client
+from tree_db import get_tree_db
+from capture_journal import get_capture_journal
+from sensor_sampler import get_sensor_sampler
+from camera_pool import get_camera
+from calibration_store import get_calibration_store, read_exif
+from camera_stream import CAMERA_SOURCE, StreamMeasurement
 
 try:
     import pytesseract
@@ -163,22 +170,26 @@ def load_models():
     """
     yolo = None
     disease = None
+    # shared model server (model_server.py) when running, in-process models otherwise
+    client = get_model_client()
 
-    if _YOLO_AVAILABLE:
+    if client is not None or _YOLO_AVAILABLE:
+        load_yolo = client.yolo if client is not None else YOLO
         # prefer local weights if present
         for candidate in ("yolov8m.pt", "yolov8n.pt", "yolov8n-seg.pt", "yolov8m-seg.pt"):
             if os.path.exists(candidate):
                 try:
-                    yolo = YOLO(candidate)
+                    yolo = load_yolo(os.path.abspath(candidate))
                     break
                 except Exception:
                     yolo = None
 
-    if _TF_AVAILABLE:
+    if client is not None or _TF_AVAILABLE:
+        load_disease = client.disease if client is not None else load_model
         # try to load a saved Keras model if provided by the user
         if os.path.exists("plant_disease_pro_model.h5"):
             try:
-                disease = load_model("plant_disease_pro_model.h5")
+                disease = load_disease(os.path.abspath("plant_disease_pro_model.h5"))
             except Exception:
                 disease = None
 
@@ -188,9 +199,32 @@ def load_models():
 # load once
 yolo_model, disease_model = load_models()
 
-DB_PATH = "arbre_data.xlsx"
+
+@st.cache_resource
+def load_ocr_engine():
+    """Shared EasyOCR engine (French) loaded and warmed once per process,
+    reused by every session. Returns None when EasyOCR is unavailable.
+    """
+    client = get_model_client()
+    if client is not None:
+        try:
+            return client.ocr(('fr',))
+        except Exception:
+            pass
+    if not _EASYOCR_AVAILABLE:
+        return None
+    return get_ocr_engine(('fr',))
+
+
+# warm the OCR engine at startup so the first label scan does not pay model loading
+ocr_engine = load_ocr_engine()
+
+DB_PATH = "arbre_data.xlsx"          # Excel export / legacy import
+TREE_DB_PATH = "arbre_data.sqlite"   # working database
+DB_COLUMNS = ['id','name','type','gps','height_m','diameter_m','fruits_count','disease','timestamp']
 CAPTURES_DIR = "captures"
-CAPTURES_CSV = "captures_log.csv"
+CAPTURES_CSV = "captures_log.csv"                          # legacy log, read-only
+CAPTURES_LOG_DIR = os.path.join(CAPTURES_DIR, "log")        # append-only capture journal
 
 # ----------------------- Helpers -----------------------
 
@@ -237,7 +271,9 @@ def perform_ocr_from_image(pil_image: Image.Image):
     if _EASYOCR_AVAILABLE:
         try:
             # prefer French language for labels
-            reader = easyocr.Reader(['fr'], gpu=True)
+            reader = load_ocr_engine()
+            if reader is None:
+                raise RuntimeError('OCR engine unavailable')
             results = reader.readtext(np.array(pil_image),
                                       batch_size=4,
                                       text_threshold=0.3,
@@ -321,147 +357,66 @@ def perform_ocr_from_image(pil_image: Image.Image):
 
 
 def simulate_sensors():
-    # Read real sensors if available. Do NOT fabricate simulated values.
-    if _RPI_GPIO_AVAILABLE:
-        try:
-            real = read_sensors_real()
-            if isinstance(real, dict):
-                return real
-        except Exception:
-            # hardware read failed -> return None to indicate unavailable
-            return None
+    # Read real sensors if available. Do NOT fabricate simulated values
+    # (the simulated sampler backend is only used when ARBOR_SENSOR_BACKEND=sim).
+    try:
+        real = read_sensors_real()
+        if isinstance(real, dict):
+            return real
+    except Exception:
+        # hardware read failed -> return None to indicate unavailable
+        return None
 
     # Sensors not available on this platform -> return None (no simulated data)
     return None
 
 
 # ----- Raspberry Pi sensor helpers -----
-_GPIO_INITIALIZED = False
-_TRIG_PIN = 23
-_ECHO_PIN = 24
-_LASER_PIN = 2
-
-def _init_gpio():
-    global _GPIO_INITIALIZED
-    if _GPIO_INITIALIZED:
-        return
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(_TRIG_PIN, GPIO.OUT)
-    GPIO.setup(_ECHO_PIN, GPIO.IN)
-    GPIO.setup(_LASER_PIN, GPIO.IN)
-    # ensure trigger low
-    GPIO.output(_TRIG_PIN, False)
-    time.sleep(0.1)
-    _GPIO_INITIALIZED = True
-
-def _cleanup_gpio():
-    try:
-        GPIO.cleanup()
-    except Exception:
-        pass
-
-if _RPI_GPIO_AVAILABLE:
-    atexit.register(_cleanup_gpio)
-
-
-def get_ultrasonic_distance_once(timeout=0.02):
-    """Trigger the ultrasonic sensor and measure distance in meters.
-    Returns float meters or None on timeout/error.
-    timeout: max wait for echo in seconds (per phase)
-    """
-    try:
-        _init_gpio()
-        # trigger
-        GPIO.output(_TRIG_PIN, True)
-        time.sleep(0.00001)
-        GPIO.output(_TRIG_PIN, False)
-
-        start = time.time()
-        # wait for echo to go high
-        t0 = time.time()
-        while GPIO.input(_ECHO_PIN) == 0:
-            t1 = time.time()
-            if t1 - t0 > timeout:
-                return None
-            start = time.time()
-
-        # wait for echo to go low
-        t0 = time.time()
-        stop = time.time()
-        while GPIO.input(_ECHO_PIN) == 1:
-            t1 = time.time()
-            if t1 - t0 > timeout:
-                return None
-            stop = time.time()
-
-        elapsed = stop - start
-        # speed of sound ~34300 cm/s -> convert to meters
-        distance_cm = (elapsed * 34300) / 2
-        return round(distance_cm / 100.0, 2)
-    except Exception:
-        return None
-
+# The laser gate and the ultrasonic sensor are sampled continuously by a
+# background thread (sensor_sampler.py); the UI only reads the filtered value.
 
 def read_sensors_real():
-    """Read laser (boolean) and ultrasonic (meters) and return dict similar to simulator."""
-    _init_gpio()
-    try:
-        laser_state = GPIO.input(_LASER_PIN)
-    except Exception:
-        laser_state = 0
-
-    distance_m = None
-    if laser_state:
-        # if laser detects (beam interrupted) then measure distance
-        distance_m = get_ultrasonic_distance_once()
-
-    # If distance measurement failed, return None values so caller can decide.
-    if distance_m is None:
-        return {'ultrasound_m': None, 'laser_m': None}
-
-    return {'ultrasound_m': distance_m, 'laser_m': distance_m}
+    """Latest filtered laser/ultrasonic reading (meters) without blocking the UI thread.
+    Returns None when no sensor backend is available."""
+    sampler = get_sensor_sampler()
+    if sampler is None:
+        return None
+    reading = sampler.latest()
+    return {'ultrasound_m': reading['ultrasound_m'], 'laser_m': reading['laser_m']}
 
 
 # ----- Pi camera preview helper (single-frame) -----
-def capture_pi_frame(device_index=0, timeout_s=2.0):
+def capture_pi_frame(device_index=CAMERA_SOURCE, timeout_s=2.0):
     """Capture one frame from a V4L2 device (Pi camera via /dev/video0) using OpenCV.
-    Returns a PIL.Image or None.
+    The device stays open between calls (camera_pool); a "file:<path>" source
+    serves frames from files instead. Returns a PIL.Image or None.
     """
+    stream = st.session_state.get('height_stream')
+    if stream is not None and stream.running:
+        # the continuous measurement owns the device: reuse its newest frame
+        _, bgr = stream.grabber.latest()
+        return None if bgr is None else Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
     try:
-        cap = cv2.VideoCapture(device_index, cv2.CAP_V4L)
+        cam = get_camera(device_index)
     except Exception:
-        try:
-            cap = cv2.VideoCapture(device_index)
-        except Exception:
-            return None
-
-    if not cap.isOpened():
-        try:
-            cap.release()
-        except Exception:
-            pass
         return None
-
-    t0 = time.time()
-    frame = None
-    while time.time() - t0 < timeout_s:
-        ret, f = cap.read()
-        if ret and f is not None:
-            frame = f
-            break
-        time.sleep(0.05)
-
-    try:
-        cap.release()
-    except Exception:
-        pass
-
+    frame = cam.capture(rgb=True, timeout_s=timeout_s)
     if frame is None:
         return None
+    stats = cam.stats()
+    st.session_state['camera_stats'] = stats
+    # PIL copies the view, so the ring buffer can be reused by the next capture
+    return Image.fromarray(frame)
 
-    # convert BGR to RGB and to PIL
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(rgb)
+
+def device_calibration(image: Image.Image, device_id=None):
+    """(key, Calibration) of the camera that took image, from its EXIF; stored once per device.
+
+    Frames without EXIF make/model (Pi camera, camera_input) are only keyed when
+    device_id says which camera took them; otherwise the key is None.
+    """
+    exif = read_exif(image.info.get('exif') or b'')
+    return get_calibration_store().for_exif(exif, image.width, image.height, device_id)
 
 
 def estimate_dimensions(image: Image.Image, sensors: dict):
@@ -470,6 +425,19 @@ def estimate_dimensions(image: Image.Image, sensors: dict):
     w_px = image.width
     px_per_m = st.session_state.get('px_per_m', None)
 
+    # Calibration persistante par appareil : px/m = (px/m à 1 m) / distance
+    distance = sensors.get('ultrasound_m') if sensors else None
+    if distance and distance > 0:
+        try:
+            cal_key, calib = device_calibration(image, st.session_state.get('tree_image_device'))
+            if px_per_m and px_per_m > 0 and cal_key is not None:
+                # calibration de session : mémorisée pour les prochaines mesures de cet appareil
+                get_calibration_store().put(cal_key, calib._replace(px_per_m_1m=px_per_m * distance, source="measured"))
+            elif calib.source != "default":
+                px_per_m = calib.px_per_m(distance)
+        except Exception:
+            pass
+
     # Initialize variables
     sensor_distance = None
     species = st.session_state.get('tree_info', {}).get('type', '')
@@ -1128,14 +1096,7 @@ def detect_fruits(image: Image.Image):
     # Prefer YOLO when available and the model provides names (custom fruit model best).
     if 'yolo_model' in globals() and yolo_model is not None:
         try:
-            tmp = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-            image.save(tmp.name)
-            results = yolo_model(tmp.name, imgsz=640, conf=0.2, verbose=False)
-            tmp.close()
-            try:
-                os.unlink(tmp.name)
-            except Exception:
-                pass
+            results = yolo_predict(yolo_model, image, imgsz=640, conf=0.2, verbose=False)
 
             detections = []
             if results and len(results) > 0:
@@ -1153,6 +1114,9 @@ def detect_fruits(image: Image.Image):
                             class_id, conf, xyxy, name = None, 0.0, [], None
                         detections.append({'name': name, 'class_id': class_id, 'confidence': conf, 'box': xyxy})
 
+            # one detection per fruit even when several classes fire on it
+            detections = fuse_detections(detections)
+
             # Strip class names for privacy/simplicity and return minimal estimate
             for d in detections:
                 d.pop('name', None)
@@ -1172,41 +1136,35 @@ def detect_fruits(image: Image.Image):
     detections = []
     min_area = max(50, (img.shape[0] * img.shape[1]) // 20000)  # adaptive min area
 
-    for fname, (lower, upper) in fruit_masks.items():
+    # Single LUT pass classifies every pixel for all enabled fruits at once
+    # (the LUT is rebuilt only when the configs change), then the combined mask
+    # is cleaned and labelled once instead of once per fruit type.
+    if fruit_masks:
         try:
-            mask = cv2.inRange(hsv, lower, upper)
-            # morphological clean
-            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5,5))
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-
-            # find contours
-            cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for c in cnts:
-                area = cv2.contourArea(c)
-                if area < min_area:
-                    continue
-                perimeter = cv2.arcLength(c, True)
-                if perimeter <= 0:
-                    continue
-                circularity = 4 * np.pi * area / (perimeter * perimeter)
+            fruit_lut = get_fruit_lut(fruit_masks)
+            for comp in detect_color_components(hsv, fruit_lut, min_area):
+                names = comp['names']
+                area = comp['area']
+                circularity = comp['circularity']
                 # allow elongated fruits too (mango, banana) so relax circularity
-                if circularity < 0.15 and fname.lower().find('mango') == -1 and fname.lower().find('banana') == -1:
+                elongated = any('mango' in n.lower() or 'banana' in n.lower() for n in names)
+                if circularity < 0.15 and not elongated:
                     continue
 
-                x, y, w_box, h_box = cv2.boundingRect(c)
+                x0, y0, x1, y1 = comp['box']
                 conf = min(0.95, 0.5 + (area / (img.shape[0]*img.shape[1])))
                 detections.append({
-                    'name': fname,
+                    'name': names[0],
+                    'candidates': names,
                     'confidence': float(conf),
-                    'box': [int(x), int(y), int(x+w_box), int(y+h_box)],
+                    'box': [x0, y0, x1, y1],
                     'area': int(area),
                     'circularity': float(circularity),
-                    'size_px': int(max(w_box, h_box)),
+                    'size_px': int(max(x1 - x0, y1 - y0)),
                     'size_m': None
                 })
         except Exception:
-            continue
+            pass
 
     # As additional heuristic, try Hough circles for round fruits (apple, cherry, blueberry etc.)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -1222,6 +1180,10 @@ def detect_fruits(image: Image.Image):
                 continue
             detections.append({'name': 'round_fruit', 'confidence': 0.4, 'box': [x-r, y-r, x+r, y+r], 'area': int(area), 'size_px': int(2*r), 'size_m': None})
 
+    # Overlapping colour ranges and Hough circles report the same fruit several
+    # times: fuse them so that min_count counts fruits, not detections
+    detections = fuse_detections(detections)
+
     # If calibration (px_per_m) is available in session, compute approximate sizes in meters
     try:
         px_per_m = st.session_state.get('px_per_m', None)
@@ -1242,6 +1204,7 @@ def detect_fruits(image: Image.Image):
     # Final simplified output: presence flag and minimal count, remove detailed class names
     for d in detections:
         d.pop('name', None)
+        d.pop('candidates', None)
     min_count = len(detections)
     return {'presence': bool(min_count), 'min_count': min_count, 'detections': detections}
 
@@ -1295,43 +1258,43 @@ def detect_diseases(image: Image.Image):
         total_lesion = 0
         lesion_areas = []
 
-        # Process connected leaf components separately to avoid background influence
+        # Per-component statistics in one pass over the label image (no per-component
+        # full-frame copies): LAB mean per label via bincount, per-pixel distance to
+        # its own label mean, then mean/std of that distance per label.
         num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats((leaf_mask > 0).astype('uint8'), connectivity=8)
         min_leaf_comp = max(200, (h * w) // 10000)
-        for lab_id in range(1, num_labels):
-            x, y, w_box, h_box, area = stats[lab_id]
-            if area < min_leaf_comp:
-                continue
-            comp_mask = (labels == lab_id).astype('uint8') * 255
-
-            # compute LAB mean for this component and per-pixel distance
-            mean_lab = cv2.mean(lab, mask=comp_mask)[:3]
-            mean_lab = np.array(mean_lab, dtype='float32')
-            # extract dist only inside component
-            comp_lab = lab.copy()
-            diff = comp_lab - mean_lab.reshape((1, 1, 3))
-            dist = np.sqrt(np.sum(diff * diff, axis=2))
-            dist_comp = dist[comp_mask > 0]
-            if dist_comp.size == 0:
-                continue
+        comp_area = stats[:, cv2.CC_STAT_AREA]
+        valid = comp_area >= min_leaf_comp
+        valid[0] = False
+        if num_labels > 1 and valid.any():
+            lbl = labels.ravel()
+            counts = np.maximum(np.bincount(lbl, minlength=num_labels), 1).astype('float64')
+            lab_flat = lab.reshape(-1, 3)
+            mean_lab = np.stack([np.bincount(lbl, weights=lab_flat[:, c], minlength=num_labels) / counts
+                                 for c in range(3)], axis=1).astype('float32')
+            diff = lab_flat - mean_lab[lbl]
+            dist = np.sqrt(np.sum(diff * diff, axis=1))
+            dist_mean = np.bincount(lbl, weights=dist, minlength=num_labels) / counts
+            dist_sq = np.bincount(lbl, weights=dist * dist, minlength=num_labels) / counts
+            dist_std = np.sqrt(np.maximum(dist_sq - dist_mean * dist_mean, 0.0))
 
             # adaptive threshold: mean + k * std, with a sensible minimum
-            thresh = float(np.mean(dist_comp) + max(6.0, 0.8 * np.std(dist_comp)))
-            thresh = max(thresh, 10.0)
+            thresh = np.maximum(dist_mean + np.maximum(6.0, 0.8 * dist_std), 10.0)
 
-            lesion_mask_comp = (dist > thresh).astype('uint8') * 255
-            # keep only within component
-            lesion_mask_comp = cv2.bitwise_and(lesion_mask_comp, comp_mask)
+            valid_px = valid[labels]
+            lesion_mask = ((dist.reshape(h, w) > thresh[labels]) & valid_px).astype('uint8') * 255
 
-            # clean small noise
+            # clean small noise, then drop anything bridged outside the leaf components
             k2 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (max(3, ksize), max(3, ksize)))
-            lesion_mask_comp = cv2.morphologyEx(lesion_mask_comp, cv2.MORPH_OPEN, k2)
-            lesion_mask_comp = cv2.morphologyEx(lesion_mask_comp, cv2.MORPH_CLOSE, k2)
+            lesion_mask = cv2.morphologyEx(lesion_mask, cv2.MORPH_OPEN, k2)
+            lesion_mask = cv2.morphologyEx(lesion_mask, cv2.MORPH_CLOSE, k2)
+            lesion_mask[~valid_px] = 0
 
-            # find contours for lesions in this component
-            cnts, _ = cv2.findContours(lesion_mask_comp, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cnts, _ = cv2.findContours(lesion_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             for c in cnts:
                 a = cv2.contourArea(c)
+                px, py = c[0, 0]
+                area = comp_area[labels[py, px]]
                 # require lesions to be a reasonable fraction of leaf comp area
                 if a < max(20, area * 0.002):
                     continue
@@ -1380,23 +1343,22 @@ def detect_diseases(image: Image.Image):
             return {'status': 'Unknown', 'ratio': 0.0}
 
 
-def load_db(path=DB_PATH):
-    if not os.path.exists(path):
-        return pd.DataFrame(columns=['id','name','type','gps','height_m','diameter_m','fruits_count','disease','timestamp'])
+def get_db(path=TREE_DB_PATH):
+    # SQLite store; an existing Excel database is imported on first use
+    return get_tree_db(path, legacy_excel=DB_PATH, id_column='id')
+
+
+def load_db(path=TREE_DB_PATH):
     try:
-        return pd.read_excel(path)
+        return get_db(path).to_dataframe(id_column='id', columns=DB_COLUMNS)
     except Exception:
-        return pd.DataFrame(columns=['id','name','type','gps','height_m','diameter_m','fruits_count','disease','timestamp'])
+        return pd.DataFrame(columns=DB_COLUMNS)
 
 
-def save_entry(entry: dict, path=DB_PATH):
-    df = load_db(path)
-    # ensure id uniqueness: overwrite if exists
-    if entry['id'] in list(df['id']):
-        df = df[df['id'] != entry['id']]
-    df = pd.concat([df, pd.DataFrame([entry])], ignore_index=True)
-    df.to_excel(path, index=False)
-    return df
+def save_entry(entry: dict, path=TREE_DB_PATH):
+    # one atomic upsert (overwrites an existing id) + history row
+    fields = {k: v for k, v in entry.items() if k != 'id'}
+    return get_db(path).upsert(entry['id'], fields, merge=False)
 
 
 def get_db_bytes(df: pd.DataFrame):
@@ -1407,9 +1369,10 @@ def get_db_bytes(df: pd.DataFrame):
 
 
 def save_capture(image: Image.Image, sensors: dict, tree_id: str = None, extra: dict = None,
-                 captures_dir=CAPTURES_DIR, csv_path=CAPTURES_CSV):
-    """Save PIL image to captures_dir with a timestamped filename and append a CSV row
-    with sensors and optional metadata. Returns the saved filepath and the row dict.
+                 captures_dir=CAPTURES_DIR, log_dir=CAPTURES_LOG_DIR):
+    """Save PIL image to captures_dir with a timestamped filename and append a row
+    with sensors and optional metadata to the capture journal. Returns the saved
+    filepath and the row dict.
     """
     os.makedirs(captures_dir, exist_ok=True)
     ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -1433,30 +1396,20 @@ def save_capture(image: Image.Image, sensors: dict, tree_id: str = None, extra:
         for k, v in extra.items():
             row[k] = v
 
-    # append to CSV (create if missing)
+    # append to the capture journal (constant time; compacted to Parquet every few hundred rows)
     try:
-        if os.path.exists(csv_path):
-            df_existing = pd.read_csv(csv_path)
-            df = pd.concat([df_existing, pd.DataFrame([row])], ignore_index=True)
-        else:
-            df = pd.DataFrame([row])
-        df.to_csv(csv_path, index=False)
+        get_capture_journal(log_dir).append(row)
     except Exception:
-        # best-effort: write minimal CSV append
-        try:
-            import csv as _csv
-            write_header = not os.path.exists(csv_path)
-            with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-                writer = _csv.DictWriter(f, fieldnames=list(row.keys()))
-                if write_header:
-                    writer.writeheader()
-                writer.writerow(row)
-        except Exception:
-            pass
+        pass
 
     return filepath, row
 
 
+def load_captures(log_dir=CAPTURES_LOG_DIR, legacy_csv=CAPTURES_CSV):
+    """All captures (legacy CSV + compacted segments + journal tail) as a DataFrame."""
+    return get_capture_journal(log_dir).read(legacy_csv=legacy_csv)
+
+
 # ----------------------- UI -----------------------
 
 ensure_session()
@@ -1481,10 +1434,9 @@ if st.session_state.step == "home":
             st.session_state.step = 'fruit_config'
             safe_rerun()
     st.markdown("\n---\n")
-    df_db = load_db()
-    st.write(f"Entrées en base: {len(df_db)}")
+    st.write(f"Entrées en base: {get_db().count()}")
     if st.button("Télécharger la base Excel"):
-        st.download_button("Télécharger Excel", data=get_db_bytes(df_db), file_name=DB_PATH, mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        st.download_button("Télécharger Excel", data=get_db_bytes(load_db()), file_name=DB_PATH, mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
 # ---------------- OCR PAGE ----------------
 elif st.session_state.step == 'ocr':
@@ -1530,7 +1482,9 @@ elif st.session_state.step == 'ocr':
 
                 if _EASYOCR_AVAILABLE:
                     try:
-                        reader_local = easyocr.Reader(['fr'], gpu=True)
+                        reader_local = load_ocr_engine()
+                        if reader_local is None:
+                            raise RuntimeError('OCR engine unavailable')
                         results = reader_local.readtext(vis_image,
                                                         batch_size=4,
                                                         text_threshold=0.3,
@@ -1640,14 +1594,13 @@ elif st.session_state.step == 'ocr_review':
 # ---------------- Existing tree selection ----------------
 elif st.session_state.step == 'existing':
     st.header('Arbre existant')
-    df_db = load_db()
     tree_id = st.text_input('Entrez l\'ID de l\'arbre')
     if st.button('Charger'):
         # Always accept the provided ID and continue to analysis.
         # If the ID exists in the DB, prefill info; otherwise start with empty info for this ID.
         st.session_state.tree_id = tree_id
-        if 'id' in df_db.columns and tree_id in list(df_db['id']):
-            row = df_db[df_db['id'] == tree_id].iloc[0]
+        row = get_db().get(tree_id) if tree_id else None
+        if row is not None:
             st.session_state.tree_info = {'name': row.get('name'), 'type': row.get('type'), 'gps': row.get('gps')}
         else:
             st.session_state.tree_info = {'name': None, 'type': None, 'gps': None}
@@ -1916,11 +1869,13 @@ elif st.session_state.step == 'analysis':
     # Pi camera inline preview with overlay (single-frame) - use if /dev/video0 is available
     st.markdown("**Aperçu direct Pi Camera :**")
     col_preview, col_camin = st.columns([1,1])
-    pi_frame = None
+    # the preview frame lives in the session: the "use this photo" button is clicked on a later run
+    pi_frame = st.session_state.get('pi_frame')
     with col_preview:
         st.write("Aperçu (cliquez 'Refresh preview' pour capturer une image) :")
         if st.button('Refresh preview'):
             pi_frame = capture_pi_frame()
+            st.session_state['pi_frame'] = pi_frame
             if pi_frame is None:
                 st.warning('Aucune image capturée depuis la caméra Pi')
             else:
@@ -1930,6 +1885,10 @@ elif st.session_state.step == 'analysis':
                 pdraw = ImageDraw.Draw(pv)
                 pdraw.rectangle((int(pw*0.15), int(ph*0.05), int(pw*0.85), int(ph*0.95)), outline='red', width=5)
                 st.image(pv, use_column_width=True)
+                cs = st.session_state.get('camera_stats') or {}
+                if cs:
+                    st.caption(f"Capture : {cs['last_latency_ms']} ms (moyenne {cs['mean_latency_ms']} ms), "
+                               f"ouverture caméra {cs['open_ms']} ms, {cs['dropped']} lecture(s) perdue(s)")
         else:
             st.info('Appuyez sur Refresh preview pour capturer une image de la caméra Pi')
 
@@ -1939,20 +1898,60 @@ elif st.session_state.step == 'analysis':
         if tree_img_file is None:
             tree_img_file = st.file_uploader('Ou téléversez la photo de l\'arbre', type=['jpg','png','jpeg'])
 
+    # Mesure continue : la caméra reste ouverte, une image sur N est mesurée et les hauteurs fusionnées
+    with st.expander("📹 Mesure continue (flux caméra)"):
+        stream = st.session_state.get('height_stream')
+        c_start, c_stop = st.columns(2)
+        with c_start:
+            if st.button('Démarrer la mesure continue') and (stream is None or not stream.running):
+                try:
+                    stream = StreamMeasurement(CAMERA_SOURCE).start()
+                    st.session_state['height_stream'] = stream
+                except Exception as e:
+                    st.warning(f"Flux caméra indisponible : {e}")
+                    stream = None
+        with c_stop:
+            if st.button('Arrêter la mesure continue') and stream is not None:
+                stream.stop()
+        if stream is not None:
+            est = stream.estimate()
+            etat = "convergée ✅" if est['converged'] else ("en cours…" if stream.running else "arrêtée")
+            st.write(f"Estimation {etat} — {est['samples']} mesures retenues, "
+                     f"{est['processed']}/{est['frames']} images analysées, {est['dropped']} ignorées")
+            if est['px_height']:
+                px_per_m = st.session_state.get('px_per_m')
+                if px_per_m and px_per_m > 0:
+                    st.metric("Hauteur fusionnée", f"{est['px_height'] / px_per_m:.2f} m",
+                              help=f"{est['px_height']:.0f} px ± {est['spread_px']:.1f} px")
+                else:
+                    st.metric("Hauteur fusionnée (pixels)", f"{est['px_height']:.0f} px")
+                    st.caption("Calibrez px/m pour obtenir la hauteur en mètres.")
+            if stream.last_frame is not None and st.button('Utiliser la dernière image du flux'):
+                pi_frame = Image.fromarray(stream.last_frame)
+                st.session_state['pi_frame'] = pi_frame
+            if st.button('🔄 Actualiser la mesure'):
+                safe_rerun()
+
     # If the user used Pi preview and clicked Use this photo, allow using that image
     if 'use_preview' not in st.session_state:
         st.session_state.use_preview = False
 
-    # show Use this preview button if a pi_frame exists in this run
+    # show Use this preview button if a preview or stream frame was kept in the session
     if pi_frame is not None:
         if st.button('Utiliser cette photo depuis la preview'):
-            # convert to bytes-like so it behaves like uploaded file
+            # JPEG bytes kept in the session so the photo survives the following reruns
             buf = _io.BytesIO()
             pi_frame.save(buf, format='JPEG')
-            buf.seek(0)
-            tree_img_file = buf
+            st.session_state['preview_jpeg'] = buf.getvalue()
             st.session_state.use_preview = True
 
+    # camera_input / upload take precedence over the preview photo; only the Pi
+    # camera frames are known to come from CAMERA_SOURCE (calibration device id)
+    st.session_state['tree_image_device'] = None
+    if tree_img_file is None and st.session_state.use_preview and st.session_state.get('preview_jpeg'):
+        tree_img_file = _io.BytesIO(st.session_state['preview_jpeg'])
+        st.session_state['tree_image_device'] = str(CAMERA_SOURCE)
+
     if tree_img_file is not None:
         # tree_img_file may be a stream/buffer or UploadFile; handle both
         if isinstance(tree_img_file, bytes) or hasattr(tree_img_file, 'read'):
@@ -2193,7 +2192,7 @@ elif st.session_state.step == 'review':
     st.subheader('État maladies')
     st.write(analysis.get('disease', {}))
 
-    if st.button('💾 Sauvegarder dans Excel'):
+    if st.button('💾 Sauvegarder'):
         entry = {
             'id': st.session_state.tree_id,
             'name': info.get('name',''),
@@ -2205,9 +2204,8 @@ elif st.session_state.step == 'review':
             'disease': analysis.get('disease', {}).get('status'),
             'timestamp': datetime.datetime.now().isoformat()
         }
-        df = save_entry(entry)
+        save_entry(entry)
         st.success('✅ Enregistré')
-        st.download_button('Télécharger Excel', data=get_db_bytes(df), file_name=DB_PATH, mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
     if st.button('🔙 Nouvelle analyse'):
         st.session_state.step = 'home'
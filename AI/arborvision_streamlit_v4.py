@@ -13,7 +13,6 @@ from streamlit.components.v1 import html
 
 # Import functions from arbresV4.py
 from arbresv4 import (
-    load_image,
     segment_tree_multi_approach,
     detect_tree_extremes,
     estimate_height_and_dbh,
@@ -46,6 +45,10 @@ try:
 except ImportError:
     DEPTH_AVAILABLE = False
 
+from depth_models import DEFAULT_DEPTH_MODEL, DEFAULT_DEPTH_DEVICE, DEPTH_MODEL_TYPES, get_depth_model
+from model_client import get_model_client
+from measurement_session import get_measurement_session
+
 # Import trigonometric calculation function
 from trigonometric_calculator import calculate_real_tree_height_with_distance# Set up logging
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
@@ -58,76 +61,32 @@ st.set_page_config(
     layout="wide"
 )
 
-# Global variables for Midas model
-midas_model = None
-midas_transforms = None
-
-def load_midas_model():
-    """Load Midas model for depth estimation"""
-    global midas_model, midas_transforms
+def load_midas_model(model_type: str = DEFAULT_DEPTH_MODEL):
+    """Load Midas model for depth estimation from the local model store"""
+    try:
+        return get_depth_model(model_type, DEFAULT_DEPTH_DEVICE)
+    except Exception as e:
+        log.error(f"Failed to load Midas model: {e}")
+        return None
 
-    if midas_model is None:
+def estimate_depth_with_midas(img_rgb: np.ndarray, model_type: str = DEFAULT_DEPTH_MODEL) -> Optional[np.ndarray]:
+    """Estimate depth using Midas model"""
+    client = get_model_client()
+    if client is not None:
         try:
-            # Import Midas components
-            from torchvision.transforms import Compose
-            from midas.dpt_depth import DPTDepthModel
-            from midas.transforms import Resize, NormalizeImage, PrepareForNet
-
-            # Load model
-            model_path = "midas_weights/dpt_large-midas-2f21e586.pt"
-            if not os.path.exists(model_path):
-                # Try to download the model if not present
-                import urllib.request
-                os.makedirs("midas_weights", exist_ok=True)
-                url = "https://github.com/isl-org/MiDaS/releases/download/v3_1/dpt_large-midas-2f21e586.pt"
-                urllib.request.urlretrieve(url, model_path)
-
-            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            midas_model = DPTDepthModel(
-                path=model_path,
-                backbone="vitl16_384",
-                non_negative=True,
-            )
-            midas_model.to(device)
-            midas_model.eval()
-
-            # Load transforms
-            midas_transforms = Compose([
-                lambda img: {"image": img / 255.0},
-                Resize(
-                    384, 384,
-                    resize_target=None,
-                    keep_aspect_ratio=True,
-                    ensure_multiple_of=32,
-                    resize_method="minimal",
-                    image_interpolation_method=cv2.INTER_CUBIC,
-                ),
-                NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-                PrepareForNet(),
-            ])
-
-            log.info("Midas model loaded successfully")
-            return True
-
+            depth_map = client.depth(img_rgb, model_type, DEFAULT_DEPTH_DEVICE)
+            return cv2.normalize(depth_map, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
         except Exception as e:
-            log.error(f"Failed to load Midas model: {e}")
-            return False
-
-    return True
+            log.warning(f"Model server depth failed, using the local model: {e}")
 
-def estimate_depth_with_midas(img_rgb: np.ndarray) -> Optional[np.ndarray]:
-    """Estimate depth using Midas model"""
-    if not load_midas_model():
+    loaded = load_midas_model(model_type)
+    if loaded is None:
         return None
+    midas_model, midas_transform = loaded
 
     try:
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
         # Prepare input
-        img_input = midas_transforms({"image": img_rgb})["image"]
-
-        # Convert to tensor and move to device
-        img_tensor = torch.from_numpy(img_input).to(device).unsqueeze(0)
+        img_tensor = midas_transform(img_rgb).to(DEFAULT_DEPTH_DEVICE)
 
         with torch.no_grad():
             prediction = midas_model(img_tensor)
@@ -156,12 +115,12 @@ def calculate_depth_based_scale(depth_map: np.ndarray, tree_mask: np.ndarray, kn
     """Calculate pixels per meter using depth information and known reference height"""
     if depth_map is None or tree_mask is None:
         return None
+    return scale_from_depth_samples(depth_map[tree_mask > 0], known_height_m)
 
+def scale_from_depth_samples(tree_depths: np.ndarray, known_height_m: float = 1.7) -> float:
+    """calculate_depth_based_scale on the depth values already sampled inside the tree mask"""
     try:
-        # Get depth values in the tree region
-        tree_depths = depth_map[tree_mask > 0]
-
-        if len(tree_depths) == 0:
+        if tree_depths is None or len(tree_depths) == 0:
             return None
 
         # Calculate average depth of the tree
@@ -308,8 +267,14 @@ def main():
     # Depth estimation option
     use_depth_estimation = st.sidebar.checkbox("Use depth estimation (Midas)", False)
     camera_height = None
+    depth_model_type = DEFAULT_DEPTH_MODEL
     if use_depth_estimation:
         camera_height = st.sidebar.number_input("Camera height (m)", 1.0, 3.0, 1.7, 0.1)
+        depth_model_type = st.sidebar.selectbox(
+            "Depth model", list(DEPTH_MODEL_TYPES),
+            index=list(DEPTH_MODEL_TYPES).index(DEFAULT_DEPTH_MODEL),
+            help="MiDaS_small is recommended on CPU; models are loaded from the local store only"
+        )
     
     # Trigonometric distance measurement
     st.sidebar.header("📏 Distance Measurement")
@@ -413,19 +378,18 @@ def main():
             try:
                 # Get image data
                 if uploaded_file is not None:
-                    image_data = uploaded_file.read()
+                    image_data = uploaded_file.getvalue()
                     image_source = "upload"
                 else:
-                    image_data = camera_image.read()
+                    image_data = camera_image.getvalue()
                     image_source = "camera"
                 
-                # Create a temporary file to process with OpenCV
-                temp_file = f"temp_{int(time.time())}.jpg"
-                with open(temp_file, "wb") as f:
-                    f.write(image_data)
-                
-                # Load and process image
-                img_bgr, img_rgb, H, W = load_image(temp_file, max_side=max_size)
+                # Per-image session: decode, mask, depth and extremes are computed once
+                # per image and per upstream setting, so a change of scale, camera height
+                # or angles only redoes the final arithmetic on rerun
+                session = get_measurement_session(image_data)
+                loaded = session.image(max_size)
+                img_bgr, img_rgb, H, W = loaded.bgr, loaded.rgb, loaded.height, loaded.width
                 
                 # Display original image
                 with col1:
@@ -435,80 +399,89 @@ def main():
                 # Depth estimation with Midas (if enabled)
                 depth_map = None
                 depth_based_ppm = None
+                depth_params = None
                 if use_depth_estimation:
                     with st.spinner("Estimating depth with Midas..."):
-                        depth_map = estimate_depth_with_midas(img_rgb)
+                        depth_params = depth_model_type
+                        depth_map = session.depth(
+                            depth_params, lambda rgb: estimate_depth_with_midas(rgb, depth_model_type), max_size
+                        )
                         if depth_map is not None:
                             st.success("Depth estimation completed!")
                         else:
                             st.warning("Depth estimation failed. Using fallback methods.")
                 
                 # Perform segmentation based on selected method and model
-                if segmentation_method == "Color-based":
-                    tree_mask = create_vegetation_mask_by_color(img_rgb)
-                    if tree_mask is None:
-                        st.error("No tree detected with color-based segmentation.")
-                        return
-                    tree_mask = refine_tree_mask(tree_mask, img_rgb)
-                elif segmentation_method == "Mask R-CNN (if available)":
-                    if torch.cuda.is_available():
-                        device = "cuda"
-                    else:
-                        device = "cpu"
-                    tree_mask = try_maskrcnn_segmentation(img_rgb, device=device)
-                    if tree_mask is None:
-                        st.error("No tree detected with Mask R-CNN segmentation.")
-                        return
-                    tree_mask = refine_tree_mask(tree_mask, img_rgb)
-                elif segmentation_method == "Shape-based":
-                    tree_mask = create_fallback_mask(img_rgb)
-                    if tree_mask is None:
-                        st.error("No tree detected with shape-based segmentation.")
-                        return
-                    tree_mask = refine_tree_mask(tree_mask, img_rgb)
-                else:  # Auto (best available)
-                    if analysis_model == "Enhanced":
-                        tree_mask = segment_tree_multi_approach_enhanced(img_rgb, device="cpu")
+                def segment(rgb):
+                    if segmentation_method == "Color-based":
+                        m = create_vegetation_mask_by_color(rgb)
+                    elif segmentation_method == "Mask R-CNN (if available)":
+                        device = "cuda" if torch.cuda.is_available() else "cpu"
+                        m = try_maskrcnn_segmentation(rgb, device=device)
+                    elif segmentation_method == "Shape-based":
+                        m = create_fallback_mask(rgb)
+                    elif analysis_model == "Enhanced":
+                        return segment_tree_multi_approach_enhanced(rgb, device="cpu")
                     elif analysis_model == "Depth-guided":
-                        tree_mask = segment_tree_multi_approach_depth(img_rgb, device="cpu")
+                        return segment_tree_multi_approach_depth(rgb, device="cpu")
                     else:  # Standard
-                        tree_mask = segment_tree_multi_approach(img_rgb, device="cpu")
+                        return segment_tree_multi_approach(rgb, device="cpu")
+                    return None if m is None else refine_tree_mask(m, rgb)
+                
+                seg_params = (segmentation_method, analysis_model if segmentation_method.startswith("Auto") else None)
+                tree_mask = session.mask(seg_params, segment, max_size)
+                if tree_mask is None:
+                    labels = {"Color-based": "color-based", "Mask R-CNN (if available)": "Mask R-CNN", "Shape-based": "shape-based"}
+                    st.error(f"No tree detected with {labels.get(segmentation_method, 'automatic')} segmentation.")
+                    return
                 
                 # Display mask
                 with col2:
                     st.subheader("Tree Segmentation")
-                    mask_display = np.zeros_like(img_rgb)
-                    mask_display[tree_mask > 0] = [0, 255, 0]  # Green mask
-                    alpha = 0.5
-                    overlay = cv2.addWeighted(img_rgb, 1-alpha, mask_display, alpha, 0)
+                    def mask_overlay():
+                        mask_display = np.zeros_like(img_rgb)
+                        mask_display[tree_mask > 0] = [0, 255, 0]  # Green mask
+                        alpha = 0.5
+                        return cv2.addWeighted(img_rgb, 1-alpha, mask_display, alpha, 0)
+                    overlay = session.stage("mask_overlay", (max_size, seg_params), mask_overlay)
                     st.image(overlay, channels="RGB", use_column_width=True)
                 
                 # Display depth map if available
                 if depth_map is not None:
                     st.subheader("Depth Map")
                     # Apply colormap to depth map for better visualization
-                    depth_colored = cv2.applyColorMap(depth_map, cv2.COLORMAP_JET)
+                    depth_colored = session.stage("depth_colored", (max_size, depth_params),
+                                                  lambda: cv2.applyColorMap(depth_map, cv2.COLORMAP_JET))
                     st.image(depth_colored, channels="BGR", use_column_width=True)
                     
-                    # Calculate depth-based scale
+                    # Calculate depth-based scale (depth samples inside the mask are kept in the session)
                     if camera_height is not None:
-                        depth_based_ppm = calculate_depth_based_scale(depth_map, tree_mask, camera_height)
+                        tree_depths = session.stage("depth_samples", (max_size, seg_params, depth_params),
+                                                    lambda: depth_map[tree_mask > 0])
+                        depth_based_ppm = scale_from_depth_samples(tree_depths, camera_height)
                         if depth_based_ppm is not None:
                             st.info(f"Depth-based scale: {depth_based_ppm:.1f} pixels/meter")
                 
                 # Detect tree extremes based on selected model
-                if analysis_model == "Enhanced":
-                    (base_x, base_y), (top_x, top_y) = detect_tree_extremes_pca(tree_mask)
-                elif analysis_model == "Depth-guided":
-                    # Use depth-guided detection if depth map is available
-                    if depth_map is not None:
-                        (base_x, base_y), (top_x, top_y) = detect_tree_extremes_pca(tree_mask)
-                        (base_x, base_y), (top_x, top_y) = refine_extremes_with_depth(tree_mask, (base_x, base_y), (top_x, top_y), depth_map)
-                        st.info("Depth-guided extreme refinement applied!")
-                    else:
-                        (base_x, base_y), (top_x, top_y) = detect_tree_extremes_pca(tree_mask)
-                else:  # Standard
-                    (base_x, base_y), (top_x, top_y) = detect_tree_extremes(tree_mask)
+                def extremes():
+                    if analysis_model == "Enhanced":
+                        return detect_tree_extremes_pca(tree_mask)
+                    if analysis_model == "Depth-guided":
+                        # Use depth-guided detection if depth map is available
+                        base, top = detect_tree_extremes_pca(tree_mask)
+                        if depth_map is not None:
+                            base, top = refine_extremes_with_depth(tree_mask, base, top, depth_map)
+                        return base, top
+                    return detect_tree_extremes(tree_mask)  # Standard
+                
+                # keyed on whether depth was available: depth-less extremes must not be
+                # reused once a retried depth estimate succeeds
+                (base_x, base_y), (top_x, top_y) = session.stage(
+                    "extremes", (max_size, seg_params, analysis_model, depth_params if depth_map is not None else None),
+                    extremes
+                )
+                if analysis_model == "Depth-guided" and depth_map is not None:
+                    st.info("Depth-guided extreme refinement applied!")
                 
                 # Calculate pixel height
                 pixel_height = abs(top_y - base_y)
@@ -588,15 +561,13 @@ def main():
                         mime="image/jpeg",
                     )
                 
-                # Clean up
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
+                st.caption(f"Decode {loaded.decode_ms:.0f} ms · " + " · ".join(
+                    f"{k} {v:.0f} ms" for k, v in session.timings_ms.items() if k != "image"
+                ) + " (computed once per image and setting)")
                 
             except Exception as e:
                 st.error(f"Error processing image: {str(e)}")
                 st.exception(e)
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
     
     # Information section
     st.header("About ArborVision")
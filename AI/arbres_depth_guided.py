@@ -21,6 +21,13 @@ try:
 except Exception:
     TV_OK = False
 
+from depth_models import DEFAULT_DEPTH_MODEL, DEFAULT_DEPTH_DEVICE, DEPTH_MODEL_TYPES, get_depth_model
+from depth_cache import DepthCache, DEFAULT_CACHE_DIR, depth_cache_key
+from mask_geometry import mask_geometry
+from image_loader import read_image
+from mask_rle import mask_summary
+from mask_cleanup import fill_holes, largest_component, remove_small_components
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 log = logging.getLogger("arbres_depth_guided")
 
@@ -31,7 +38,11 @@ def _parse_args():
     p.add_argument("--max-size", type=int, default=1600)
     p.add_argument("--pixel-per-meter", type=float, default=None)
     p.add_argument("--use-depth", action="store_true", help="Enable depth-guided apex/base")
-    p.add_argument("--depth-model", type=str, default="DPT_Large", help="MiDaS model: DPT_Large | DPT_Hybrid | MiDaS_small")
+    p.add_argument("--depth-model", type=str, default=DEFAULT_DEPTH_MODEL, choices=DEPTH_MODEL_TYPES, help="MiDaS model from the local store (default from ARBOR_DEPTH_MODEL)")
+    p.add_argument("--sparse-depth", action="store_true", help="Keep depth at network resolution and smooth only the sampled axis profile")
+    p.add_argument("--depth-cache", type=str, default=DEFAULT_CACHE_DIR, help="Directory of cached depth maps")
+    p.add_argument("--no-depth-cache", action="store_true")
+    p.add_argument("--mask-rle", action="store_true", help="Include the tree mask (COCO RLE) in the result JSON")
     return p.parse_args()
 
 def select_image_file() -> Optional[str]:
@@ -55,27 +66,15 @@ def get_image_path(cli_path: Optional[str]) -> Optional[str]:
     return select_image_file()
 
 def load_image(path: str, max_side: int = 1600):
-    img_bgr = cv2.imread(path, cv2.IMREAD_COLOR)
-    if img_bgr is None: raise FileNotFoundError(f"Cannot read image: {path}")
-    h, w = img_bgr.shape[:2]
-    scale = max_side / max(h, w) if max(h, w) > max_side else 1.0
-    if scale < 1.0:
-        img_bgr = cv2.resize(img_bgr, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    H, W = img_rgb.shape[:2]
-    return img_bgr, img_rgb, H, W
+    img = read_image(path, max_side)
+    log.debug(f"Decoded {img.source_size[0]}x{img.source_size[1]} at 1/{img.reduction} in {img.decode_ms:.0f} ms "
+              f"(orientation {img.orientation}, total {img.total_ms:.0f} ms)")
+    return img.bgr, img.rgb, img.height, img.width
 
 def _area_ratio(mask: np.ndarray) -> float:
     mask_bin = mask > 0
     return float(mask_bin.sum()) / (mask_bin.shape[0] * mask_bin.shape[1])
 
-def _largest_component(mask_bool: np.ndarray) -> np.ndarray:
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask_bool.astype(np.uint8), connectivity=8)
-    if num_labels <= 1: return mask_bool
-    areas = stats[1:, cv2.CC_STAT_AREA]
-    idx = 1 + np.argmax(areas)
-    return labels == idx
-
 def create_vegetation_mask_by_color(img_rgb: np.ndarray) -> Optional[np.ndarray]:
     lab = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2LAB)
     L, A, B = cv2.split(lab)
@@ -99,7 +98,7 @@ def create_vegetation_mask_by_color(img_rgb: np.ndarray) -> Optional[np.ndarray]
     mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, k, iterations=1)
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, k, iterations=1)
     mask_bool = mask > 0
-    mask_bool = _largest_component(mask_bool)
+    mask_bool = largest_component(mask_bool)
     if mask_bool.sum() == 0: return None
     return (mask_bool.astype(np.uint8) * 255)
 
@@ -136,17 +135,11 @@ def create_fallback_mask(img_rgb: np.ndarray) -> Optional[np.ndarray]:
     edges = cv2.Canny(gray, 50, 150)
     k = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
     edges = cv2.dilate(edges, k, iterations=1)
-    cnts, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not cnts: return None
     H, W = gray.shape
     MIN_BLOB_RATIO = 0.02
-    mask = np.zeros_like(gray, dtype=np.uint8)
-    for c in cnts:
-        area = cv2.contourArea(c)
-        if area >= MIN_BLOB_RATIO * H * W:
-            cv2.drawContours(mask, [c], -1, 255, thickness=cv2.FILLED)
-    if mask.sum() == 0: return None
-    mask_bool = _largest_component(mask > 0)
+    mask = remove_small_components(fill_holes(edges), int(MIN_BLOB_RATIO * H * W))
+    if not mask.any(): return None
+    mask_bool = largest_component(mask)
     return (mask_bool.astype(np.uint8) * 255)
 
 def refine_tree_mask(mask: np.ndarray, img_rgb: np.ndarray) -> np.ndarray:
@@ -154,7 +147,7 @@ def refine_tree_mask(mask: np.ndarray, img_rgb: np.ndarray) -> np.ndarray:
     k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_OPEN, k, iterations=1)
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_CLOSE, k, iterations=1)
-    mask_bin = _largest_component(mask_bin > 0).astype(np.uint8)
+    mask_bin = largest_component(mask_bin > 0).astype(np.uint8)
     k2 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 5))
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_CLOSE, k2, iterations=1)
     return (mask_bin * 255)
@@ -210,19 +203,9 @@ def segment_tree_multi_approach_depth(img_rgb: np.ndarray, device="cpu") -> np.n
     return refined
 
 def detect_tree_extremes_pca(mask: np.ndarray) -> Tuple[Tuple[int,int], Tuple[int,int]]:
-    pts = np.column_stack(np.where(mask > 0))
-    if len(pts) == 0: return (0,0),(0,0)
-    mu = pts.mean(axis=0, keepdims=True)
-    X = pts - mu
-    cov = (X.T @ X) / max(1, len(pts)-1)
-    eigvals, eigvecs = np.linalg.eigh(cov)
-    v = eigvecs[:, np.argmax(eigvals)]
-    proj = X @ v
-    i_min = int(np.argmin(proj))
-    i_max = int(np.argmax(proj))
-    top = tuple(pts[i_min][::-1])
-    base = tuple(pts[i_max][::-1])
-    return base, top
+    geom = mask_geometry(mask)
+    if geom is None: return (0,0),(0,0)
+    return geom.base, geom.top
 
 def bilinear_sample(depth: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
     H, W = depth.shape
@@ -240,12 +223,32 @@ def bilinear_sample(depth: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.nda
     bot = Ic*(1-dx) + Id*dx
     return top*(1-dy) + bot*dy
 
+def smooth_profile(d: np.ndarray, radius: int = 4, sigma_space: float = 5.0, sigma_range: float = 0.1) -> np.ndarray:
+    # 1-D bilateral filter, same parameters as the full-frame cv2.bilateralFilter(depth, 9, 0.1, 5.0)
+    n = len(d)
+    if n == 0: return d
+    offs = np.arange(-radius, radius + 1)
+    idx = np.clip(np.arange(n)[:, None] + offs[None, :], 0, n-1)
+    win = d[idx]
+    w = np.exp(-(offs[None, :] ** 2) / (2 * sigma_space ** 2)) * np.exp(-((win - d[:, None]) ** 2) / (2 * sigma_range ** 2))
+    return (w * win).sum(axis=1) / w.sum(axis=1)
+
+def sample_depth_profile(depth: np.ndarray, xs: np.ndarray, ys: np.ndarray, image_hw: Tuple[int,int]) -> np.ndarray:
+    H, W = image_hw
+    dh, dw = depth.shape
+    if (dh, dw) == (H, W):
+        return bilinear_sample(depth, xs, ys)
+    # sparse depth: map image coordinates into the network grid (align_corners=False convention)
+    xs_d = np.clip((xs + 0.5) * (dw / W) - 0.5, 0, dw-1)
+    ys_d = np.clip((ys + 0.5) * (dh / H) - 0.5, 0, dh-1)
+    return smooth_profile(bilinear_sample(depth, xs_d, ys_d))
+
 def refine_extremes_with_depth(mask: np.ndarray, base: Tuple[int,int], top: Tuple[int,int], depth: np.ndarray) -> Tuple[Tuple[int,int], Tuple[int,int]]:
     x_top, y_top = top; x_base, y_base = base
     N = 400
     xs = np.linspace(x_top, x_base, N)
     ys = np.linspace(y_top, y_base, N)
-    d = bilinear_sample(depth, xs, ys)
+    d = sample_depth_profile(depth, xs, ys, mask.shape[:2])
     g = np.gradient(d)
     idx_top = np.argmax(np.abs(g[: max(20, int(0.4*N)) ]))
     idx_base_region_start = int(0.75*N)
@@ -299,25 +302,75 @@ def render_overlay(img_bgr: np.ndarray, base: Tuple[int,int], top: Tuple[int,int
     cv2.putText(out, txt, (16, 10 + th + 6), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
     return out
 
-def load_midas(model_type: str = "DPT_Large", device="cpu"):
-    midas = torch.hub.load("intel-isl/MiDaS", model_type)
-    midas.to(device).eval()
-    transforms = torch.hub.load("intel-isl/MiDaS", "transforms")
-    if "DPT" in model_type:
-        transform = transforms.dpt_transform
-    else:
-        transform = transforms.small_transform
-    return midas, transform
+def load_midas(model_type: str = DEFAULT_DEPTH_MODEL, device=DEFAULT_DEPTH_DEVICE):
+    return get_depth_model(model_type, device)
 
-def infer_depth(img_rgb: np.ndarray, model, transform, device="cpu") -> np.ndarray:
-    import PIL.Image as Image
-    inp = transform(Image.fromarray(img_rgb)).to(device)
+def infer_depth(img_rgb: np.ndarray, model, transform, device="cpu", sparse: bool = False) -> np.ndarray:
+    """Relative depth in [0,1]. With sparse=True the map stays at network resolution
+    and is neither upsampled nor filtered; refine_extremes_with_depth handles the mapping."""
+    inp = transform(img_rgb).to(device)
     with torch.inference_mode():
         pred = model(inp)
         if isinstance(pred, (list, tuple)): pred = pred[0]
-        pred = F.interpolate(pred.unsqueeze(1), size=img_rgb.shape[:2], mode="bicubic", align_corners=False).squeeze()
+        if sparse:
+            pred = pred.squeeze()
+        else:
+            pred = F.interpolate(pred.unsqueeze(1), size=img_rgb.shape[:2], mode="bicubic", align_corners=False).squeeze()
     depth = pred.detach().cpu().numpy().astype(np.float32)
     dmin, dmax = np.percentile(depth, 1), np.percentile(depth, 99)
     depth = np.clip((depth - dmin) / max(1e-6, (dmax - dmin)), 0, 1)
-    depth = cv2.bilateralFilter(depth, 9, 0.1, 5.0)
-    return depth
\ No newline at end of file
+    if not sparse:
+        depth = cv2.bilateralFilter(depth, 9, 0.1, 5.0)
+    return depth
+
+def infer_depth_cached(img_rgb: np.ndarray, model_type: str = DEFAULT_DEPTH_MODEL, device=DEFAULT_DEPTH_DEVICE,
+                       sparse: bool = False, cache: Optional[DepthCache] = None) -> np.ndarray:
+    """infer_depth behind the on-disk cache; on a hit neither the model nor the network is touched."""
+    key = depth_cache_key(img_rgb, model_type, sparse)
+    if cache is not None:
+        depth = cache.get(key)
+        if depth is not None:
+            return depth
+    midas, transform = load_midas(model_type, device)
+    depth = infer_depth(img_rgb, midas, transform, device, sparse=sparse)
+    if cache is not None:
+        cache.put(key, depth)
+    return depth
+
+def main():
+    args = _parse_args()
+    img_path = get_image_path(args.image)
+    if not img_path:
+        log.error("No image provided/selected."); return
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu") if TORCH_OK else "cpu"
+    img_bgr, img_rgb, H, W = load_image(img_path, max_side=args.max_size)
+    log.info(f"Image loaded: {img_path} ({W}x{H})")
+    tree_mask = segment_tree_multi_approach_depth(img_rgb, device)
+    base, top = detect_tree_extremes_pca(tree_mask)
+    if args.use_depth and TORCH_OK:
+        cache = None if args.no_depth_cache else DepthCache(args.depth_cache)
+        depth = infer_depth_cached(img_rgb, args.depth_model, device, sparse=args.sparse_depth, cache=cache)
+        base, top = refine_extremes_with_depth(tree_mask, base, top, depth)
+    elif args.use_depth:
+        log.warning("Torch not available; depth refinement skipped.")
+    pixel_height = abs(top[1] - base[1])
+    log.info(f"Pixel height = {pixel_height}")
+    height_m, height_ci, size_label, dbh_m = estimate_height_and_dbh(pixel_height, manual_ppm=args.pixel_per_meter)
+    log.info(f"Estimated height: {height_m:.2f} m (±{height_ci:.2f} m), class={size_label}, DBH≈{dbh_m:.2f} m")
+    stem = os.path.splitext(os.path.basename(img_path))[0]
+    out_path = f"{stem}_depth_annotated.jpg"
+    cv2.imwrite(out_path, render_overlay(img_bgr, base, top, height_m, height_ci, size_label, dbh_m))
+    if args.save_debug or args.mask_rle:
+        if args.save_debug:
+            cv2.imwrite(f"{stem}_depth_mask.png", tree_mask)
+        result = {"source": img_path, "height_m": round(height_m, 3), "uncertainty_m": round(height_ci, 3),
+                  "dbh_m": round(dbh_m, 3), "size_label": size_label, "base_xy": [int(v) for v in base], "top_xy": [int(v) for v in top],
+                  "image_shape_hw": [H, W]}
+        if args.mask_rle:
+            result["mask"] = mask_summary(tree_mask)
+        with open(f"{stem}_depth_result.json", "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    log.info(f"Saved: {out_path}")
+
+if __name__ == "__main__":
+    main()
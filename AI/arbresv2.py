@@ -10,12 +10,16 @@ import torch
 import torchvision
 from torchvision import transforms
 from PIL import Image
-import exifread
 import warnings
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import glob
+from mask_geometry import mask_geometry
+from model_cache import get_model
+from calibration_store import get_calibration_store
+from semantic_segmentation import semantic_mask
+from mask_cleanup import largest_component
 warnings.filterwarnings('ignore')
 
 def select_image_file():
@@ -169,8 +173,7 @@ def segment_tree_multi_approach(img_rgb, device):
 def try_maskrcnn_segmentation(img_rgb, device):
     """Essayer la segmentation avec Mask R-CNN"""
     try:
-        maskrcnn = torchvision.models.detection.maskrcnn_resnet50_fpn(pretrained=True).to(device)
-        maskrcnn.eval()
+        maskrcnn = get_model("maskrcnn_resnet50_fpn", "DEFAULT", device)
         
         transform = transforms.Compose([transforms.ToTensor()])
         input_tensor = transform(img_rgb).to(device)
@@ -219,37 +222,9 @@ def try_maskrcnn_segmentation(img_rgb, device):
         return None
 
 def try_semantic_segmentation(img_rgb, device):
-    """Essayer la segmentation sémantique avec DeepLabV3"""
+    """Essayer la segmentation sémantique avec DeepLabV3 (ARBOR_SEG_MODEL, ARBOR_SEG_SIZE)"""
     try:
-        model = torchvision.models.segmentation.deeplabv3_resnet101(pretrained=True).to(device)
-        model.eval()
-        
-        preprocess = transforms.Compose([
-            transforms.ToPILImage(),
-            transforms.Resize((520, 520)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        
-        input_tensor = preprocess(img_rgb).unsqueeze(0).to(device)
-        
-        with torch.no_grad():
-            output = model(input_tensor)['out'][0]
-        
-        output_predictions = output.argmax(0).cpu().numpy()
-        
-        # Redimensionner
-        height, width = img_rgb.shape[:2]
-        
-        # Essayer plusieurs classes de végétation PASCAL VOC
-        vegetation_classes = [15]  # plant
-        combined_mask = np.zeros((height, width), dtype=bool)
-        
-        for class_id in vegetation_classes:
-            class_mask = cv2.resize((output_predictions == class_id).astype(np.uint8), (width, height))
-            combined_mask |= class_mask.astype(bool)
-        
-        return combined_mask if np.sum(combined_mask) > 0 else None
+        return semantic_mask(img_rgb, device)
         
     except Exception as e:
         print(f"Erreur segmentation sémantique: {e}")
@@ -279,12 +254,7 @@ def create_vegetation_mask_by_color(img_rgb):
         mask_combined = cv2.morphologyEx(mask_combined, cv2.MORPH_OPEN, kernel)
         
         # Garder seulement la plus grande composante connexe
-        num_labels, labels = cv2.connectedComponents(mask_combined)
-        if num_labels > 1:
-            largest_component = 1 + np.argmax([np.sum(labels == i) for i in range(1, num_labels)])
-            mask_combined = (labels == largest_component).astype(np.uint8) * 255
-        
-        return mask_combined.astype(bool)
+        return largest_component(mask_combined)
         
     except Exception as e:
         print(f"Erreur segmentation couleur: {e}")
@@ -312,14 +282,12 @@ def generate_depth_map(img_rgb, device):
     """Générer la carte de profondeur avec MiDaS"""
     print("Génération carte de profondeur...")
     try:
-        midas = torch.hub.load("intel-isl/MiDaS", "DPT_Large").to(device)
-        midas.eval()
-        midas_transforms = torch.hub.load("intel-isl/MiDaS", "transforms").dpt_transform
+        midas, midas_transform = get_model("midas", "DPT_Large", device)
         
-        input_midas = midas_transforms(img_rgb).to(device)
+        input_midas = midas_transform(img_rgb).to(device)
         
         with torch.no_grad():
-            depth = midas(input_midas.unsqueeze(0))
+            depth = midas(input_midas)
         
         depth_map = depth.squeeze().cpu().numpy()
         height, width = img_rgb.shape[:2]
@@ -336,43 +304,28 @@ def generate_depth_map(img_rgb, device):
 
 def detect_tree_extremes(tree_mask):
     """Détecter base et sommet de l'arbre"""
-    ys, xs = np.where(tree_mask)
-    if len(ys) == 0:
+    geom = mask_geometry(tree_mask, win=0)
+    if geom is None:
         raise ValueError("Masque vide")
     
-    base_y = ys.max()
-    top_y = ys.min()
-    base_x = int(np.median(xs[ys == base_y]))
-    top_x = int(np.median(xs[ys == top_y]))
+    (base_x, base_y), (top_x, top_y) = geom.base_vertical, geom.top_vertical
     
     print(f"Base: ({base_x}, {base_y}), Sommet: ({top_x}, {top_y})")
     return (base_x, base_y), (top_x, top_y)
 
-def get_focal_length_px(img_path, width):
-    """Estimation focale en pixels"""
-    try:
-        with open(img_path, 'rb') as f:
-            tags = exifread.process_file(f)
-        focal_mm_tag = tags.get('EXIF FocalLength')
-        if focal_mm_tag:
-            focal_mm = float(str(focal_mm_tag).split('/')[0])
-            if '/' in str(focal_mm_tag):
-                focal_mm = focal_mm / float(str(focal_mm_tag).split('/')[1])
-            sensor_width_mm = 6.3
-            focal_px = focal_mm / sensor_width_mm * width
-            print(f"Focale EXIF: {focal_mm}mm -> {focal_px:.1f}px")
-            return focal_px
-    except Exception as e:
-        print(f"Erreur EXIF: {e}")
-    
-    focal_px = 0.9 * width
-    print(f"Focale approximée: {focal_px:.1f}px")
-    return focal_px
+def get_focal_length_px(img_path, width, height):
+    """Estimation focale en pixels (calibration de l'appareil, calculée une fois puis réutilisée)"""
+    key, calib = get_calibration_store().for_image(img_path, width, height)
+    if calib.source == "default":
+        print(f"Focale approximée: {calib.focal_px:.1f}px")
+    else:
+        print(f"Focale {calib.source} ({key}): {calib.focal_px:.1f}px")
+    return calib.focal_px
 
 # ----------- Calculs principaux -----------
 depth_map = generate_depth_map(img_rgb, device)
 base_pos, top_pos = detect_tree_extremes(tree_mask)
-focal_px = get_focal_length_px(img_path, width)
+focal_px = get_focal_length_px(img_path, width, height)
 
 # Estimation hauteur
 camera_height_m = 1.6
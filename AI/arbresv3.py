@@ -10,12 +10,16 @@ import torch
 import torchvision
 from torchvision import transforms
 from PIL import Image
-import exifread
 import warnings
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import glob
+from mask_geometry import percentile_extremes
+from model_cache import get_model
+from calibration_store import get_calibration_store
+from semantic_segmentation import semantic_mask
+from mask_cleanup import fill_holes, filter_components, largest_component
 warnings.filterwarnings('ignore')
 
 def select_image_file():
@@ -225,8 +229,7 @@ def interactive_grabcut_segmentation(img_rgb):
 def try_maskrcnn_segmentation(img_rgb, device):
     """Essayer la segmentation avec Mask R-CNN"""
     try:
-        maskrcnn = torchvision.models.detection.maskrcnn_resnet50_fpn(pretrained=True).to(device)
-        maskrcnn.eval()
+        maskrcnn = get_model("maskrcnn_resnet50_fpn", "DEFAULT", device)
         
         transform = transforms.Compose([transforms.ToTensor()])
         input_tensor = transform(img_rgb).to(device)
@@ -275,37 +278,9 @@ def try_maskrcnn_segmentation(img_rgb, device):
         return None
 
 def try_semantic_segmentation(img_rgb, device):
-    """Essayer la segmentation sémantique avec DeepLabV3"""
+    """Essayer la segmentation sémantique avec DeepLabV3 (ARBOR_SEG_MODEL, ARBOR_SEG_SIZE)"""
     try:
-        model = torchvision.models.segmentation.deeplabv3_resnet101(pretrained=True).to(device)
-        model.eval()
-        
-        preprocess = transforms.Compose([
-            transforms.ToPILImage(),
-            transforms.Resize((520, 520)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        
-        input_tensor = preprocess(img_rgb).unsqueeze(0).to(device)
-        
-        with torch.no_grad():
-            output = model(input_tensor)['out'][0]
-        
-        output_predictions = output.argmax(0).cpu().numpy()
-        
-        # Redimensionner
-        height, width = img_rgb.shape[:2]
-        
-        # Essayer plusieurs classes de végétation PASCAL VOC
-        vegetation_classes = [15]  # plant
-        combined_mask = np.zeros((height, width), dtype=bool)
-        
-        for class_id in vegetation_classes:
-            class_mask = cv2.resize((output_predictions == class_id).astype(np.uint8), (width, height))
-            combined_mask |= class_mask.astype(bool)
-        
-        return combined_mask if np.sum(combined_mask) > 0 else None
+        return semantic_mask(img_rgb, device)
         
     except Exception as e:
         print(f"Erreur segmentation sémantique: {e}")
@@ -343,12 +318,7 @@ def create_vegetation_mask_by_color(img_rgb):
         mask_combined = cv2.morphologyEx(mask_combined, cv2.MORPH_OPEN, kernel)
         
         # Garder seulement la plus grande composante (l'arbre principal)
-        num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask_combined)
-        
-        if num_labels > 1:
-            # Trouver la plus grande composante (exclure le background=0)
-            largest_component = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
-            mask_combined = (labels == largest_component).astype(np.uint8) * 255
+        mask_combined = largest_component(mask_combined).astype(np.uint8) * 255
         
         # Vérifier que le masque a une forme verticale (caractéristique d'un arbre)
         if np.sum(mask_combined) > 1000:  # Assez de pixels
@@ -381,25 +351,22 @@ def create_fallback_mask(img_rgb):
         edges_dilated = cv2.dilate(edges, kernel, iterations=2)
         
         # Remplir les régions fermées
-        contours, _ = cv2.findContours(edges_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        regions = fill_holes(edges_dilated)
         
-        mask = np.zeros(gray.shape, dtype=np.uint8)
-        
-        # Chercher des contours qui ressemblent à des arbres (grands et verticaux)
+        # Garder les régions qui ressemblent à des arbres (grandes et verticales)
         height, width = img_rgb.shape[:2]
         
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area > height * width * 0.02:  # Au moins 2% de l'image
-                x, y, w, h = cv2.boundingRect(contour)
-                aspect_ratio = h / w if w > 0 else 0
-                
-                # Vérifier si c'est vertical et assez grand
-                if aspect_ratio > 1.0 and h > height * 0.3:
-                    cv2.fillPoly(mask, [contour], 255)
-                    print(f"✓ Forme d'arbre détectée - Ratio H/L: {aspect_ratio:.2f}")
+        def tree_like(stats):
+            w = stats[:, cv2.CC_STAT_WIDTH]
+            h = stats[:, cv2.CC_STAT_HEIGHT]
+            return ((stats[:, cv2.CC_STAT_AREA] > height * width * 0.02)  # Au moins 2% de l'image
+                    & (h > w) & (h > height * 0.3))
+        
+        mask = filter_components(regions, tree_like)
+        if mask.any():
+            print("✓ Forme d'arbre détectée")
         
-        return mask.astype(bool) if np.sum(mask) > 1000 else None
+        return mask if np.sum(mask) > 1000 else None
         
     except Exception as e:
         print(f"Erreur masque de secours: {e}")
@@ -519,14 +486,12 @@ def generate_depth_map(img_rgb, device):
     """Générer la carte de profondeur avec MiDaS"""
     print("Génération carte de profondeur...")
     try:
-        midas = torch.hub.load("intel-isl/MiDaS", "DPT_Large").to(device)
-        midas.eval()
-        midas_transforms = torch.hub.load("intel-isl/MiDaS", "transforms").dpt_transform
+        midas, midas_transform = get_model("midas", "DPT_Large", device)
         
-        input_midas = midas_transforms(img_rgb).to(device)
+        input_midas = midas_transform(img_rgb).to(device)
         
         with torch.no_grad():
-            depth = midas(input_midas.unsqueeze(0))
+            depth = midas(input_midas)
         
         depth_map = depth.squeeze().cpu().numpy()
         height, width = img_rgb.shape[:2]
@@ -543,85 +508,26 @@ def generate_depth_map(img_rgb, device):
 
 def detect_tree_extremes(tree_mask):
     """Détecter base et sommet de l'arbre avec précision améliorée"""
-    ys, xs = np.where(tree_mask)
-    if len(ys) == 0:
+    # Médiane des 5% de pixels les plus bas / hauts, x affiné sur une fenêtre de 20 px ;
+    # calculé sur l'histogramme des lignes du masque, sans liste de pixels
+    extremes = percentile_extremes(tree_mask, q=5.0, window=20)
+    if extremes is None:
         raise ValueError("Masque vide")
-    
-    # Méthode améliorée pour la base
-    # Prendre les 5% de pixels les plus bas et faire la médiane
-    bottom_threshold = np.percentile(ys, 95)
-    bottom_pixels = ys >= bottom_threshold
-    base_candidates_y = ys[bottom_pixels]
-    base_candidates_x = xs[bottom_pixels]
-    
-    base_y = int(np.median(base_candidates_y))
-    base_x = int(np.median(base_candidates_x))
-    
-    # Méthode améliorée pour le sommet
-    # Prendre les 5% de pixels les plus hauts et faire la médiane
-    top_threshold = np.percentile(ys, 5)
-    top_pixels = ys <= top_threshold
-    top_candidates_y = ys[top_pixels]
-    top_candidates_x = xs[top_pixels]
-    
-    top_y = int(np.median(top_candidates_y))
-    top_x = int(np.median(top_candidates_x))
-    
-    # Vérification de cohérence
-    if base_y <= top_y:
-        print("⚠️ Avertissement: Base et sommet incohérents, correction automatique")
-        # Forcer base en bas et sommet en haut
-        base_y = ys.max()
-        top_y = ys.min()
-        base_x = int(np.median(xs[ys == base_y]))
-        top_x = int(np.median(xs[ys == top_y]))
-    
-    # Affiner la position horizontale en cherchant le centre de masse local
-    def refine_x_position(y_pos, mask, window=20):
-        y_start = max(0, y_pos - window//2)
-        y_end = min(mask.shape[0], y_pos + window//2)
-        
-        local_region = mask[y_start:y_end, :]
-        if np.any(local_region):
-            ys_local, xs_local = np.where(local_region)
-            if len(xs_local) > 0:
-                return int(np.median(xs_local))
-        return None
-    
-    # Affiner les positions
-    refined_base_x = refine_x_position(base_y, tree_mask)
-    refined_top_x = refine_x_position(top_y, tree_mask)
-    
-    if refined_base_x is not None:
-        base_x = refined_base_x
-    if refined_top_x is not None:
-        top_x = refined_top_x
+    (base_x, base_y), (top_x, top_y) = extremes
     
     print(f"Base affinée: ({base_x}, {base_y}), Sommet affiné: ({top_x}, {top_y})")
     print(f"Hauteur en pixels: {base_y - top_y}")
     
     return (base_x, base_y), (top_x, top_y)
 
-def get_focal_length_px(img_path, width):
-    """Estimation focale en pixels"""
-    try:
-        with open(img_path, 'rb') as f:
-            tags = exifread.process_file(f)
-        focal_mm_tag = tags.get('EXIF FocalLength')
-        if focal_mm_tag:
-            focal_mm = float(str(focal_mm_tag).split('/')[0])
-            if '/' in str(focal_mm_tag):
-                focal_mm = focal_mm / float(str(focal_mm_tag).split('/')[1])
-            sensor_width_mm = 6.3
-            focal_px = focal_mm / sensor_width_mm * width
-            print(f"Focale EXIF: {focal_mm}mm -> {focal_px:.1f}px")
-            return focal_px
-    except Exception as e:
-        print(f"Erreur EXIF: {e}")
-    
-    focal_px = 0.9 * width
-    print(f"Focale approximée: {focal_px:.1f}px")
-    return focal_px
+def get_focal_length_px(img_path, width, height):
+    """Estimation focale en pixels (calibration de l'appareil, calculée une fois puis réutilisée)"""
+    key, calib = get_calibration_store().for_image(img_path, width, height)
+    if calib.source == "default":
+        print(f"Focale approximée: {calib.focal_px:.1f}px")
+    else:
+        print(f"Focale {calib.source} ({key}): {calib.focal_px:.1f}px")
+    return calib.focal_px
 
 # ----------- Calcul de hauteur RÈGLE DE TROIS AVEC CLASSIFICATION DE TAILLE -----------
 base_pos, top_pos = detect_tree_extremes(tree_mask)
@@ -7,6 +7,11 @@ from typing import Tuple, Optional
 import numpy as np
 import cv2
 
+from mask_geometry import mask_geometry
+from image_loader import read_image
+from mask_rle import mask_summary
+from mask_cleanup import fill_holes, largest_component, remove_small_components
+
 try:
     import torch
     from torchvision.models.detection import (
@@ -33,6 +38,7 @@ def _parse_args():
     p.add_argument("--save-debug", action="store_true")
     p.add_argument("--max-size", type=int, default=1600)
     p.add_argument("--pixel-per-meter", type=float, default=None)
+    p.add_argument("--mask-rle", action="store_true", help="Include the tree mask (COCO RLE) in the result JSON")
     return p.parse_args()
 
 def select_image_file() -> Optional[str]:
@@ -54,16 +60,10 @@ def get_image_path(cli_path: Optional[str]) -> Optional[str]:
     return select_image_file()
 
 def load_image(path: str, max_side: int = 1600):
-    img_bgr = cv2.imread(path, cv2.IMREAD_COLOR)
-    if img_bgr is None:
-        raise FileNotFoundError(f"Cannot read image: {path}")
-    h, w = img_bgr.shape[:2]
-    scale = max_side / max(h, w) if max(h, w) > max_side else 1.0
-    if scale < 1.0:
-        img_bgr = cv2.resize(img_bgr, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    H, W = img_rgb.shape[:2]
-    return img_bgr, img_rgb, H, W
+    img = read_image(path, max_side)
+    log.debug(f"Decoded {img.source_size[0]}x{img.source_size[1]} at 1/{img.reduction} in {img.decode_ms:.0f} ms "
+              f"(orientation {img.orientation}, total {img.total_ms:.0f} ms)")
+    return img.bgr, img.rgb, img.height, img.width
 
 def _area_ratio(mask: np.ndarray) -> float:
     if mask.dtype != np.bool_:
@@ -72,14 +72,6 @@ def _area_ratio(mask: np.ndarray) -> float:
         mask_bin = mask
     return float(mask_bin.sum()) / (mask_bin.shape[0] * mask_bin.shape[1])
 
-def _largest_component(mask_bool: np.ndarray) -> np.ndarray:
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask_bool.astype(np.uint8), connectivity=8)
-    if num_labels <= 1:
-        return mask_bool
-    areas = stats[1:, cv2.CC_STAT_AREA]
-    idx = 1 + np.argmax(areas)
-    return labels == idx
-
 def create_vegetation_mask_by_color(img_rgb: np.ndarray) -> Optional[np.ndarray]:
     hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
     lower = np.array([20, 30, 30], dtype=np.uint8)
@@ -89,7 +81,7 @@ def create_vegetation_mask_by_color(img_rgb: np.ndarray) -> Optional[np.ndarray]
     mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, k, iterations=1)
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, k, iterations=1)
     mask_bool = mask > 0
-    mask_bool = _largest_component(mask_bool)
+    mask_bool = largest_component(mask_bool)
     ys, xs = np.where(mask_bool)
     if len(ys) == 0:
         return None
@@ -136,19 +128,12 @@ def create_fallback_mask(img_rgb: np.ndarray) -> Optional[np.ndarray]:
     edges = cv2.Canny(gray, 50, 150)
     k = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
     edges = cv2.dilate(edges, k, iterations=1)
-    cnts, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not cnts:
-        return None
     H, W = gray.shape
     MIN_BLOB_RATIO = 0.02
-    mask = np.zeros_like(gray, dtype=np.uint8)
-    for c in cnts:
-        area = cv2.contourArea(c)
-        if area >= MIN_BLOB_RATIO * H * W:
-            cv2.drawContours(mask, [c], -1, 255, thickness=cv2.FILLED)
-    if mask.sum() == 0:
+    mask = remove_small_components(fill_holes(edges), int(MIN_BLOB_RATIO * H * W))
+    if not mask.any():
         return None
-    mask_bool = _largest_component(mask > 0)
+    mask_bool = largest_component(mask)
     return (mask_bool.astype(np.uint8) * 255)
 
 def refine_tree_mask(mask: np.ndarray, img_rgb: np.ndarray) -> np.ndarray:
@@ -156,7 +141,7 @@ def refine_tree_mask(mask: np.ndarray, img_rgb: np.ndarray) -> np.ndarray:
     k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_OPEN, k, iterations=1)
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_CLOSE, k, iterations=1)
-    mask_bin = _largest_component(mask_bin > 0).astype(np.uint8)
+    mask_bin = largest_component(mask_bin > 0).astype(np.uint8)
     k2 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 5))
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_CLOSE, k2, iterations=1)
     return (mask_bin * 255)
@@ -197,22 +182,10 @@ def detect_tree_extremes(mask: np.ndarray, erode_ksize: int = 3) -> Tuple[Tuple[
     mb = (mask > 0).astype(np.uint8)
     k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (erode_ksize, erode_ksize))
     clean = cv2.erode(mb, k, iterations=1)
-    ys, xs = np.where(clean > 0)
-    if len(ys) == 0:
-        ys, xs = np.where(mb > 0)
-        if len(ys) == 0:
-            return (0, 0), (0, 0)
-    top_y = int(ys.min())
-    base_y = int(ys.max())
-    def robust_x_at(y: int, win: int = 5) -> int:
-        y0, y1 = max(0, y - win), min(mb.shape[0], y + win + 1)
-        col_idx = np.where(np.any(clean[y0:y1] > 0, axis=0))[0]
-        if len(col_idx) == 0:
-            col_idx = xs
-        return int(np.median(col_idx))
-    top_x = robust_x_at(top_y)
-    base_x = robust_x_at(base_y)
-    return (base_x, base_y), (top_x, top_y)
+    geom = mask_geometry(clean) or mask_geometry(mb)
+    if geom is None:
+        return (0, 0), (0, 0)
+    return geom.base_vertical, geom.top_vertical
 
 def classify_tree_size(pixel_height: int) -> str:
     if pixel_height < 600:
@@ -267,29 +240,34 @@ def render_and_save_outputs(img_bgr: np.ndarray,
                             size_label: str,
                             dbh_m: float,
                             save_debug: bool = False,
-                            source_path: Optional[str] = None) -> str:
+                            source_path: Optional[str] = None,
+                            include_mask_rle: bool = False) -> str:
     stem = "tree"
     if source_path:
         stem = os.path.splitext(os.path.basename(source_path))[0]
     out_img = render_overlay(img_bgr, base, top, height_m, height_ci, size_label, dbh_m)
     out_path = f"{stem}_annotated.jpg"
     cv2.imwrite(out_path, out_img)
-    if save_debug:
+    if save_debug or include_mask_rle:
         mask_path = f"{stem}_mask.png"
         json_path = f"{stem}_result.json"
-        cv2.imwrite(mask_path, (mask > 0).astype("uint8") * 255)
+        if save_debug:
+            cv2.imwrite(mask_path, (mask > 0).astype("uint8") * 255)
+        result = {
+            "source": source_path,
+            "height_m": round(height_m, 3),
+            "uncertainty_m": round(height_ci, 3),
+            "dbh_m": round(dbh_m, 3),
+            "size_label": size_label,
+            "base_xy": base,
+            "top_xy": top,
+            "image_shape_hw": img_rgb.shape[:2],
+        }
+        if include_mask_rle:
+            result["mask"] = mask_summary(mask)
         with open(json_path, "w", encoding="utf-8") as f:
-            json.dump({
-                "source": source_path,
-                "height_m": round(height_m, 3),
-                "uncertainty_m": round(height_ci, 3),
-                "dbh_m": round(dbh_m, 3),
-                "size_label": size_label,
-                "base_xy": base,
-                "top_xy": top,
-                "image_shape_hw": img_rgb.shape[:2],
-            }, ensure_ascii=False, indent=2)
-        log.info(f"Saved debug: {mask_path}, {json_path}")
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        log.info(f"Saved debug: {mask_path + ', ' if save_debug else ''}{json_path}")
     return out_path
 
 def main():
@@ -317,7 +295,7 @@ def main():
     output_path = render_and_save_outputs(
         img_bgr, img_rgb, tree_mask, (base_x, base_y), (top_x, top_y),
         height_m, height_ci, size_label, dbh_m,
-        save_debug=args.save_debug, source_path=img_path
+        save_debug=args.save_debug, source_path=img_path, include_mask_rle=args.mask_rle
     )
     log.info(f"Saved: {output_path}")
 
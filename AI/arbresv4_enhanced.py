@@ -5,6 +5,10 @@ import numpy as np
 import cv2
 import pygame
 
+from mask_geometry import mask_geometry
+from image_loader import read_image
+from mask_cleanup import fill_holes, largest_component, remove_small_components
+
 try:
     import torch
     from torchvision.models.detection import maskrcnn_resnet50_fpn, MaskRCNN_ResNet50_FPN_Weights
@@ -22,25 +26,11 @@ def _area_ratio(mask: np.ndarray) -> float:
     mask_bin = mask > 0
     return float(mask_bin.sum()) / (mask_bin.shape[0] * mask_bin.shape[1])
 
-def _largest_component(mask_bool: np.ndarray) -> np.ndarray:
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask_bool.astype(np.uint8), connectivity=8)
-    if num_labels <= 1:
-        return mask_bool
-    areas = stats[1:, cv2.CC_STAT_AREA]
-    idx = 1 + np.argmax(areas)
-    return labels == idx
-
 def load_image(path: str, max_side: int = 1600):
-    img_bgr = cv2.imread(path, cv2.IMREAD_COLOR)
-    if img_bgr is None:
-        raise FileNotFoundError(path)
-    h, w = img_bgr.shape[:2]
-    scale = max_side / max(h, w) if max(h, w) > max_side else 1.0
-    if scale < 1.0:
-        img_bgr = cv2.resize(img_bgr, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_AREA)
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    H, W = img_rgb.shape[:2]
-    return img_bgr, img_rgb, H, W
+    img = read_image(path, max_side)
+    log.debug(f"Decoded {img.source_size[0]}x{img.source_size[1]} at 1/{img.reduction} in {img.decode_ms:.0f} ms "
+              f"(orientation {img.orientation}, total {img.total_ms:.0f} ms)")
+    return img.bgr, img.rgb, img.height, img.width
 
 def create_vegetation_mask_by_color(img_rgb: np.ndarray) -> Optional[np.ndarray]:
     lab = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2LAB)
@@ -65,7 +55,7 @@ def create_vegetation_mask_by_color(img_rgb: np.ndarray) -> Optional[np.ndarray]
     mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, k, iterations=1)
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, k, iterations=1)
     mask_bool = mask > 0
-    mask_bool = _largest_component(mask_bool)
+    mask_bool = largest_component(mask_bool)
     if mask_bool.sum() == 0:
         return None
     return (mask_bool.astype(np.uint8) * 255)
@@ -106,19 +96,12 @@ def create_fallback_mask(img_rgb: np.ndarray) -> Optional[np.ndarray]:
     edges = cv2.Canny(gray, 50, 150)
     k = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
     edges = cv2.dilate(edges, k, iterations=1)
-    cnts, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not cnts:
-        return None
     H, W = gray.shape
     MIN_BLOB_RATIO = 0.02
-    mask = np.zeros_like(gray, dtype=np.uint8)
-    for c in cnts:
-        area = cv2.contourArea(c)
-        if area >= MIN_BLOB_RATIO * H * W:
-            cv2.drawContours(mask, [c], -1, 255, thickness=cv2.FILLED)
-    if mask.sum() == 0:
+    mask = remove_small_components(fill_holes(edges), int(MIN_BLOB_RATIO * H * W))
+    if not mask.any():
         return None
-    mask_bool = _largest_component(mask > 0)
+    mask_bool = largest_component(mask)
     return (mask_bool.astype(np.uint8) * 255)
 
 def refine_tree_mask(mask: np.ndarray, img_rgb: np.ndarray) -> np.ndarray:
@@ -126,7 +109,7 @@ def refine_tree_mask(mask: np.ndarray, img_rgb: np.ndarray) -> np.ndarray:
     k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5,5))
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_OPEN, k, iterations=1)
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_CLOSE, k, iterations=1)
-    mask_bin = _largest_component(mask_bin > 0).astype(np.uint8)
+    mask_bin = largest_component(mask_bin > 0).astype(np.uint8)
     k2 = cv2.getStructuringElement(cv2.MORPH_RECT, (3,5))
     mask_bin = cv2.morphologyEx(mask_bin, cv2.MORPH_CLOSE, k2, iterations=1)
     return (mask_bin * 255)
@@ -184,20 +167,10 @@ def segment_tree_multi_approach_enhanced(img_rgb: np.ndarray, device="cpu") -> n
     return refined
 
 def detect_tree_extremes_pca(mask: np.ndarray) -> Tuple[Tuple[int,int], Tuple[int,int]]:
-    pts = np.column_stack(np.where(mask > 0))
-    if len(pts) == 0:
+    geom = mask_geometry(mask)
+    if geom is None:
         return (0,0),(0,0)
-    mu = pts.mean(axis=0, keepdims=True)
-    X = pts - mu
-    cov = (X.T @ X) / max(1, len(pts)-1)
-    eigvals, eigvecs = np.linalg.eigh(cov)
-    v = eigvecs[:, np.argmax(eigvals)]
-    proj = X @ v
-    i_min = int(np.argmin(proj))
-    i_max = int(np.argmax(proj))
-    top = tuple(pts[i_min][::-1])
-    base = tuple(pts[i_max][::-1])
-    return base, top
+    return geom.base, geom.top
 
 def classify_tree_size(pixel_height: int) -> str:
     if pixel_height < 600:
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import os
+from typing import List, Sequence, Tuple
+import numpy as np
+
+# Deduplication of fruit detections coming from several detectors (colour
+# blobs, Hough circles, YOLO classes). The same fruit is typically reported
+# once per overlapping HSV range and again as a round_fruit circle; boxes are
+# grouped class-agnostically on an IoU matrix and each group becomes one
+# detection. Only the top_k most confident boxes enter the O(N^2) step, so the
+# cost stays bounded on fruit-dense trees.
+
+FUSION_IOU = float(os.environ.get("ARBOR_FUSION_IOU", "0.5"))
+FUSION_TOP_K = int(os.environ.get("ARBOR_FUSION_TOP_K", "300"))
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(N, M) IoU of xyxy boxes a (N, 4) and b (M, 4)."""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    area_a = np.clip(a[:, 2] - a[:, 0], 0, None) * np.clip(a[:, 3] - a[:, 1], 0, None)
+    area_b = np.clip(b[:, 2] - b[:, 0], 0, None) * np.clip(b[:, 3] - b[:, 1], 0, None)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    wh = np.clip(rb - lt, 0, None)
+    inter = wh[..., 0] * wh[..., 1]
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (stable for ties)."""
+    scores = np.asarray(scores, dtype=np.float64)
+    if k and len(scores) > k:
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = np.sort(idx)   # keep input order among ties before the stable sort
+        return idx[np.argsort(-scores[idx], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+def cluster_boxes(boxes: np.ndarray, scores: np.ndarray, iou_thr: float = FUSION_IOU,
+                  k: int = FUSION_TOP_K) -> List[np.ndarray]:
+    """Greedy class-agnostic grouping: each group is led by its best box (first index).
+
+    Boxes outside the top k are dropped. NMS keeps group[0]; fusion averages the group.
+    """
+    order = top_k(scores, k)
+    if order.size == 0:
+        return []
+    ious = iou_matrix(boxes[order], boxes[order])
+    taken = np.zeros(order.size, dtype=bool)
+    groups = []
+    for i in range(order.size):
+        if taken[i]:
+            continue
+        taken[i] = True   # a degenerate box has IoU 0 with itself but still leads its group
+        members = np.concatenate(([i], np.flatnonzero(~taken & (ious[i] >= iou_thr))))
+        taken[members] = True
+        groups.append(order[members])
+    return groups
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_thr: float = FUSION_IOU, k: int = FUSION_TOP_K) -> np.ndarray:
+    """Indices kept by class-agnostic non-maximum suppression, best first."""
+    groups = cluster_boxes(np.asarray(boxes, dtype=np.float64).reshape(-1, 4), scores, iou_thr, k)
+    return np.array([g[0] for g in groups], dtype=np.intp)
+
+def weighted_box_fusion(boxes: np.ndarray, scores: np.ndarray, iou_thr: float = FUSION_IOU,
+                        k: int = FUSION_TOP_K) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+    """(fused boxes, merged scores, groups): score-weighted mean box and best score per group."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64)
+    groups = cluster_boxes(boxes, scores, iou_thr, k)
+    fused = np.zeros((len(groups), 4))
+    merged = np.zeros(len(groups))
+    for j, g in enumerate(groups):
+        w = np.clip(scores[g], 1e-6, None)
+        fused[j] = (boxes[g] * w[:, None]).sum(axis=0) / w.sum()
+        merged[j] = merge_confidence(scores[g])
+    return fused, merged, groups
+
+def merge_confidence(scores: Sequence[float]) -> float:
+    """Confidence of a fruit reported by several detections: the best of them.
+
+    The duplicates are correlated (overlapping HSV ranges fire on the same
+    pixels), so they do not add evidence; the group size is reported separately
+    as 'merged'.
+    """
+    return float(np.clip(np.max(np.asarray(scores, dtype=np.float64), initial=0.0), 0.0, 1.0))
+
+def fuse_detections(detections: List[dict], iou_thr: float = FUSION_IOU, k: int = FUSION_TOP_K,
+                    method: str = "wbf") -> List[dict]:
+    """One detection per fruit from detect_fruits' dicts ('box' xyxy, 'confidence').
+
+    method "wbf" averages the boxes of a group, "nms" keeps the best one. The best
+    detection of each group supplies the other fields, 'merged' counts the group.
+    Detections without a usable box are passed through unchanged.
+    """
+    valid = [d for d in detections if d.get('box') is not None and len(d['box']) == 4]
+    rest = [d for d in detections if not (d.get('box') is not None and len(d['box']) == 4)]
+    if not valid:
+        return rest
+    boxes = np.array([d['box'] for d in valid], dtype=np.float64)
+    scores = np.array([float(d.get('confidence') or 0.0) for d in valid])
+    if method == "nms":
+        groups = cluster_boxes(boxes, scores, iou_thr, k)
+        fused_boxes = boxes[[g[0] for g in groups]] if groups else boxes[:0]
+        merged = [float(scores[g[0]]) for g in groups]
+    else:
+        fused_boxes, merged, groups = weighted_box_fusion(boxes, scores, iou_thr, k)
+    out = []
+    for box, conf, g in zip(fused_boxes, merged, groups):
+        d = dict(valid[g[0]])
+        x0, y0, x1, y1 = (int(round(v)) for v in box)
+        d['box'] = [x0, y0, x1, y1]
+        d['confidence'] = float(conf)
+        d['merged'] = int(len(g))
+        if 'candidates' in d:
+            d['candidates'] = list(dict.fromkeys(n for i in g for n in (valid[i].get('candidates') or [valid[i].get('name')]) if n))
+        if d.get('size_px') is not None:
+            d['size_px'] = int(max(x1 - x0, y1 - y0))
+        out.append(d)
+    return out + rest
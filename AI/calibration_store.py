@@ -0,0 +1,283 @@
+from __future__ import annotations
+import contextlib
+import io
+import json
+import math
+import logging
+import os
+import struct
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+try:
+    import fcntl
+    FCNTL_OK = True
+except ImportError:  # Windows
+    FCNTL_OK = False
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+log = logging.getLogger("calibration_store")
+
+# Per-device camera calibration, persisted in a small JSON file.
+#
+# A device is keyed by EXIF make/model (or a device id given by the caller, such
+# as the camera source, for frames without EXIF), image resolution and digital
+# zoom. Images of unknown origin get no key: their calibration is derived from
+# whatever EXIF they carry but never stored or shared with other cameras. Its
+# calibration (focal length in pixels, sensor size, distortion coefficients and
+# px_per_m_1m, the pixels-per-meter of an object 1 m away, so that
+# px_per_m = px_per_m_1m / distance) is derived from EXIF the first time the
+# device is seen, refined by measured references, and reused afterwards.
+#
+# read_exif only walks the JPEG segments up to the APP1 block and decodes the
+# handful of tags needed here, instead of the whole EXIF/MakerNote tree.
+#
+# Several app processes share the file: writes take an OS lock on a sidecar
+# ".lock" file, merge what is on disk, and are skipped when the entry is
+# already stored as is.
+
+CALIBRATION_FILE = os.environ.get("ARBOR_CALIBRATION_FILE", "camera_calibration.json")
+DEFAULT_SENSOR_WIDTH_MM = 6.3     # the scripts' historical assumption
+DEFAULT_FOCAL_RATIO = 0.9         # focal_px ~= 0.9 * width without EXIF
+
+# tag id -> name, IFD0 and Exif sub-IFD
+_IFD0_TAGS = {0x010F: "make", 0x0110: "model", 0x0112: "orientation", 0x8769: "_exif_ifd"}
+_EXIF_TAGS = {
+    0x920A: "focal_length_mm", 0xA405: "focal_length_35mm", 0xA404: "digital_zoom",
+    0xA002: "pixel_width", 0xA003: "pixel_height",
+    0xA20E: "focal_plane_x_res", 0xA20F: "focal_plane_y_res", 0xA210: "focal_plane_res_unit",
+}
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+def _parse_ifd(tiff: bytes, offset: int, endian: str, names: Dict[int, str], out: Dict):
+    if offset + 2 > len(tiff):
+        return
+    (count,) = struct.unpack_from(endian + "H", tiff, offset)
+    for i in range(count):
+        pos = offset + 2 + 12 * i
+        if pos + 12 > len(tiff):
+            return
+        tag, typ, n = struct.unpack_from(endian + "HHI", tiff, pos)
+        name = names.get(tag)
+        if name is None or typ not in _TYPE_SIZES:
+            continue
+        size = _TYPE_SIZES[typ] * n
+        data_at = pos + 8 if size <= 4 else struct.unpack_from(endian + "I", tiff, pos + 8)[0]
+        if data_at + size > len(tiff):
+            continue
+        if typ == 2:
+            out[name] = tiff[data_at:data_at + size].split(b"\0", 1)[0].decode("ascii", "replace").strip()
+        elif typ in (3, 4, 9):
+            fmt = {3: "H", 4: "I", 9: "i"}[typ]
+            out[name] = struct.unpack_from(endian + fmt, tiff, data_at)[0]
+        elif typ in (5, 10):
+            num, den = struct.unpack_from(endian + ("II" if typ == 5 else "ii"), tiff, data_at)
+            out[name] = num / den if den else None
+
+def parse_exif_block(block: bytes) -> Dict[str, object]:
+    """Tags of interest from an APP1 payload ("Exif\\0\\0" + TIFF) or a bare TIFF header."""
+    if block.startswith(b"Exif\0\0"):
+        block = block[6:]
+    if len(block) < 8 or block[:2] not in (b"II", b"MM"):
+        return {}
+    endian = "<" if block[:2] == b"II" else ">"
+    out: Dict[str, object] = {}
+    try:
+        (ifd0,) = struct.unpack_from(endian + "I", block, 4)
+        _parse_ifd(block, ifd0, endian, _IFD0_TAGS, out)
+        sub = out.pop("_exif_ifd", None)
+        if sub:
+            _parse_ifd(block, int(sub), endian, _EXIF_TAGS, out)
+    except struct.error:
+        pass
+    return out
+
+def _app1(f) -> Optional[bytes]:
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        head = f.read(4)
+        if len(head) < 4 or head[0] != 0xFF:
+            return None
+        marker = head[1]
+        (length,) = struct.unpack(">H", head[2:])
+        if marker == 0xDA or marker == 0xD9:     # start of scan / end of image: no EXIF
+            return None
+        if marker == 0xE1:
+            block = f.read(length - 2)
+            if block.startswith(b"Exif\0\0"):
+                return block
+            continue                              # XMP APP1, keep looking
+        f.seek(length - 2, io.SEEK_CUR)
+
+def read_exif(src: Union[str, bytes, "io.BufferedIOBase"]) -> Dict[str, object]:
+    """Make, model, orientation, focal lengths, zoom and focal-plane resolution of a JPEG.
+
+    src is a path, the file bytes, an APP1/TIFF block (e.g. PIL's image.info['exif'])
+    or a binary file object positioned at the start. Missing tags are absent from the dict.
+    """
+    try:
+        if isinstance(src, (bytes, bytearray)):
+            if not bytes(src[:2]) == b"\xff\xd8":
+                return parse_exif_block(bytes(src))
+            block = _app1(io.BytesIO(src))
+        elif isinstance(src, str):
+            with open(src, "rb") as f:
+                block = _app1(f)
+        else:
+            block = _app1(src)
+    except (OSError, struct.error) as e:
+        log.debug(f"EXIF read failed: {e}")
+        return {}
+    return parse_exif_block(block) if block else {}
+
+class Calibration(NamedTuple):
+    focal_px: float
+    sensor_width_mm: Optional[float] = None
+    sensor_height_mm: Optional[float] = None
+    dist_coeffs: Tuple[float, ...] = (0.0, 0.0, 0.0, 0.0, 0.0)
+    px_per_m_1m: Optional[float] = None     # measured; focal_px is used when None
+    source: str = "default"                 # default | exif | measured
+
+    def px_per_m(self, distance_m: float) -> Optional[float]:
+        """Pixels per meter for an object distance_m away (pinhole model)."""
+        if not distance_m or distance_m <= 0:
+            return None
+        return (self.px_per_m_1m or self.focal_px) / distance_m
+
+def device_key(exif: Dict[str, object], width: int, height: int, device_id: Optional[str] = None) -> Optional[str]:
+    """Store key of the device, None when neither EXIF make/model nor device_id identify it."""
+    make = str(exif.get("make") or "").strip()
+    model = str(exif.get("model") or "").strip()
+    zoom = float(exif.get("digital_zoom") or 1.0) or 1.0
+    if make or model:
+        ident = f"{make or 'unknown'}|{model or 'unknown'}"
+    elif device_id is not None and str(device_id) != "":
+        ident = f"device|{device_id}"
+    else:
+        return None
+    return f"{ident}|{int(width)}x{int(height)}|zoom{zoom:.2f}"
+
+def calibration_from_exif(exif: Dict[str, object], width: int, height: int) -> Calibration:
+    """Focal length in pixels and sensor size from EXIF, the historical 6.3 mm / 0.9*width guess otherwise."""
+    f_mm = exif.get("focal_length_mm")
+    f35 = exif.get("focal_length_35mm")
+    sensor_w = None
+    if f_mm and f35:
+        # the 35 mm equivalent is defined on the 43.27 mm film diagonal: sensor diagonal
+        # from the crop factor, then its width share for this aspect ratio
+        pw = float(exif.get("pixel_width") or width)
+        ph = float(exif.get("pixel_height") or height)
+        if (pw >= ph) != (width >= height):
+            pw, ph = ph, pw            # EXIF dimensions before orientation
+        sensor_w = 43.27 * float(f_mm) / float(f35) * pw / math.hypot(pw, ph)
+    elif exif.get("focal_plane_x_res"):
+        unit_mm = {2: 25.4, 3: 10.0, 4: 1.0}.get(int(exif.get("focal_plane_res_unit") or 2), 25.4)
+        sensor_w = float(exif.get("pixel_width") or width) / float(exif["focal_plane_x_res"]) * unit_mm
+    if f_mm:
+        sensor_w = sensor_w or DEFAULT_SENSOR_WIDTH_MM
+        focal_px = float(f_mm) / sensor_w * width
+        sensor_h = sensor_w * height / width if width else None
+        return Calibration(focal_px, sensor_w, sensor_h, source="exif")
+    return Calibration(DEFAULT_FOCAL_RATIO * width)
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Exclusive inter-process lock on path (created if needed)."""
+    with open(path, "a+b") as f:
+        if FCNTL_OK:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if FCNTL_OK:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class CalibrationStore:
+    def __init__(self, path: str = CALIBRATION_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Calibration] = self._read()
+
+    def _read(self) -> Dict[str, Calibration]:
+        entries: Dict[str, Calibration] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            for key, d in raw.items():
+                d["dist_coeffs"] = tuple(d.get("dist_coeffs") or ())
+                entries[key] = Calibration(**d)
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as e:
+            log.warning(f"Ignoring unreadable calibration file {self.path}: {e}")
+        return entries
+
+    def _save(self, key: str, calib: Calibration):
+        """Merge the file's current entries, set key, and write only if the file changes."""
+        with _file_lock(self.path + ".lock"):
+            on_disk = self._read()
+            self._entries.update(on_disk)
+            self._entries[key] = calib
+            if on_disk.get(key) == calib:
+                return
+            on_disk[key] = calib
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({k: c._asdict() for k, c in on_disk.items()}, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+    def get(self, key: str) -> Optional[Calibration]:
+        return self._entries.get(key)
+
+    def put(self, key: Optional[str], calib: Calibration) -> Calibration:
+        """Store calib under key; a None key (unidentified device) is not persisted."""
+        if key is None:
+            return calib
+        with self._lock:
+            if self._entries.get(key) != calib:
+                self._save(key, calib)
+        return calib
+
+    def for_exif(self, exif: Dict[str, object], width: int, height: int,
+                 device_id: Optional[str] = None) -> Tuple[Optional[str], Calibration]:
+        """(key, calibration) of the device, derived from EXIF and stored on first sight.
+
+        Without make/model and device_id the key is None and nothing is stored or reused.
+        """
+        key = device_key(exif, width, height, device_id)
+        calib = self._entries.get(key) if key is not None else None
+        if calib is None:
+            calib = calibration_from_exif(exif, width, height)
+            if calib.source != "default":
+                self.put(key, calib)      # guesses are not persisted, a later EXIF may do better
+        return key, calib
+
+    def for_image(self, path: str, width: int, height: int,
+                  device_id: Optional[str] = None) -> Tuple[Optional[str], Calibration]:
+        return self.for_exif(read_exif(path), width, height, device_id)
+
+    def record_reference(self, key: Optional[str], px_size: float, real_size_m: float, distance_m: float) -> Calibration:
+        """Measured object of real_size_m spanning px_size pixels at distance_m: sets px_per_m_1m."""
+        base = self._entries.get(key) or Calibration(px_size / real_size_m * distance_m)
+        return self.put(key, base._replace(px_per_m_1m=px_size / real_size_m * distance_m, source="measured"))
+
+_STORES: Dict[str, CalibrationStore] = {}
+_SLOCK = threading.Lock()
+
+def get_calibration_store(path: str = CALIBRATION_FILE) -> CalibrationStore:
+    key = os.path.abspath(path)
+    with _SLOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = CalibrationStore(path)
+        return store
@@ -0,0 +1,249 @@
+from __future__ import annotations
+import atexit
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+import cv2
+
+log = logging.getLogger("camera_pool")
+
+# Process-wide camera handles. Opening a V4L2 device and negotiating its format
+# costs most of a shot's latency, so each device is opened once and kept open.
+# Frames are read into a small ring of pre-allocated buffers (cap.read writes
+# into the given array when shape and dtype match), and callers get read-only
+# views into that ring: a view stays valid until `buffers` further captures on
+# the same handle, copy it to keep it longer.
+#
+# Sources: a device index, "/dev/videoN", a video file, or "file:<path>" for
+# the file-backed fake device (an image, a glob/directory of images or a video),
+# which stands in for the camera in tests and on machines without one. Image
+# sources are served at FAKE_FPS, or at the rate given as "file:<path>?fps=N".
+
+FAKE_PREFIX = "file:"
+FAKE_FPS = 30.0
+RING_BUFFERS = 3
+READ_TIMEOUT_S = 2.0
+_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+Source = Union[int, str]
+
+def parse_source(source: Source) -> Source:
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+def is_device(source: Source) -> bool:
+    return isinstance(source, int) or str(source).startswith("/dev/video")
+
+class FileCamera:
+    """cv2.VideoCapture stand-in serving frames from files, looping forever."""
+    def __init__(self, path: str, fps: Optional[float] = None):
+        self.path = path
+        self.fps = fps
+        self._video = None
+        self._images: List[str] = []
+        self._i = 0
+        self._next_t = time.monotonic()
+        if os.path.isdir(path):
+            self._images = sorted(p for p in glob.glob(os.path.join(path, "*")) if p.lower().endswith(_IMAGE_EXTS))
+        elif any(ch in path for ch in "*?["):
+            self._images = sorted(glob.glob(path))
+        elif path.lower().endswith(_IMAGE_EXTS):
+            self._images = [path] if os.path.exists(path) else []
+        else:
+            self._video = cv2.VideoCapture(path)
+        if self._images and not self.fps:
+            self.fps = FAKE_FPS      # like a real camera, images are not served faster than a frame rate
+        self._cache: Dict[str, np.ndarray] = {}
+
+    def isOpened(self) -> bool:
+        return bool(self._images) or (self._video is not None and self._video.isOpened())
+
+    def _pace(self):
+        if self.fps:
+            self._next_t += 1.0 / self.fps
+            delay = self._next_t - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self._next_t = time.monotonic()
+
+    def read(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        if not self.isOpened():
+            return False, None
+        self._pace()
+        if self._video is not None:
+            ok, frame = self._video.read(image)
+            if not ok:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self._video.read(image)
+            return ok, frame
+        p = self._images[self._i % len(self._images)]
+        self._i += 1
+        src = self._cache.get(p)
+        if src is None:
+            src = cv2.imread(p, cv2.IMREAD_COLOR)
+            if src is None:
+                return False, None
+            self._cache[p] = src
+        if image is not None and image.shape == src.shape and image.dtype == src.dtype:
+            np.copyto(image, src)
+            return True, image
+        return True, src.copy()
+
+    def grab(self) -> bool:
+        return self.isOpened()
+
+    def get(self, prop) -> float:
+        if self._video is not None:
+            return self._video.get(prop)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps or 0.0)
+        return 0.0
+
+    def set(self, prop, value) -> bool:
+        return self._video.set(prop, value) if self._video is not None else False
+
+    def release(self):
+        if self._video is not None:
+            self._video.release()
+        self._cache.clear()
+
+def open_capture(source: Source):
+    """Capture for source: FileCamera for "file:" sources, V4L2 backend for devices, default otherwise."""
+    source = parse_source(source)
+    if isinstance(source, str) and source.startswith(FAKE_PREFIX):
+        path, _, query = source[len(FAKE_PREFIX):].partition("?")
+        params = dict(kv.partition("=")[::2] for kv in query.split("&") if kv)
+        cap = FileCamera(path, float(params["fps"]) if params.get("fps") else None)
+        if not cap.isOpened():
+            raise IOError(f"fake camera has no frames: {source!r}")
+        return cap
+    cap = None
+    if is_device(source):
+        try:
+            cap = cv2.VideoCapture(source, cv2.CAP_V4L)
+        except Exception:
+            cap = None
+    if cap is None or not cap.isOpened():
+        cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        cap.release()
+        raise IOError(f"cannot open camera source {source!r}")
+    return cap
+
+class CameraHandle:
+    """One open capture with a ring of frame buffers; capture() is serialized per device."""
+    def __init__(self, source: Source, buffers: int = RING_BUFFERS):
+        self.source = parse_source(source)
+        self._lock = threading.Lock()
+        t0 = time.perf_counter()
+        self._cap = open_capture(self.source)
+        if is_device(self.source):
+            # a shallow driver queue keeps frames fresh between sparse captures
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.open_ms = (time.perf_counter() - t0) * 1000.0
+        self._bgr: List[Optional[np.ndarray]] = [None] * max(1, buffers)
+        self._rgb: List[Optional[np.ndarray]] = [None] * max(1, buffers)
+        self._slot = 0
+        self.captures = 0
+        self.dropped = 0          # failed reads (timeouts, empty frames)
+        self.last_latency_ms: Optional[float] = None
+        self._latency_sum = 0.0
+
+    def capture(self, rgb: bool = False, timeout_s: float = READ_TIMEOUT_S) -> Optional[np.ndarray]:
+        """Read-only view of a fresh frame (BGR, or RGB when rgb=True); None if nothing arrived in time."""
+        with self._lock:
+            i = self._slot
+            t0 = time.perf_counter()
+            frame = None
+            while True:
+                buf = self._bgr[i]
+                if buf is not None:
+                    buf.flags.writeable = True
+                ok, f = self._cap.read(buf)
+                if ok and f is not None:
+                    frame = f
+                    break
+                self.dropped += 1
+                if time.perf_counter() - t0 >= timeout_s:
+                    break
+                time.sleep(0.005)
+            if frame is None:
+                return None
+            self._bgr[i] = frame      # same array as buf once the shape is settled
+            out = frame
+            if rgb:
+                dst = self._rgb[i]
+                if dst is None or dst.shape != frame.shape:
+                    dst = self._rgb[i] = np.empty_like(frame)
+                dst.flags.writeable = True
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=dst)
+                out = dst
+            self._slot = (i + 1) % len(self._bgr)
+            latency = (time.perf_counter() - t0) * 1000.0
+            self.last_latency_ms = latency
+            self._latency_sum += latency
+            self.captures += 1
+            view = out.view()
+            view.flags.writeable = False
+            return view
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {
+            'source': str(self.source),
+            'open_ms': round(self.open_ms, 1),
+            'captures': self.captures,
+            'dropped': self.dropped,
+            'last_latency_ms': None if self.last_latency_ms is None else round(self.last_latency_ms, 1),
+            'mean_latency_ms': round(self._latency_sum / self.captures, 1) if self.captures else None,
+        }
+
+    def close(self):
+        with self._lock:
+            try:
+                self._cap.release()
+            except Exception:
+                pass
+
+class CameraPool:
+    def __init__(self, buffers: int = RING_BUFFERS):
+        self.buffers = buffers
+        self._handles: Dict[Source, CameraHandle] = {}
+        self._lock = threading.Lock()
+
+    def get(self, source: Source) -> CameraHandle:
+        """Handle for source, opened on first use."""
+        key = parse_source(source)
+        with self._lock:
+            h = self._handles.get(key)
+            if h is None:
+                h = self._handles[key] = CameraHandle(key, self.buffers)
+                log.info(f"Opened camera {key!r} in {h.open_ms:.0f} ms")
+            return h
+
+    def release(self, source: Optional[Source] = None):
+        """Close one handle (or all); the next get() reopens it."""
+        with self._lock:
+            keys = list(self._handles) if source is None else [parse_source(source)]
+            for key in keys:
+                h = self._handles.pop(key, None)
+                if h is not None:
+                    h.close()
+
+    def stats(self) -> List[Dict[str, Optional[float]]]:
+        with self._lock:
+            return [h.stats() for h in self._handles.values()]
+
+_POOL = CameraPool()
+atexit.register(_POOL.release)
+
+def get_camera(source: Source) -> CameraHandle:
+    return _POOL.get(source)
+
+def camera_pool() -> CameraPool:
+    return _POOL
@@ -0,0 +1,281 @@
+from __future__ import annotations
+import argparse
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+import cv2
+
+from camera_pool import Source, camera_pool, is_device, open_capture, parse_source
+from mask_cleanup import largest_component
+from mask_geometry import mask_geometry
+from sensor_sampler import robust_median
+
+log = logging.getLogger("camera_stream")
+
+# Streaming height measurement. A FrameGrabber keeps the camera (or a video file
+# standing in for it) open and reads frames on its own thread into a single
+# latest-frame slot, so a slow consumer only ever sees the newest frame and
+# stale ones are dropped. StreamMeasurement segments every Nth frame, measures
+# the tree's pixel height and fuses the per-frame values with a running robust
+# estimate (median of a sliding window after MAD rejection) until the standard
+# error falls under a relative tolerance.
+#
+# ARBOR_CAMERA_SOURCE: device index, /dev/videoN, a video file path, or a
+# "file:" fake device (see camera_pool).
+
+CAMERA_SOURCE = os.environ.get("ARBOR_CAMERA_SOURCE", "0")
+EVERY_N = 3
+FUSION_WINDOW = 60
+FUSION_MIN_SAMPLES = 5
+FUSION_REL_TOL = 0.02
+
+Measure = Callable[[np.ndarray], Optional[float]]   # RGB frame -> pixel height
+
+class FrameGrabber:
+    """Background reader keeping only the most recent frame (BGR, as read)."""
+    def __init__(self, source: Source = CAMERA_SOURCE, realtime: Optional[bool] = None, loop: bool = False):
+        self.source = parse_source(source)
+        # a file is paced at its own frame rate so it behaves like a live camera
+        self.realtime = (not is_device(self.source)) if realtime is None else realtime
+        self.loop = loop
+        self._cap = None
+        self._cond = threading.Condition()
+        self._frame: Optional[np.ndarray] = None
+        self._t = 0.0
+        self._seq = 0          # frames read so far
+        self._taken = 0        # seq of the last frame handed out
+        self.dropped = 0       # frames overwritten before anyone took them
+        self.eof = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            if is_device(self.source):
+                # a V4L2 device has a single reader: take it over from the pool
+                # (preview captures) rather than opening it a second time
+                camera_pool().release(self.source)
+            self._cap = open_capture(self.source)
+            self._stop.clear()
+            self.eof = False
+            self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _run(self):
+        fps = self._cap.get(cv2.CAP_PROP_FPS) or 0.0
+        period = 1.0 / fps if self.realtime and 0 < fps < 240 else 0.0
+        next_t = time.monotonic()
+        while not self._stop.is_set():
+            ok, frame = self._cap.read()
+            if not ok or frame is None:
+                if not is_device(self.source):
+                    if self.loop:
+                        self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    with self._cond:
+                        self.eof = True
+                        self._cond.notify_all()
+                    return
+                time.sleep(0.01)
+                continue
+            with self._cond:
+                if self._frame is not None and self._taken < self._seq:
+                    self.dropped += 1
+                self._frame, self._t = frame, time.monotonic()
+                self._seq += 1
+                self._cond.notify_all()
+            if period:
+                next_t += period
+                delay = next_t - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    next_t = time.monotonic()
+
+    def latest(self) -> Tuple[int, Optional[np.ndarray]]:
+        """(seq, frame) of the newest frame without waiting; frame is None before the first one."""
+        with self._cond:
+            if self._frame is not None:
+                self._taken = self._seq
+            return self._seq, self._frame
+
+    def wait_next(self, after_seq: int, timeout: float = 1.0) -> Tuple[int, Optional[np.ndarray]]:
+        """Newest frame with seq > after_seq; (after_seq, None) on timeout or end of file."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._seq <= after_seq and not self.eof and not self._stop.is_set():
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return after_seq, None
+                self._cond.wait(left)
+            if self._seq <= after_seq:
+                return after_seq, None
+            self._taken = self._seq
+            return self._seq, self._frame
+
+    @property
+    def frames(self) -> int:
+        return self._seq
+
+class HeightFusion:
+    """Robust running estimate of a pixel height over the last `window` measurements."""
+    def __init__(self, window: int = FUSION_WINDOW, min_samples: int = FUSION_MIN_SAMPLES,
+                 rel_tol: float = FUSION_REL_TOL):
+        self.window = window
+        self.min_samples = min_samples
+        self.rel_tol = rel_tol
+        self._values = np.full(window, np.nan, np.float64)
+        self._n = 0
+        self._lock = threading.Lock()
+
+    def add(self, px_height: Optional[float]):
+        if px_height is None or not np.isfinite(px_height) or px_height <= 0:
+            return
+        with self._lock:
+            self._values[self._n % self.window] = float(px_height)
+            self._n += 1
+
+    def reset(self):
+        with self._lock:
+            self._values[:] = np.nan
+            self._n = 0
+
+    def estimate(self) -> Dict[str, object]:
+        with self._lock:
+            values = self._values.copy()
+            total = self._n
+        out = {'px_height': None, 'samples': 0, 'spread_px': None, 'rel_error': None,
+               'converged': False, 'measured': total}
+        est = robust_median(values, k=3.0)
+        if est is None:
+            return out
+        med, n, mad = est
+        # standard error of the median ~ 1.2533 * sigma / sqrt(n), sigma estimated by the MAD
+        rel_err = 1.2533 * max(mad, 0.5) / np.sqrt(n) / med if med > 0 else None
+        out.update({'px_height': round(med, 1), 'samples': n, 'spread_px': round(mad, 2),
+                    'rel_error': None if rel_err is None else round(float(rel_err), 4),
+                    'converged': bool(n >= self.min_samples and rel_err is not None and rel_err <= self.rel_tol)})
+        return out
+
+def vegetation_mask(img_rgb: np.ndarray) -> np.ndarray:
+    """Fast colour segmentation of the tree (green foliage and brown trunk), largest component only."""
+    hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
+    mask = cv2.inRange(hsv, np.array([25, 30, 30], np.uint8), np.array([95, 255, 255], np.uint8))
+    mask |= cv2.inRange(hsv, np.array([8, 50, 20], np.uint8), np.array([25, 255, 200], np.uint8))
+    k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, k)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, k)
+    return largest_component(mask)
+
+def tree_pixel_height(img_rgb: np.ndarray, segment: Callable[[np.ndarray], np.ndarray] = vegetation_mask,
+                      min_area_ratio: float = 0.005) -> Optional[float]:
+    """Pixel distance between the base and the top of the segmented tree, None if nothing was found."""
+    mask = segment(img_rgb)
+    if mask is None or mask.sum() < min_area_ratio * mask.size:
+        return None
+    geom = mask_geometry(mask.astype(np.uint8) * 255)
+    if geom is None:
+        return None
+    (xb, yb), (xt, yt) = geom.base_vertical, geom.top_vertical
+    return float(np.hypot(xb - xt, yb - yt))
+
+class StreamMeasurement:
+    """Measure every Nth grabbed frame on a worker thread and fuse the pixel heights."""
+    def __init__(self, source: Source = CAMERA_SOURCE, every_n: int = EVERY_N,
+                 measure: Measure = tree_pixel_height, fusion: Optional[HeightFusion] = None,
+                 grabber: Optional[FrameGrabber] = None):
+        self.grabber = grabber or FrameGrabber(source)
+        self.every_n = max(1, every_n)
+        self.measure = measure
+        self.fusion = fusion or HeightFusion()
+        self.processed = 0
+        self.last_frame: Optional[np.ndarray] = None   # RGB of the last measured frame
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.grabber.start()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="stream-measure", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self.grabber.stop()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        last = 0
+        while not self._stop.is_set():
+            seq, frame = self.grabber.wait_next(last + self.every_n - 1, timeout=0.5)
+            if frame is None:
+                if self.grabber.eof:
+                    return
+                continue
+            last = seq
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            try:
+                self.fusion.add(self.measure(rgb))
+            except Exception as e:
+                log.debug(f"frame {seq} not measured: {e}")
+            self.last_frame = rgb
+            self.processed += 1
+
+    def estimate(self) -> Dict[str, object]:
+        out = self.fusion.estimate()
+        out.update({'frames': self.grabber.frames, 'processed': self.processed, 'dropped': self.grabber.dropped})
+        return out
+
+    def wait_converged(self, timeout_s: float = 10.0, poll_s: float = 0.1) -> Dict[str, object]:
+        """Block until the estimate converges, the source ends or timeout_s elapses."""
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            est = self.estimate()
+            if est['converged'] or not self.running:
+                return est
+            time.sleep(poll_s)
+        return self.estimate()
+
+def main():
+    ap = argparse.ArgumentParser(description="Streaming tree height measurement (pixels) from a camera or a video file")
+    ap.add_argument("--source", default=CAMERA_SOURCE, help="device index, /dev/videoN or video file")
+    ap.add_argument("--every", type=int, default=EVERY_N, help="measure every Nth frame")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--tol", type=float, default=FUSION_REL_TOL, help="relative standard error for convergence")
+    ap.add_argument("--px-per-m", type=float, default=None, help="calibration, to report meters")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    sm = StreamMeasurement(args.source, every_n=args.every, fusion=HeightFusion(rel_tol=args.tol)).start()
+    t0 = time.monotonic()
+    try:
+        est = sm.wait_converged(args.timeout)
+    finally:
+        sm.stop()
+    est['elapsed_s'] = round(time.monotonic() - t0, 2)
+    if args.px_per_m and est['px_height']:
+        est['height_m'] = round(est['px_height'] / args.px_per_m, 2)
+    log.info(est)
+
+if __name__ == "__main__":
+    main()
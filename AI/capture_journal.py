@@ -0,0 +1,207 @@
+from __future__ import annotations
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_OK = True
+except Exception:
+    PYARROW_OK = False
+
+log = logging.getLogger("capture_journal")
+
+# Append-only capture log. Each capture is one JSON line appended to
+# journal.jsonl (constant cost, whatever the session length). Lines are flushed
+# immediately and fsync'ed in batches. Every `compact_every` records the journal
+# is sealed (renamed) and rewritten as a Parquet segment; readers merge the
+# segments, any sealed journal not yet compacted, and the live journal tail.
+#
+#   <root>/journal.jsonl           live journal
+#   <root>/sealed-000007.jsonl     sealed, compaction pending (or interrupted)
+#   <root>/segment-000007.parquet  compacted
+
+CAPTURE_SCHEMA = (
+    ("filename", "str"), ("filepath", "str"), ("timestamp", "str"), ("tree_id", "str"),
+    ("ultrasound_m", "float"), ("laser_m", "float"),
+    ("roi_x1", "int"), ("roi_y1", "int"), ("roi_x2", "int"), ("roi_y2", "int"),
+    ("px_per_m", "float"),
+    ("extra", "str"),  # JSON object with any field outside the schema
+)
+CAPTURE_FIELDS = tuple(name for name, _ in CAPTURE_SCHEMA)
+
+COMPACT_EVERY = 500
+FSYNC_EVERY = 8
+FSYNC_INTERVAL_S = 2.0
+
+_CASTS = {"str": str, "float": float, "int": int}
+_SEQ_RE = re.compile(r"-(\d+)\.(?:jsonl|parquet)$")
+
+def normalize_capture(row: Dict) -> Dict:
+    """Row restricted to CAPTURE_SCHEMA; '' / None become null, unknown keys go to 'extra'."""
+    out = {}
+    for name, kind in CAPTURE_SCHEMA[:-1]:
+        v = row.get(name)
+        if v is None or v == "":
+            out[name] = None
+            continue
+        try:
+            out[name] = _CASTS[kind](v)
+        except (TypeError, ValueError):
+            out[name] = None
+    extra = {k: v for k, v in row.items() if k not in CAPTURE_FIELDS}
+    out["extra"] = json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+    return out
+
+def _arrow_schema():
+    types = {"str": pa.string(), "float": pa.float64(), "int": pa.int64()}
+    return pa.schema([(name, types[kind]) for name, kind in CAPTURE_SCHEMA])
+
+def _read_jsonl(path: str) -> List[Dict]:
+    rows = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    pass  # torn last line after a crash
+    except FileNotFoundError:
+        pass
+    return rows
+
+def _seq(path: str) -> int:
+    m = _SEQ_RE.search(path)
+    return int(m.group(1)) if m else 0
+
+class CaptureJournal:
+    def __init__(self, root: str, compact_every: int = COMPACT_EVERY,
+                 fsync_every: int = FSYNC_EVERY, fsync_interval_s: float = FSYNC_INTERVAL_S):
+        self.root = root
+        self.compact_every = compact_every
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval_s = fsync_interval_s
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "journal.jsonl")
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._f = open(self.path, "a", encoding="utf-8")
+        with open(self.path, "rb") as f:
+            self._count = sum(1 for _ in f)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        existing = glob.glob(os.path.join(root, "sealed-*.jsonl")) + glob.glob(os.path.join(root, "segment-*.parquet"))
+        self._next_seq = max([_seq(p) for p in existing] + [0]) + 1
+        # finish compactions interrupted by a crash
+        for sealed in sorted(glob.glob(os.path.join(root, "sealed-*.jsonl"))):
+            self._compact_sealed(sealed)
+
+    def append(self, row: Dict) -> Dict:
+        rec = normalize_capture(row)
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self._count += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval_s:
+                self._sync()
+            due = PYARROW_OK and self._count >= self.compact_every
+        if due:
+            self.compact()
+        return rec
+
+    def _sync(self):
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._unsynced:
+                self._f.flush()
+                self._sync()
+
+    def compact(self) -> Optional[str]:
+        """Seal the live journal and rewrite it as a Parquet segment."""
+        if not PYARROW_OK:
+            return None
+        with self._compact_lock:
+            with self._lock:
+                if self._count == 0:
+                    return None
+                self._f.flush()
+                self._sync()
+                self._f.close()
+                sealed = os.path.join(self.root, f"sealed-{self._next_seq:06d}.jsonl")
+                self._next_seq += 1
+                os.replace(self.path, sealed)
+                self._f = open(self.path, "a", encoding="utf-8")
+                self._count = 0
+            return self._compact_sealed(sealed)
+
+    def _compact_sealed(self, sealed: str) -> Optional[str]:
+        if not PYARROW_OK:
+            return None
+        rows = _read_jsonl(sealed)
+        segment = os.path.join(self.root, f"segment-{_seq(sealed):06d}.parquet")
+        tmp = segment + ".tmp"
+        table = pa.Table.from_pylist([{k: r.get(k) for k in CAPTURE_FIELDS} for r in rows], schema=_arrow_schema())
+        pq.write_table(table, tmp)
+        os.replace(tmp, segment)
+        os.remove(sealed)
+        log.info(f"Compacted {len(rows)} captures into {segment}")
+        return segment
+
+    def read(self, legacy_csv: Optional[str] = None):
+        """All captures as a DataFrame: legacy CSV, segments, pending sealed journals, live tail."""
+        import pandas as pd
+        self.flush()
+        frames = []
+        if legacy_csv and os.path.exists(legacy_csv):
+            legacy = pd.read_csv(legacy_csv)
+            frames.append(pd.DataFrame([normalize_capture(r) for r in legacy.to_dict("records")], columns=list(CAPTURE_FIELDS)))
+        rows = []
+        # consistent snapshot: no compaction can seal the journal or turn a sealed
+        # file into a segment while the files are listed and read (appends go on)
+        with self._compact_lock:
+            segments = sorted(glob.glob(os.path.join(self.root, "segment-*.parquet")), key=_seq)
+            compacted = {_seq(p) for p in segments}
+            for seg in segments:
+                frames.append(pd.read_parquet(seg))
+            for sealed in sorted(glob.glob(os.path.join(self.root, "sealed-*.jsonl")), key=_seq):
+                if _seq(sealed) not in compacted:      # segment written, sealed file not yet removed
+                    rows.extend(_read_jsonl(sealed))
+            rows.extend(_read_jsonl(self.path))
+        if rows:
+            frames.append(pd.DataFrame(rows, columns=list(CAPTURE_FIELDS)))
+        if not frames:
+            return pd.DataFrame(columns=list(CAPTURE_FIELDS))
+        return pd.concat(frames, ignore_index=True)[list(CAPTURE_FIELDS)]
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._f.flush()
+                self._sync()
+                self._f.close()
+
+_JOURNALS: Dict[str, CaptureJournal] = {}
+_JLOCK = threading.Lock()
+
+def get_capture_journal(root: str) -> CaptureJournal:
+    """Shared journal per directory (all sessions of the app share a process)."""
+    key = os.path.abspath(root)
+    with _JLOCK:
+        j = _JOURNALS.get(key)
+        if j is None:
+            j = _JOURNALS[key] = CaptureJournal(root)
+            atexit.register(j.close)
+        return j
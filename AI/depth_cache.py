@@ -0,0 +1,87 @@
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import threading
+from typing import Optional
+import numpy as np
+
+log = logging.getLogger("depth_cache")
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "ARBOR_DEPTH_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "arborvision", "depth"),
+)
+DEFAULT_MAX_BYTES = int(os.environ.get("ARBOR_DEPTH_CACHE_MB", "512")) * 1024 * 1024
+
+def depth_cache_key(img_rgb: np.ndarray, model_type: str, sparse: bool = False) -> str:
+    """Image content hash + model type + resolution (+ sparse/full output)."""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(img_rgb).data)
+    H, W = img_rgb.shape[:2]
+    mode = "sparse" if sparse else "full"
+    return f"{h.hexdigest()}_{model_type}_{W}x{H}_{mode}"
+
+class DepthCache:
+    """On-disk LRU cache of depth maps.
+
+    Entries are float16 .npy files opened with mmap_mode="r", so a hit costs a
+    page-in of the samples actually read instead of a full decode. float16 .npy
+    is used instead of np.savez_compressed because compressed archives cannot be
+    memory-mapped. Recency is tracked through file mtimes; the oldest entries are
+    evicted once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            depth = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        log.info(f"Depth cache hit: {key}")
+        return depth
+
+    def put(self, key: str, depth: np.ndarray) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, depth.astype(np.float16))
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith(".npy"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.root, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(e[1] for e in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.root, name))
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in os.listdir(self.root):
+                if name.endswith(".npy"):
+                    os.remove(os.path.join(self.root, name))
@@ -0,0 +1,198 @@
+from __future__ import annotations
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, Tuple, Optional
+
+try:
+    import torch
+    TORCH_OK = True
+except Exception:
+    TORCH_OK = False
+    torch = None
+
+log = logging.getLogger("depth_models")
+
+# Local depth-model store (no network access at run time).
+#
+# Layout of MODEL_STORE:
+#   manifest.json            {"MiDaS_small": {"file": "MiDaS_small.pt", "sha256": "..."}, ...}
+#   <model_type>.pt          state_dict saved by --provision
+#   hub/                     torch.hub cache holding intel-isl/MiDaS (and its backbone repos)
+#
+# The store is filled once on a connected machine with
+#   python depth_models.py --provision MiDaS_small
+# and copied as-is to the field servers.
+
+DEPTH_MODEL_TYPES = ("MiDaS_small", "DPT_Hybrid", "DPT_Large")
+DEFAULT_DEPTH_MODEL = os.environ.get("ARBOR_DEPTH_MODEL", "MiDaS_small")
+DEFAULT_DEPTH_DEVICE = os.environ.get("ARBOR_DEPTH_DEVICE", "cpu")
+MODEL_STORE = os.environ.get(
+    "ARBOR_MODEL_STORE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "depth"),
+)
+MIDAS_REPO_DIRNAME = "intel-isl_MiDaS_master"
+
+_CACHE: Dict[Tuple[str, str], tuple] = {}
+_VERIFIED: Dict[str, str] = {}
+_LOCK = threading.Lock()
+
+class DepthModelError(RuntimeError):
+    pass
+
+def _manifest_path(store: str) -> str:
+    return os.path.join(store, "manifest.json")
+
+def _read_manifest(store: str) -> dict:
+    path = _manifest_path(store)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def verified_weights_path(model_type: str, store: str = MODEL_STORE) -> str:
+    """Return the weight file for model_type after checking it against the manifest checksum."""
+    entry = _read_manifest(store).get(model_type)
+    if entry is None:
+        raise DepthModelError(f"{model_type} is not provisioned in {store} (run depth_models.py --provision {model_type})")
+    path = os.path.join(store, entry["file"])
+    if not os.path.isfile(path):
+        raise DepthModelError(f"Missing weight file: {path}")
+    if _VERIFIED.get(path) != entry["sha256"]:
+        digest = file_sha256(path)
+        if digest != entry["sha256"]:
+            raise DepthModelError(f"Checksum mismatch for {path}: expected {entry['sha256']}, got {digest}")
+        _VERIFIED[path] = digest
+    return path
+
+def _midas_repo(store: str) -> str:
+    repo = os.path.join(store, "hub", MIDAS_REPO_DIRNAME)
+    if not os.path.isdir(repo):
+        raise DepthModelError(f"MiDaS code not found in store: {repo}")
+    return repo
+
+def _local_hub_repo(hub_dir: str, repo: str) -> Optional[str]:
+    """Directory of a github "owner/name[:ref]" repo inside a torch.hub cache, as torch.hub names it."""
+    name, _, ref = repo.partition(":")
+    owner, _, project = name.partition("/")
+    pattern = f"{owner}_{project}_{ref}" if ref else f"{owner}_{project}_*"
+    found = sorted(d for d in glob.glob(os.path.join(hub_dir, pattern)) if os.path.isdir(d))
+    return found[0] if found else None
+
+@contextlib.contextmanager
+def _store_hub(store: str, offline: bool = True):
+    """torch.hub pointed at the store for the duration of a load, then restored.
+
+    offline: nested github loads (the efficientnet backbone hubconf of MiDaS_small
+    calls torch.hub.load("rwightman/gen-efficientnet-pytorch", ...)) are served
+    from the copy provisioned in the store with source="local", since resolving a
+    github repo, even a cached one, may query github for its default branch.
+    Only calls from the loading thread are redirected; other threads (model_cache)
+    keep the stock torch.hub.load.
+    """
+    hub_dir = os.path.join(store, "hub")
+    prev_dir = torch.hub.get_dir()
+    orig_load = torch.hub.load
+    owner = threading.get_ident()
+
+    def local_load(repo_or_dir, model, *args, source="github", **kwargs):
+        if source == "github" and threading.get_ident() == owner:
+            local = _local_hub_repo(hub_dir, repo_or_dir)
+            if local is None:
+                raise DepthModelError(f"{repo_or_dir} is not provisioned in {hub_dir}")
+            kwargs.pop("trust_repo", None)
+            kwargs.pop("force_reload", None)
+            return orig_load(local, model, *args, source="local", **kwargs)
+        return orig_load(repo_or_dir, model, *args, source=source, **kwargs)
+
+    torch.hub.set_dir(hub_dir)
+    if offline:
+        torch.hub.load = local_load
+    try:
+        yield hub_dir
+    finally:
+        torch.hub.load = orig_load
+        torch.hub.set_dir(prev_dir)
+
+def build_depth_model(model_type: str, device: str = "cpu", store: str = MODEL_STORE):
+    """Uncached (model, transform) from the local store; see get_depth_model for the cached one."""
+    if not TORCH_OK:
+        raise DepthModelError("torch is not available")
+    weights = verified_weights_path(model_type, store)
+    repo = _midas_repo(store)
+    # nested torch.hub lookups (e.g. the efficientnet backbone of MiDaS_small) stay inside the store
+    with _store_hub(store):
+        model = torch.hub.load(repo, model_type, source="local", pretrained=False)
+        transforms = torch.hub.load(repo, "transforms", source="local")
+    model.load_state_dict(torch.load(weights, map_location="cpu"))
+    model.to(device).eval()
+    transform = transforms.dpt_transform if "DPT" in model_type else transforms.small_transform
+    return model, transform
+
+def get_depth_model(model_type: Optional[str] = None, device=None, store: str = MODEL_STORE):
+    """Process-wide cached (model, transform) for (model_type, device), loaded from the local store only."""
+    if not TORCH_OK:
+        raise DepthModelError("torch is not available")
+    model_type = model_type or DEFAULT_DEPTH_MODEL
+    if model_type not in DEPTH_MODEL_TYPES:
+        raise DepthModelError(f"Unknown depth model: {model_type} (expected one of {', '.join(DEPTH_MODEL_TYPES)})")
+    device = str(device or DEFAULT_DEPTH_DEVICE)
+    key = (model_type, device)
+    with _LOCK:
+        if key not in _CACHE:
+            log.info(f"Loading depth model {model_type} on {device} from {store}")
+            _CACHE[key] = build_depth_model(model_type, device, store)
+        return _CACHE[key]
+
+def clear_cache():
+    with _LOCK:
+        _CACHE.clear()
+
+def provision(model_type: str, store: str = MODEL_STORE) -> str:
+    """Download model_type through torch.hub into the store and record its checksum. Needs network."""
+    os.makedirs(store, exist_ok=True)
+    # online: the MiDaS repo and its backbone repos land in the store's hub cache
+    with _store_hub(store, offline=False):
+        model = torch.hub.load("intel-isl/MiDaS", model_type, trust_repo=True)
+        torch.hub.load("intel-isl/MiDaS", "transforms", trust_repo=True)
+    fname = f"{model_type}.pt"
+    path = os.path.join(store, fname)
+    torch.save(model.state_dict(), path)
+    manifest = _read_manifest(store)
+    manifest[model_type] = {"file": fname, "sha256": file_sha256(path)}
+    with open(_manifest_path(store), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    log.info(f"Provisioned {model_type} -> {path}")
+    return path
+
+def _parse_args():
+    p = argparse.ArgumentParser(description="Local MiDaS depth-model store")
+    p.add_argument("--store", type=str, default=MODEL_STORE)
+    p.add_argument("--provision", type=str, nargs="+", choices=DEPTH_MODEL_TYPES, help="Download and register models (needs network)")
+    p.add_argument("--verify", action="store_true", help="Check every registered weight file against its checksum")
+    return p.parse_args()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    args = _parse_args()
+    for model_type in args.provision or []:
+        provision(model_type, args.store)
+    if args.verify:
+        for model_type in _read_manifest(args.store):
+            verified_weights_path(model_type, args.store)
+            log.info(f"{model_type}: OK")
+
+if __name__ == "__main__":
+    main()
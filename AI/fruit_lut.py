@@ -0,0 +1,135 @@
+from __future__ import annotations
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import cv2
+
+# Single-pass multi-class fruit colour classification.
+#
+# Every fruit config is an HSV box [lower, upper]. The union of all box
+# boundaries splits each channel into a handful of cells, so the HSV cube is
+# quantised into (cells_h x cells_s x cells_v) without losing precision. Each
+# cell stores the index of its "combo" (the set of fruits whose box contains
+# it). One gather per channel then classifies every pixel for all enabled
+# fruits at once, independently of how many fruits are enabled.
+# Components come from one cleanup and one labelling of the combined mask. To
+# keep a fruit touching foliage of another colour class (lime and guava ranges
+# cover leaves) out of the leaf blob, pixels where two neighbours match
+# disjoint sets of fruits are cut from the mask before labelling; each label
+# then gets its fruits from one bincount over (label, combo) pairs.
+
+class FruitColorLUT:
+    def __init__(self, names: Sequence[str], lowers: np.ndarray, uppers: np.ndarray):
+        self.names = list(names)
+        lowers = np.asarray(lowers, dtype=np.int32).reshape(-1, 3)
+        uppers = np.asarray(uppers, dtype=np.int32).reshape(-1, 3)
+        self.cell_of = []   # per channel: value (0..255) -> cell index
+        inside = []         # per channel: (cells, K) bool, cell representative inside each box
+        for ch in range(3):  # OpenCV 8-bit HSV: H 0..179, S/V 0..255
+            cuts = np.unique(np.concatenate([[0, 256], np.clip(lowers[:, ch], 0, 256), np.clip(uppers[:, ch] + 1, 0, 256)]))
+            self.cell_of.append((np.searchsorted(cuts, np.arange(256), side="right") - 1).astype(np.intp))
+            reps = cuts[:-1]
+            inside.append((reps[:, None] >= lowers[None, :, ch]) & (reps[:, None] <= uppers[None, :, ch]))
+        full = inside[0][:, None, None, :] & inside[1][None, :, None, :] & inside[2][None, None, :, :]
+        K = len(self.names)
+        flat = full.reshape(-1, K)
+        # the all-False row sorts first, so combo 0 == "no fruit"
+        combos, codes = np.unique(np.vstack([np.zeros((1, K), bool), flat]), axis=0, return_inverse=True)
+        codes = codes.reshape(-1)
+        self.combos = combos                                     # (C, K) bool
+        self.cell_code = codes[1:].reshape(full.shape[:3]).astype(np.uint16)
+        # per combo, bit k set when fruit k matches (combo 0 -> 0)
+        dtype = np.uint64 if K > 32 else np.uint32
+        self.combo_bits = (combos.astype(dtype) << np.arange(K, dtype=dtype)).sum(axis=1, dtype=dtype) if K else np.zeros(len(combos), dtype)
+
+    @property
+    def n_combos(self) -> int:
+        return len(self.combos)
+
+    def combo_names(self, code: int) -> List[str]:
+        return [n for n, on in zip(self.names, self.combos[code]) if on]
+
+    def classify(self, hsv: np.ndarray) -> np.ndarray:
+        """Combo code per pixel (0 = no fruit)."""
+        h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+        return self.cell_code[self.cell_of[0][h], self.cell_of[1][s], self.cell_of[2][v]]
+
+@lru_cache(maxsize=8)
+def _build(key: Tuple[Tuple[str, Tuple[int, ...], Tuple[int, ...]], ...]) -> FruitColorLUT:
+    names = [k[0] for k in key]
+    return FruitColorLUT(names, np.array([k[1] for k in key]).reshape(-1, 3), np.array([k[2] for k in key]).reshape(-1, 3))
+
+def get_fruit_lut(fruit_masks: Dict[str, Sequence[np.ndarray]]) -> FruitColorLUT:
+    """LUT for {name: [lower, upper]}; rebuilt only when the configs change."""
+    key = tuple((name, tuple(int(x) for x in lo), tuple(int(x) for x in hi)) for name, (lo, hi) in fruit_masks.items())
+    return _build(key)
+
+def _class_boundaries(bits: np.ndarray) -> np.ndarray:
+    """Pixels with an 8-neighbour matching a disjoint, non-empty set of fruits."""
+    cut = np.zeros(bits.shape, dtype=bool)
+    h, w = bits.shape
+    # right, down, down-right, down-left neighbours; both pixels of a pair are cut
+    for (ya, xa), (yb, xb) in (((slice(0, h), slice(0, w - 1)), (slice(0, h), slice(1, w))),
+                               ((slice(0, h - 1), slice(0, w)), (slice(1, h), slice(0, w))),
+                               ((slice(0, h - 1), slice(0, w - 1)), (slice(1, h), slice(1, w))),
+                               ((slice(0, h - 1), slice(1, w)), (slice(1, h), slice(0, w - 1)))):
+        a, b = bits[ya, xa], bits[yb, xb]
+        edge = (a != 0) & (b != 0) & ((a & b) == 0)
+        cut[ya, xa] |= edge
+        cut[yb, xb] |= edge
+    return cut
+
+def detect_color_components(hsv: np.ndarray, lut: FruitColorLUT, min_area: int, kernel=None,
+                            min_share: float = 0.5) -> List[dict]:
+    """Connected fruit-coloured blobs with the fruits they match, best first.
+
+    One cleanup and one connectedComponentsWithStats on the combined mask,
+    whatever the number of fruits. A label lists every fruit matched by at
+    least min_share of the pixels of its most frequent fruit.
+    """
+    codes = lut.classify(hsv)
+    bits = lut.combo_bits[codes]
+    if kernel is None:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    mask = (codes > 0).astype(np.uint8) * 255
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask[_class_boundaries(bits)] = 0
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n <= 1:
+        return []
+    C = lut.n_combos
+    hist = np.bincount(labels.ravel().astype(np.int64) * C + codes.ravel(), minlength=n * C).reshape(n, C)
+    hist[:, 0] = 0
+    per_fruit = hist @ lut.combos.astype(np.int64)          # (labels, fruits) pixel counts
+
+    comps = []
+    # pixel count bounds the contour area from above, so smaller labels are skipped outright
+    for lbl in np.flatnonzero(stats[:, cv2.CC_STAT_AREA] >= min_area):
+        if lbl == 0:
+            continue
+        counts = per_fruit[lbl]
+        top = counts.max() if counts.size else 0
+        if top == 0:
+            continue
+        x, y, w, h = (int(v) for v in stats[lbl, :4])
+        # outer contour of this label only (a fruit lying inside a leaf blob is its own label)
+        roi = (labels[y:y + h, x:x + w] == lbl).astype(np.uint8)
+        cnts, _ = cv2.findContours(roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not cnts:
+            continue
+        c = max(cnts, key=cv2.contourArea)
+        area = cv2.contourArea(c)
+        if area < min_area:
+            continue
+        perimeter = cv2.arcLength(c, True)
+        if perimeter <= 0:
+            continue
+        order = np.argsort(-counts, kind="stable")
+        comps.append({
+            'names': [lut.names[k] for k in order if counts[k] >= min_share * top],
+            'area': float(area),
+            'circularity': float(4 * np.pi * area / (perimeter * perimeter)),
+            'box': [x, y, x + w, y + h],
+        })
+    return comps
@@ -0,0 +1,406 @@
+from __future__ import annotations
+import argparse
+import ast
+import contextlib
+import csv
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import cv2
+
+try:
+    import psutil
+    PSUTIL_OK = True
+except Exception:
+    PSUTIL_OK = False
+try:
+    import resource
+    RESOURCE_OK = True
+except ImportError:  # Windows
+    RESOURCE_OK = False
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+log = logging.getLogger("height_benchmark")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+# Manifest CSV: one row per image, paths relative to the manifest.
+#   image,height_m[,pixel_per_meter,camera_height_m,distance_m,angle_base_deg,angle_top_deg,size_class]
+MANIFEST_FIELDS = ["image", "height_m", "pixel_per_meter", "camera_height_m",
+                   "distance_m", "angle_base_deg", "angle_top_deg", "size_class"]
+SIZE_CLASSES = ("PETIT", "MOYEN", "GRAND")
+
+def size_class_m(height_m: float) -> str:
+    # same metric thresholds as arborvision_streamlit_v4.calculate_real_tree_height_with_distance
+    if height_m < 3: return "PETIT"
+    if height_m < 8: return "MOYEN"
+    return "GRAND"
+
+# --------------------------- Dataset ---------------------------
+
+def read_manifest(path: str) -> List[dict]:
+    root = os.path.dirname(os.path.abspath(path))
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            row = {"image": os.path.join(root, r["image"]), "height_m": float(r["height_m"])}
+            for k in MANIFEST_FIELDS[2:7]:
+                row[k] = float(r[k]) if r.get(k) not in (None, "") else None
+            row["size_class"] = r.get("size_class") or size_class_m(row["height_m"])
+            rows.append(row)
+    return rows
+
+def _check_trig_angles(rows: List[dict], rel_tol: float = 0.01):
+    """Fail if the app's distance formula does not recover distance_m from the generated angles."""
+    distance = load_script_defs("arborvision_streamlit_v4.py")["calculate_distance_from_angles"]
+    for row in rows:
+        d = distance(row["camera_height_m"], row["angle_base_deg"], row["angle_top_deg"])
+        if d is None or abs(d - row["distance_m"]) > rel_tol * row["distance_m"]:
+            raise ValueError(f"{row['image']}: angles give {d} m, expected {row['distance_m']} m")
+
+def generate_synthetic_dataset(out_dir: str, n: int = 12, seed: int = 0) -> str:
+    """Render simple tree scenes with known height and scale; returns the manifest path."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    rows = []
+    for i in range(n):
+        W, H = 900, 1200
+        img = np.zeros((H, W, 3), np.uint8)
+        horizon = int(H * rng.uniform(0.75, 0.85))
+        sky = np.linspace(235, 190, horizon).astype(np.uint8)
+        img[:horizon, :, 0] = sky[:, None]                          # BGR: pale blue sky
+        img[:horizon, :, 1] = (sky * 0.85).astype(np.uint8)[:, None]
+        img[:horizon, :, 2] = (sky * 0.7).astype(np.uint8)[:, None]
+        img[horizon:] = (120, 130, 140)                             # grey-beige ground
+        height_m = float(rng.uniform(1.5, 12.0))
+        px_h = int(rng.uniform(350, horizon - 60))
+        ppm = px_h / height_m
+        cx = int(W / 2 + rng.uniform(-0.15, 0.15) * W)
+        base_y = horizon + int(rng.uniform(5, 40))
+        top_y = base_y - px_h
+        trunk_h = int(px_h * rng.uniform(0.25, 0.4))
+        trunk_w = max(6, int(px_h * 0.05))
+        crown_w = int(px_h * rng.uniform(0.35, 0.6))
+        cv2.rectangle(img, (cx - trunk_w // 2, base_y - trunk_h), (cx + trunk_w // 2, base_y), (30, 60, 100), -1)
+        crown_h = px_h - trunk_h + int(0.1 * px_h)
+        cv2.ellipse(img, (cx, top_y + crown_h // 2), (crown_w // 2, crown_h // 2), 0, 0, 360, (40, 140, 50), -1)
+        noise = rng.normal(0, 6, img.shape)
+        img = np.clip(img.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+        name = f"synthetic_{i:03d}.png"
+        cv2.imwrite(os.path.join(out_dir, name), img)
+        cam_h, dist = 1.6, float(rng.uniform(5, 20))
+        # calculate_distance_from_angles solves D = h_cam / (tan t - tan b): the two
+        # sightings span a vertical extent of h_cam, i.e. the foot of the trunk
+        # (depression) and the trunk at lens height (level sight, 0 deg).
+        rows.append({
+            "image": name, "height_m": round(height_m, 4), "pixel_per_meter": round(ppm, 4),
+            "camera_height_m": cam_h, "distance_m": round(dist, 3),
+            "angle_base_deg": round(math.degrees(math.atan2(-cam_h, dist)), 3),
+            "angle_top_deg": 0.0,
+            "size_class": size_class_m(height_m),
+        })
+    _check_trig_angles(rows)
+    path = os.path.join(out_dir, "manifest.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        w.writeheader(); w.writerows(rows)
+    log.info(f"Synthetic dataset: {n} images -> {path}")
+    return path
+
+# --------------------------- Estimators ---------------------------
+
+class StageTimer:
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0) * 1000.0
+
+_SCRIPT_DEFS: Dict[str, dict] = {}
+
+def load_script_defs(filename: str) -> dict:
+    """Imports and function definitions of a top-level script, without running its body.
+
+    arbresv2/arbresv3 and the Streamlit apps execute their pipeline (and open dialogs)
+    at import time; this keeps only what the benchmark needs.
+    """
+    if filename in _SCRIPT_DEFS:
+        return _SCRIPT_DEFS[filename]
+    path = os.path.join(HERE, filename)
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    ns = {"__name__": f"bench_{os.path.splitext(filename)[0]}", "log": logging.getLogger(filename)}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module([node], []), path, "exec"), ns)
+            except Exception as e:
+                log.debug(f"{filename}: skipped import ({e})")
+        elif isinstance(node, ast.FunctionDef):
+            exec(compile(ast.Module([node], []), path, "exec"), ns)
+    _SCRIPT_DEFS[filename] = ns
+    return ns
+
+def _input_scale(img_path: str, loaded_w: int) -> float:
+    from PIL import Image
+    with Image.open(img_path) as im:
+        return loaded_w / float(im.size[0])
+
+def _ppm(row: dict, scale: float = 1.0) -> Optional[float]:
+    return row["pixel_per_meter"] * scale if row.get("pixel_per_meter") else None
+
+def est_arbresv2(img_path: str, row: dict, t: StageTimer) -> Optional[float]:
+    m = load_script_defs("arbresv2.py")
+    with t("load"): _, img_rgb, _, W = m["load_image"](img_path)
+    with t("segment"): mask = m["segment_tree_multi_approach"](img_rgb, "cpu")
+    with t("extremes"): base, top = m["detect_tree_extremes"](mask)
+    ppm = _ppm(row, _input_scale(img_path, W))
+    return abs(base[1] - top[1]) / ppm if ppm else None
+
+def est_arbresv3(img_path: str, row: dict, t: StageTimer) -> Optional[float]:
+    m = load_script_defs("arbresv3.py")
+    with t("load"): _, img_rgb, _, W = m["load_image"](img_path)
+    with t("segment"): mask = m["segment_tree_multi_approach"](img_rgb, "cpu")
+    with t("extremes"): base, top = m["detect_tree_extremes"](mask)
+    ppm = _ppm(row, _input_scale(img_path, W))
+    return abs(base[1] - top[1]) / ppm if ppm else None
+
+def est_arbresv4(img_path: str, row: dict, t: StageTimer) -> Optional[float]:
+    import arbresv4 as m
+    with t("load"): _, img_rgb, _, W = m.load_image(img_path, max_side=1600)
+    with t("segment"): mask = m.segment_tree_multi_approach(img_rgb, "cpu")
+    with t("extremes"): base, top = m.detect_tree_extremes(mask)
+    with t("height"):
+        h = m.estimate_height_and_dbh(abs(top[1] - base[1]), manual_ppm=_ppm(row, _input_scale(img_path, W)))[0]
+    return h
+
+def est_arbresv4_enhanced(img_path: str, row: dict, t: StageTimer) -> Optional[float]:
+    import arbresv4_enhanced as m
+    with t("load"): _, img_rgb, _, W = m.load_image(img_path, max_side=1600)
+    with t("segment"): mask = m.segment_tree_multi_approach_enhanced(img_rgb, "cpu")
+    with t("extremes"): base, top = m.detect_tree_extremes_pca(mask)
+    with t("height"):
+        h = m.estimate_height_and_dbh_enhanced(abs(top[1] - base[1]), manual_ppm=_ppm(row, _input_scale(img_path, W)))[0]
+    return h
+
+def est_depth_guided(img_path: str, row: dict, t: StageTimer, use_depth: bool = False) -> Optional[float]:
+    import arbres_depth_guided as m
+    with t("load"): _, img_rgb, _, W = m.load_image(img_path, max_side=1600)
+    with t("segment"): mask = m.segment_tree_multi_approach_depth(img_rgb, "cpu")
+    with t("extremes"): base, top = m.detect_tree_extremes_pca(mask)
+    if use_depth:
+        with t("depth"):
+            depth = m.infer_depth_cached(img_rgb, sparse=True)
+            base, top = m.refine_extremes_with_depth(mask, base, top, depth)
+    with t("height"):
+        h = m.estimate_height_and_dbh(abs(top[1] - base[1]), manual_ppm=_ppm(row, _input_scale(img_path, W)))[0]
+    return h
+
+def est_trigonometric(img_path: str, row: dict, t: StageTimer) -> Optional[float]:
+    import arbresv4
+    v4 = load_script_defs("arborvision_streamlit_v4.py")
+    if None in (row.get("camera_height_m"), row.get("angle_base_deg"), row.get("angle_top_deg")):
+        return None
+    with t("load"): _, img_rgb, _, _ = arbresv4.load_image(img_path, max_side=1600)
+    with t("segment"): mask = arbresv4.segment_tree_multi_approach(img_rgb, "cpu")
+    with t("extremes"): base, top = arbresv4.detect_tree_extremes(mask)
+    with t("height"):
+        dist = v4["calculate_distance_from_angles"](row["camera_height_m"], row["angle_base_deg"], row["angle_top_deg"])
+        if dist is None:
+            return None
+        h = v4["calculate_real_tree_height_with_distance"](abs(top[1] - base[1]), dist, row["camera_height_m"])[0]
+    return h
+
+ESTIMATORS: Dict[str, Callable] = {
+    "arbresv2": est_arbresv2,
+    "arbresv3": est_arbresv3,
+    "arbresv4": est_arbresv4,
+    "arbresv4_enhanced": est_arbresv4_enhanced,
+    "depth_guided": est_depth_guided,
+    "trigonometric": est_trigonometric,
+}
+
+# --------------------------- Runner ---------------------------
+
+def _percentiles(values: List[float]) -> dict:
+    if not values:
+        return {}
+    a = np.asarray(values, dtype=np.float64)
+    return {"p50": float(np.percentile(a, 50)), "p90": float(np.percentile(a, 90)),
+            "p99": float(np.percentile(a, 99)), "mean": float(a.mean())}
+
+def _error_stats(pairs: List[Tuple[float, float]]) -> dict:
+    if not pairs:
+        return {"n": 0}
+    est, gt = np.asarray(pairs, dtype=np.float64).T
+    abs_err = np.abs(est - gt)
+    return {"n": int(len(gt)), "mae_m": float(abs_err.mean()),
+            "mape_pct": float((abs_err / np.maximum(gt, 1e-6)).mean() * 100.0)}
+
+_STATM = "/proc/self/statm" if os.path.exists("/proc/self/statm") else None
+_PAGE = os.sysconf("SC_PAGE_SIZE") if _STATM else 4096
+
+class PeakRSS:
+    """Peak resident memory above the starting RSS while the block runs, in bytes.
+
+    Counts native allocations (OpenCV, torch) that tracemalloc does not see. The
+    RSS is polled from a thread (psutil, or /proc/self/statm on Linux); elsewhere
+    ru_maxrss only moves when the process reaches a new high, so it is a lower bound.
+    """
+    def __init__(self, interval_s: float = 0.002):
+        self.interval_s = interval_s
+        self.peak = 0
+
+    def _rss(self) -> int:
+        if PSUTIL_OK:
+            return psutil.Process().memory_info().rss
+        if _STATM:
+            with open(_STATM) as f:
+                return int(f.read().split()[1]) * _PAGE
+        if RESOURCE_OK:
+            kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return kb if sys.platform == "darwin" else kb * 1024   # bytes on macOS, KiB elsewhere
+        return 0
+
+    def _poll(self):
+        while not self._stop.wait(self.interval_s):
+            self._max = max(self._max, self._rss())
+
+    def __enter__(self):
+        self._start = self._max = self._rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True) if PSUTIL_OK or _STATM else None
+        if self._thread:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+        self._max = max(self._max, self._rss())
+        self.peak = max(0, self._max - self._start)
+        return False
+
+def run_estimator(name: str, rows: List[dict], mem_samples: int = 3, **kwargs) -> dict:
+    fn = ESTIMATORS[name]
+    stage_ms: Dict[str, List[float]] = {}
+    totals: List[float] = []
+    by_class: Dict[str, List[Tuple[float, float]]] = {c: [] for c in SIZE_CLASSES}
+    failures = 0
+    for row in rows:
+        t = StageTimer()
+        t0 = time.perf_counter()
+        try:
+            h = fn(row["image"], row, t, **kwargs)
+        except Exception as e:
+            log.warning(f"{name}: {os.path.basename(row['image'])} failed: {e}")
+            failures += 1
+            continue
+        totals.append((time.perf_counter() - t0) * 1000.0)
+        for k, v in t.stages.items():
+            stage_ms.setdefault(k, []).append(v)
+        if h is not None and np.isfinite(h):
+            by_class.setdefault(row["size_class"], []).append((float(h), row["height_m"]))
+    # separate pass so the RSS polling does not distort latencies
+    peak = 0
+    for row in rows[:mem_samples]:
+        with PeakRSS() as mem:
+            try:
+                fn(row["image"], row, StageTimer(), **kwargs)
+            except Exception:
+                pass
+        peak = max(peak, mem.peak)
+    all_pairs = [p for ps in by_class.values() for p in ps]
+    return {
+        "images": len(rows), "failures": failures,
+        "latency_ms": {"total": _percentiles(totals), **{k: _percentiles(v) for k, v in stage_ms.items()}},
+        "peak_mem_mb": round(peak / (1024 * 1024), 2),
+        "error": {"all": _error_stats(all_pairs), **{c: _error_stats(ps) for c, ps in by_class.items()}},
+    }
+
+def compare_to_baseline(report: dict, baseline: dict, err_tol: float = 0.10, lat_tol: float = 0.25) -> List[str]:
+    """Regressions of report against baseline: MAE beyond err_tol (relative, +2 cm) or p50 latency beyond lat_tol."""
+    problems = []
+    for name, cur in report.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        cur_mae = cur["error"]["all"].get("mae_m"); base_mae = base["error"]["all"].get("mae_m")
+        if cur_mae is not None and base_mae is not None and cur_mae > base_mae * (1 + err_tol) + 0.02:
+            problems.append(f"{name}: MAE {cur_mae:.3f} m > baseline {base_mae:.3f} m")
+        cur_lat = cur["latency_ms"]["total"].get("p50"); base_lat = base["latency_ms"]["total"].get("p50")
+        if cur_lat is not None and base_lat is not None and cur_lat > base_lat * (1 + lat_tol):
+            problems.append(f"{name}: p50 latency {cur_lat:.1f} ms > baseline {base_lat:.1f} ms")
+        if cur["failures"] > base["failures"]:
+            problems.append(f"{name}: {cur['failures']} failures > baseline {base['failures']}")
+    return problems
+
+def print_report(report: dict):
+    print(f"{'estimator':<20}{'n':>4}{'MAE m':>9}{'MAPE %':>9}{'p50 ms':>10}{'p90 ms':>10}{'peak MB':>9}  per-class MAPE %")
+    for name, r in report.items():
+        e = r["error"]["all"]; lat = r["latency_ms"]["total"]
+        per_class = " ".join(f"{c}={r['error'][c]['mape_pct']:.1f}" for c in SIZE_CLASSES if r["error"][c].get("n"))
+        print(f"{name:<20}{e.get('n', 0):>4}{e.get('mae_m', float('nan')):>9.3f}{e.get('mape_pct', float('nan')):>9.1f}"
+              f"{lat.get('p50', float('nan')):>10.1f}{lat.get('p90', float('nan')):>10.1f}{r['peak_mem_mb']:>9.1f}  {per_class}")
+
+def _parse_args():
+    p = argparse.ArgumentParser(description="Accuracy and latency benchmark for the tree height estimators")
+    p.add_argument("--manifest", type=str, help="CSV manifest of labeled images")
+    p.add_argument("--synthetic", type=str, help="Generate a synthetic dataset in this directory and benchmark it")
+    p.add_argument("--n", type=int, default=12, help="Number of synthetic images")
+    p.add_argument("--estimators", type=str, default=",".join(ESTIMATORS), help="Comma-separated estimator names")
+    p.add_argument("--use-depth", action="store_true", help="Run MiDaS refinement in depth_guided")
+    p.add_argument("--mem-samples", type=int, default=3)
+    p.add_argument("--report", type=str, default=None, help="Write the JSON report here")
+    p.add_argument("--baseline", type=str, default=None, help="Fail on regressions against this JSON report; benchmarks/height_baseline.json is the --synthetic --n 12 reference")
+    p.add_argument("--update-baseline", action="store_true", help="Write the report to --baseline instead of comparing")
+    return p.parse_args()
+
+def main() -> int:
+    args = _parse_args()
+    manifest = generate_synthetic_dataset(args.synthetic, args.n) if args.synthetic else args.manifest
+    if not manifest:
+        log.error("Provide --manifest or --synthetic."); return 2
+    rows = read_manifest(manifest)
+    report = {}
+    for name in [s.strip() for s in args.estimators.split(",") if s.strip()]:
+        if name not in ESTIMATORS:
+            log.error(f"Unknown estimator: {name}"); return 2
+        kwargs = {"use_depth": True} if name == "depth_guided" and args.use_depth else {}
+        log.info(f"Running {name} on {len(rows)} images")
+        report[name] = run_estimator(name, rows, args.mem_samples, **kwargs)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        if args.update_baseline:
+            with open(args.baseline, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            log.info(f"Baseline written: {args.baseline}")
+            return 0
+        if not os.path.isfile(args.baseline):
+            log.error(f"Baseline not found: {args.baseline} (create it with --update-baseline)"); return 2
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare_to_baseline(report, json.load(f))
+        for msg in problems:
+            log.error(f"Regression: {msg}")
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import io
+import struct
+import time
+from typing import NamedTuple, Optional, Tuple, Union
+import numpy as np
+import cv2
+
+from calibration_store import read_exif
+
+# Image loading for the measurement scripts. For JPEGs the size is read from the
+# SOF header first, and the decoder is asked for the smallest DCT-domain
+# reduction (1/2, 1/4, 1/8) that is still at least max_side, so a 12 MP photo
+# bound for 1600 px is decoded at 1/2 instead of in full; INTER_AREA then only
+# covers the remaining factor. EXIF orientation is applied by us on the reduced
+# image (the decoder is told to ignore it). RGB is converted into its own
+# contiguous buffer: callers draw on it with cv2, which rejects negative-stride
+# views such as bgr[..., ::-1].
+
+_REDUCED = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+            (2, cv2.IMREAD_REDUCED_COLOR_2), (1, cv2.IMREAD_COLOR))
+_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+class LoadedImage(NamedTuple):
+    bgr: np.ndarray
+    rgb: np.ndarray            # contiguous copy of bgr with the channels reversed
+    height: int
+    width: int
+    source_size: Tuple[int, int]   # (width, height) stored in the file, before orientation
+    reduction: int             # DCT-domain reduction used by the decoder (1, 2, 4, 8)
+    orientation: int           # EXIF orientation that was applied
+    decode_ms: float
+    total_ms: float
+
+def _sof_size(f) -> Optional[Tuple[int, int]]:
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        head = f.read(4)
+        if len(head) < 4 or head[0] != 0xFF:
+            return None
+        marker, (length,) = head[1], struct.unpack(">H", head[2:])
+        if marker in _SOF:
+            h, w = struct.unpack(">xHH", f.read(5))
+            return w, h
+        if marker == 0xDA:
+            return None
+        f.seek(length - 2, 1)
+
+def jpeg_size(src: Union[str, bytes]) -> Optional[Tuple[int, int]]:
+    """(width, height) from the JPEG frame header of a path or file bytes, None for other formats."""
+    try:
+        if isinstance(src, (bytes, bytearray)):
+            return _sof_size(io.BytesIO(src))
+        with open(src, "rb") as f:
+            return _sof_size(f)
+    except (OSError, struct.error):
+        return None
+
+def apply_orientation(img: np.ndarray, orientation: int) -> np.ndarray:
+    """Rotate/flip img as EXIF orientation 1-8 prescribes."""
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+def _load(src: Union[str, bytes], max_side: Optional[int]) -> LoadedImage:
+    t0 = time.perf_counter()
+    size = jpeg_size(src)
+    reduction, flag = 1, cv2.IMREAD_COLOR
+    if size is not None and max_side:
+        for r, f in _REDUCED:
+            if max(size) / r >= max_side:
+                reduction, flag = r, f
+                break
+    orientation = 1
+    if size is not None:
+        orientation = int(read_exif(src).get("orientation") or 1)
+        flag |= cv2.IMREAD_IGNORE_ORIENTATION
+    t1 = time.perf_counter()
+    if isinstance(src, (bytes, bytearray)):
+        bgr = cv2.imdecode(np.frombuffer(src, np.uint8), flag)
+    else:
+        bgr = cv2.imread(src, flag)
+    decode_ms = (time.perf_counter() - t1) * 1000.0
+    if bgr is None:
+        raise FileNotFoundError("Cannot read image: " + (src if isinstance(src, str) else "<bytes>"))
+    h, w = bgr.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        bgr = cv2.resize(bgr, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    bgr = apply_orientation(bgr, orientation)
+    H, W = bgr.shape[:2]
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    return LoadedImage(bgr, rgb, H, W, size or (w, h), reduction, orientation,
+                       decode_ms, (time.perf_counter() - t0) * 1000.0)
+
+def read_image(path: str, max_side: Optional[int] = 1600) -> LoadedImage:
+    """Decode path with its longest side reduced to max_side (None: full size), EXIF-oriented."""
+    return _load(path, max_side)
+
+def decode_image(data: bytes, max_side: Optional[int] = 1600) -> LoadedImage:
+    """read_image for encoded bytes (uploads, camera input) without a temporary file."""
+    return _load(bytes(data), max_side)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import logging
+import time
+from typing import Dict, List, Sequence
+import numpy as np
+import cv2
+
+try:
+    from pyzbar import pyzbar
+    PYZBAR_OK = True
+except Exception:
+    PYZBAR_OK = False
+
+log = logging.getLogger("label_reader")
+
+# Tiered tree-label identification:
+#   1. QR / barcode decoding at a few downscaled sizes, stop at the first hit;
+#   2. otherwise, text-region detection once on the grey image;
+#   3. recognition on those regions only, greedy first, beam search only for
+#      regions whose greedy confidence is low.
+
+CODE_SIZES = (640, 1024, None)   # max side in px, None = full resolution
+LOW_CONFIDENCE = 0.5
+
+def _gray(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def decode_label_codes(image: np.ndarray, sizes: Sequence = CODE_SIZES) -> List[str]:
+    """Payloads of QR codes / barcodes in a BGR or grey image, smallest size that works."""
+    if not PYZBAR_OK:
+        return []
+    gray = _gray(image)
+    h, w = gray.shape[:2]
+    for max_side in sizes:
+        if max_side is not None and max(h, w) <= max_side:
+            continue
+        if max_side is None:
+            img = gray
+        else:
+            s = max_side / float(max(h, w))
+            img = cv2.resize(gray, (int(w * s), int(h * s)), interpolation=cv2.INTER_AREA)
+        try:
+            codes = pyzbar.decode(img)
+        except Exception as e:
+            log.debug(f"pyzbar failed at {max_side}: {e}")
+            continue
+        if codes:
+            return [c.data.decode("utf-8", errors="replace") for c in codes]
+    return []
+
+def read_label_text(reader, image: np.ndarray, low_confidence: float = LOW_CONFIDENCE) -> List[tuple]:
+    """(bbox, text, confidence) like reader.readtext, but detection runs once and
+    beam-search decoding is spent only on low-confidence regions."""
+    gray = _gray(image)
+    horizontal, free = reader.detect(gray, text_threshold=0.3, low_text=0.3, link_threshold=0.3)
+    horizontal, free = horizontal[0], free[0]
+    if not horizontal and not free:
+        return []
+    results = list(reader.recognize(gray, horizontal_list=horizontal, free_list=free, decoder="greedy", batch_size=4))
+    # recognize() returns results sorted by position, not in horizontal + free
+    # order, so each weak result is rescored on the bbox it carries
+    for i, (bbox, _, conf) in enumerate(results):
+        if conf >= low_confidence:
+            continue
+        h_list, f_list = _region_lists(bbox)
+        rescored = reader.recognize(gray, horizontal_list=h_list, free_list=f_list, decoder="beamsearch", batch_size=1)
+        if rescored and rescored[0][2] > conf:
+            results[i] = rescored[0]
+    return results
+
+def _region_lists(bbox) -> tuple:
+    """(horizontal_list, free_list) for one result bbox (4 corner points)."""
+    pts = np.asarray(bbox, dtype=np.float64).reshape(4, 2)
+    xs, ys = pts[:, 0], pts[:, 1]
+    if len(set(np.round(xs, 3))) <= 2 and len(set(np.round(ys, 3))) <= 2:   # axis-aligned box
+        return [[int(xs.min()), int(xs.max()), int(ys.min()), int(ys.max())]], []
+    return [], [pts.tolist()]
+
+def identify_label(image: np.ndarray, reader=None) -> Dict:
+    """Codes first, OCR only when no code is found. Returns codes, OCR results and timings (ms)."""
+    out = {"codes": [], "texts": [], "source": "none", "timings_ms": {}}
+    t0 = time.perf_counter()
+    out["codes"] = decode_label_codes(image)
+    out["timings_ms"]["codes"] = (time.perf_counter() - t0) * 1000.0
+    if out["codes"]:
+        out["source"] = "code"
+        return out
+    if reader is not None:
+        t0 = time.perf_counter()
+        out["texts"] = read_label_text(reader, image)
+        out["timings_ms"]["ocr"] = (time.perf_counter() - t0) * 1000.0
+        if out["texts"]:
+            out["source"] = "ocr"
+    return out
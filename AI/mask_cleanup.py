@@ -0,0 +1,71 @@
+from __future__ import annotations
+from typing import Callable, Optional
+import numpy as np
+import cv2
+
+# Connected-component cleanup of binary masks, shared by the arbres* pipelines.
+# Everything goes through one connectedComponentsWithStats pass: components are
+# chosen from the stats table and the kept ones are written back with a single
+# lookup (keep[labels]), so the cost is O(pixels) whatever the number of labels.
+# Masks may be bool or uint8 (0/255); results are bool.
+
+StatsFilter = Callable[[np.ndarray], np.ndarray]   # stats rows (background excluded) -> bool per component
+
+def _binary(mask: np.ndarray) -> np.ndarray:
+    return (np.asarray(mask) > 0).astype(np.uint8)
+
+def component_stats(mask: np.ndarray, connectivity: int = 8):
+    """(num_labels, labels, stats) of the foreground; label 0 is the background."""
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(_binary(mask), connectivity=connectivity)
+    return num_labels, labels, stats
+
+def _keep(labels: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    lut = np.zeros(len(keep) + 1, dtype=bool)
+    lut[1:] = keep
+    return lut[labels]
+
+def filter_components(mask: np.ndarray, keep: StatsFilter, connectivity: int = 8) -> np.ndarray:
+    """Components for which keep(stats[1:]) is True (stats columns are cv2.CC_STAT_*)."""
+    num_labels, labels, stats = component_stats(mask, connectivity)
+    if num_labels <= 1:
+        return np.zeros(labels.shape, dtype=bool)
+    return _keep(labels, np.asarray(keep(stats[1:]), dtype=bool))
+
+def top_k_components(mask: np.ndarray, k: int, min_area: int = 0, connectivity: int = 8) -> np.ndarray:
+    """The k largest components with at least min_area pixels."""
+    num_labels, labels, stats = component_stats(mask, connectivity)
+    if num_labels <= 1 or k <= 0:
+        return np.zeros(labels.shape, dtype=bool)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = np.zeros(len(areas), dtype=bool)
+    if k < len(areas):
+        keep[np.argpartition(areas, -k)[-k:]] = True
+    else:
+        keep[:] = True
+    keep &= areas >= min_area
+    return _keep(labels, keep)
+
+def largest_component(mask: np.ndarray, connectivity: int = 8) -> np.ndarray:
+    """Largest component; an empty mask is returned unchanged (as bool)."""
+    num_labels, labels, stats = component_stats(mask, connectivity)
+    if num_labels <= 1:
+        return labels > 0
+    return labels == 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+
+def remove_small_components(mask: np.ndarray, min_area: int, connectivity: int = 8) -> np.ndarray:
+    return filter_components(mask, lambda s: s[:, cv2.CC_STAT_AREA] >= min_area, connectivity)
+
+def fill_holes(mask: np.ndarray, max_hole_area: Optional[int] = None) -> np.ndarray:
+    """Fill background regions not connected to the image border (optionally only small ones)."""
+    fg = _binary(mask)
+    # background components use 4-connectivity, the dual of the 8-connected foreground
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(1 - fg, connectivity=4)
+    if num_labels <= 1:
+        return fg > 0
+    border = np.unique(np.concatenate([labels[0, :], labels[-1, :], labels[:, 0], labels[:, -1]]))
+    hole = np.ones(num_labels, dtype=bool)
+    hole[0] = False          # label 0 is the foreground here
+    hole[border] = False
+    if max_hole_area is not None:
+        hole &= stats[:, cv2.CC_STAT_AREA] <= max_hole_area
+    return (fg > 0) | hole[labels]
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import math
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+import cv2
+
+# Tree geometry from the outer contour and its moments, instead of from the
+# list of foreground pixels: memory is O(contour), and every height method
+# (vertical extremes, PCA axis, crown metrics) is served by the same pass.
+
+Point = Tuple[int, int]
+
+class MaskGeometry(NamedTuple):
+    area: float                  # crown (projected) area in px², holes included
+    centroid: Tuple[float, float]
+    axis: Tuple[float, float]    # unit principal axis (x, y), oriented top -> base
+    top: Point                   # apex along the principal axis
+    base: Point                  # base along the principal axis
+    top_vertical: Point          # highest point, x = median of the contour near it
+    base_vertical: Point         # lowest point, x = median of the contour near it
+    crown_width: float           # extent perpendicular to the principal axis
+    trunk_x: float               # trunk centre in the lowest band of the mask
+    bbox: Tuple[int, int, int, int]  # x, y, w, h
+
+def outer_contour(mask: np.ndarray) -> Optional[np.ndarray]:
+    """Largest external contour of a binary mask as an (N, 2) int array of (x, y)."""
+    mb = mask if mask.dtype == np.uint8 else (mask > 0).astype(np.uint8)
+    cnts, _ = cv2.findContours(mb, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    if not cnts:
+        return None
+    c = max(cnts, key=cv2.contourArea)
+    return c.reshape(-1, 2)
+
+def _median_x_near(pts: np.ndarray, y: int, win: int) -> int:
+    band = pts[np.abs(pts[:, 1] - y) <= win, 0]
+    return int(np.median(band)) if len(band) else int(pts[0, 0])
+
+def mask_geometry(mask: np.ndarray, band_ratio: float = 0.05, win: int = 5) -> Optional[MaskGeometry]:
+    pts = outer_contour(mask)
+    if pts is None or len(pts) == 0:
+        return None
+    m = cv2.moments(pts.reshape(-1, 1, 2).astype(np.int32))
+    if m["m00"] > 0:
+        cx, cy = m["m10"] / m["m00"], m["m01"] / m["m00"]
+        theta = 0.5 * math.atan2(2.0 * m["mu11"], m["mu20"] - m["mu02"])
+    else:
+        # degenerate (line-like) contour: fall back to its mean and vertical axis
+        cx, cy = float(pts[:, 0].mean()), float(pts[:, 1].mean())
+        theta = math.pi / 2
+    vx, vy = math.cos(theta), math.sin(theta)
+    if vy < 0 or (vy == 0 and vx < 0):
+        vx, vy = -vx, -vy
+    rel = pts - np.array([cx, cy])
+    proj = rel[:, 0] * vx + rel[:, 1] * vy
+    perp = rel[:, 0] * -vy + rel[:, 1] * vx
+    i_top, i_base = int(np.argmin(proj)), int(np.argmax(proj))
+
+    ys = pts[:, 1]
+    y_top, y_base = int(ys.min()), int(ys.max())
+    band = max(1, int(band_ratio * (y_base - y_top + 1)))
+    trunk_xs = pts[ys >= y_base - band, 0]
+    x, y, w, h = cv2.boundingRect(pts.reshape(-1, 1, 2).astype(np.int32))
+
+    return MaskGeometry(
+        area=float(m["m00"]),
+        centroid=(float(cx), float(cy)),
+        axis=(vx, vy),
+        top=(int(pts[i_top, 0]), int(pts[i_top, 1])),
+        base=(int(pts[i_base, 0]), int(pts[i_base, 1])),
+        top_vertical=(_median_x_near(pts, y_top, win), y_top),
+        base_vertical=(_median_x_near(pts, y_base, win), y_base),
+        crown_width=float(perp.max() - perp.min()),
+        trunk_x=0.5 * float(trunk_xs.min() + trunk_xs.max()),
+        bbox=(int(x), int(y), int(w), int(h)),
+    )
+
+def _row_of_rank(cum: np.ndarray, k) -> np.ndarray:
+    """Row of the k-th (0-based) foreground pixel in row-major order, from the row cumsum."""
+    return np.searchsorted(cum, np.asarray(k), side="right")
+
+def _median_row(cum: np.ndarray, r0: int, r1: int) -> float:
+    """np.median of the y of every foreground pixel in rows r0..r1 (inclusive)."""
+    before = cum[r0 - 1] if r0 > 0 else 0
+    n = int(cum[r1] - before)
+    lo, hi = _row_of_rank(cum, [before + (n - 1) // 2, before + n // 2])
+    return 0.5 * (lo + hi)
+
+def _median_x_rows(mask: np.ndarray, r0: int, r1: int) -> Optional[int]:
+    xs = np.nonzero(mask[r0:r1])[1]
+    return int(np.median(xs)) if len(xs) else None
+
+def percentile_extremes(mask: np.ndarray, q: float = 5.0, window: int = 20) -> Optional[Tuple[Point, Point]]:
+    """(base, top) as the median of the lowest / highest q% of all foreground pixels.
+
+    Same result as np.percentile / np.median over np.where(mask), but from a row
+    histogram (O(H) plus the pixels of the selected rows); x is the median of the
+    mask in a window of rows around each point. None for an empty mask.
+    """
+    counts = np.count_nonzero(mask, axis=1)
+    cum = np.cumsum(counts)
+    n = int(cum[-1]) if len(cum) else 0
+    if n == 0:
+        return None
+
+    def percentile_row(p: float) -> float:
+        pos = p / 100.0 * (n - 1)
+        lo, hi = _row_of_rank(cum, [int(math.floor(pos)), int(math.ceil(pos))])
+        return lo + (pos - math.floor(pos)) * (hi - lo)
+
+    y_min, y_max = int(_row_of_rank(cum, 0)), int(_row_of_rank(cum, n - 1))
+    base_r0 = int(math.ceil(percentile_row(100.0 - q)))
+    top_r1 = int(math.floor(percentile_row(q)))
+    base_y = int(_median_row(cum, base_r0, y_max))
+    top_y = int(_median_row(cum, y_min, top_r1))
+    base_x = _median_x_rows(mask, base_r0, y_max + 1)
+    top_x = _median_x_rows(mask, y_min, top_r1 + 1)
+    if base_y <= top_y:
+        # incoherent percentiles: fall back to the extreme rows
+        base_y, top_y = y_max, y_min
+        base_x = _median_x_rows(mask, y_max, y_max + 1)
+        top_x = _median_x_rows(mask, y_min, y_min + 1)
+    H = mask.shape[0]
+    rb = _median_x_rows(mask, max(0, base_y - window // 2), min(H, base_y + window // 2))
+    rt = _median_x_rows(mask, max(0, top_y - window // 2), min(H, top_y + window // 2))
+    return (rb if rb is not None else base_x, base_y), (rt if rt is not None else top_x, top_y)
@@ -0,0 +1,159 @@
+from __future__ import annotations
+import json
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+import numpy as np
+
+# Compact binary masks: COCO run-length encoding (column-major runs, starting
+# with a background run) plus the bounding box. A tree mask of ~2 MP is a few
+# hundred runs, i.e. a few hundred bytes once serialized with the COCO
+# compressed string. Area, bbox and IoU are computed on the runs without
+# decoding; to_coco()/from_coco() interoperate with pycocotools.
+
+class MaskRLE(NamedTuple):
+    height: int
+    width: int
+    counts: np.ndarray   # uint32 run lengths, alternating background / foreground
+
+    @property
+    def area(self) -> int:
+        return int(self.counts[1::2].sum())
+
+    @property
+    def bbox(self) -> Tuple[int, int, int, int]:
+        """COCO [x, y, w, h] of the foreground, zeros when empty."""
+        starts, ends = _runs(self)
+        if starts.size == 0:
+            return (0, 0, 0, 0)
+        h = self.height
+        c0, c1 = starts // h, (ends - 1) // h
+        single = c0 == c1
+        # a run spanning several columns covers the whole height of the columns in between
+        y0 = int(np.where(single, starts % h, 0).min())
+        y1 = int(np.where(single, (ends - 1) % h, h - 1).max())
+        x0, x1 = int(c0.min()), int(c1.max())
+        return (x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+
+    def decode(self) -> np.ndarray:
+        return decode(self)
+
+    def to_coco(self) -> Dict[str, object]:
+        """{"size": [h, w], "counts": <compressed string>} as pycocotools writes it."""
+        return {"size": [self.height, self.width], "counts": counts_to_string(self.counts)}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_coco())
+
+    def to_bytes(self) -> bytes:
+        return struct.pack("<II", self.height, self.width) + counts_to_string(self.counts).encode("ascii")
+
+def _runs(rle: MaskRLE) -> Tuple[np.ndarray, np.ndarray]:
+    """(start, end) flat column-major offsets of the foreground runs."""
+    edges = np.cumsum(rle.counts.astype(np.int64))
+    starts = edges[0::2][: len(rle.counts) // 2]
+    ends = edges[1::2]
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+def encode(mask: np.ndarray) -> MaskRLE:
+    """RLE of a 2-D mask (bool or 0/255)."""
+    h, w = mask.shape[:2]
+    flat = (np.asarray(mask) > 0).ravel(order="F")
+    if flat.size == 0:
+        return MaskRLE(h, w, np.zeros(0, np.uint32))
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(bounds)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))   # runs always start with background
+    return MaskRLE(h, w, counts.astype(np.uint32))
+
+def decode(rle: MaskRLE) -> np.ndarray:
+    vals = np.zeros(len(rle.counts), dtype=bool)
+    vals[1::2] = True
+    flat = np.repeat(vals, rle.counts.astype(np.int64))
+    if flat.size < rle.height * rle.width:
+        flat = np.concatenate((flat, np.zeros(rle.height * rle.width - flat.size, bool)))
+    return flat.reshape((rle.height, rle.width), order="F")
+
+def iou(a: MaskRLE, b: MaskRLE) -> float:
+    """Intersection over union of two masks of the same size, from their runs."""
+    if (a.height, a.width) != (b.height, b.width):
+        raise ValueError("masks of different sizes")
+    area_a, area_b = a.area, b.area
+    if area_a == 0 or area_b == 0:
+        return 0.0
+    ax, ay, aw, ah = a.bbox
+    bx, by, bw, bh = b.bbox
+    if ax >= bx + bw or bx >= ax + aw or ay >= by + bh or by >= ay + ah:
+        return 0.0
+    ea = np.cumsum(a.counts.astype(np.int64))
+    eb = np.cumsum(b.counts.astype(np.int64))
+    # segments between consecutive run boundaries of either mask; a position is
+    # foreground in a mask when an odd number of its boundaries lie at or before it
+    cuts = np.union1d(ea, eb)
+    seg_start = np.concatenate(([0], cuts[:-1]))
+    seg_len = cuts - seg_start
+    in_a = np.searchsorted(ea, seg_start, side="right") % 2 == 1
+    in_b = np.searchsorted(eb, seg_start, side="right") % 2 == 1
+    inter = int(seg_len[in_a & in_b].sum())
+    return inter / float(area_a + area_b - inter)
+
+def counts_to_string(counts: np.ndarray) -> str:
+    """COCO compressed counts (LEB128-like, 6 bits per char, deltas after the first two runs)."""
+    out = []
+    cnts = [int(c) for c in counts]
+    for i, x in enumerate(cnts):
+        if i > 2:
+            x -= cnts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            out.append(chr(c + 48))
+    return "".join(out)
+
+def string_to_counts(s: str) -> np.ndarray:
+    cnts: List[int] = []
+    p = 0
+    while p < len(s):
+        x, k, more = 0, 0, True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(cnts) > 2:
+            x += cnts[-2]
+        cnts.append(x)
+    return np.asarray(cnts, dtype=np.uint32)
+
+def from_coco(obj: Union[Dict[str, object], str]) -> MaskRLE:
+    """MaskRLE from a COCO dict (compressed string or list counts) or its JSON text."""
+    if isinstance(obj, str):
+        obj = json.loads(obj)
+    h, w = (int(v) for v in obj["size"])
+    counts = obj["counts"]
+    if isinstance(counts, bytes):
+        counts = counts.decode("ascii")
+    arr = string_to_counts(counts) if isinstance(counts, str) else np.asarray(counts, dtype=np.uint32)
+    return MaskRLE(h, w, arr)
+
+def from_bytes(data: bytes) -> MaskRLE:
+    h, w = struct.unpack_from("<II", data, 0)
+    return MaskRLE(h, w, string_to_counts(data[8:].decode("ascii")))
+
+def mask_summary(mask: Optional[np.ndarray]) -> Optional[Dict[str, object]]:
+    """COCO RLE plus area and bbox, for inclusion in a result JSON."""
+    if mask is None:
+        return None
+    rle = encode(mask)
+    out = rle.to_coco()
+    out.update({"area": rle.area, "bbox": list(rle.bbox)})
+    return out
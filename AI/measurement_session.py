@@ -0,0 +1,91 @@
+from __future__ import annotations
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import numpy as np
+
+from image_loader import LoadedImage, decode_image
+
+log = logging.getLogger("measurement_session")
+
+# Per-image measurement state kept across Streamlit reruns. A session is keyed
+# by the hash of the uploaded bytes and memoizes each pipeline stage (decoded
+# image, mask, depth map, extremes, ...) under the parameters that stage
+# depends on. A rerun caused by a downstream parameter (pixels per meter,
+# camera height, angles) finds every upstream stage cached and only redoes the
+# cheap arithmetic; changing e.g. the segmentation method recomputes the mask
+# and whatever is keyed on it, nothing else.
+
+MAX_SESSIONS = 4        # images kept in memory (decoded image + masks + depth)
+MAX_STAGES = 16         # stage results kept per image, least recently used dropped first
+
+def upload_key(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class MeasurementSession:
+    def __init__(self, data: bytes, key: Optional[str] = None):
+        self.key = key or upload_key(data)
+        self._data = data
+        self._stages: "OrderedDict[Tuple[str, Hashable], Any]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.timings_ms: Dict[str, float] = {}   # last computation time per stage
+        self.hits: Dict[str, int] = {}
+
+    def stage(self, name: str, params: Hashable, compute: Callable[[], Any], cache_none: bool = False) -> Any:
+        """compute() once per (name, params); later calls return the stored result.
+
+        A None result (failed segmentation, model server unavailable) is not
+        stored unless cache_none, so the next rerun tries again.
+        """
+        k = (name, params)
+        with self._lock:
+            if k in self._stages:
+                self.hits[name] = self.hits.get(name, 0) + 1
+                self._stages.move_to_end(k)
+                return self._stages[k]
+            t0 = time.perf_counter()
+            value = compute()
+            self.timings_ms[name] = (time.perf_counter() - t0) * 1000.0
+            if value is not None or cache_none:
+                self._stages[k] = value
+                while len(self._stages) > MAX_STAGES:
+                    self._stages.popitem(last=False)
+            return value
+
+    def image(self, max_side: int = 1600) -> LoadedImage:
+        return self.stage("image", max_side, lambda: decode_image(self._data, max_side))
+
+    def mask(self, params: Hashable, segment: Callable[[np.ndarray], Optional[np.ndarray]],
+             max_side: int = 1600) -> Optional[np.ndarray]:
+        """Tree mask for the image at max_side; params identify the segmentation (method, model)."""
+        img = self.image(max_side)
+        return self.stage("mask", (max_side, params), lambda: segment(img.rgb))
+
+    def depth(self, params: Hashable, estimate: Callable[[np.ndarray], Optional[np.ndarray]],
+              max_side: int = 1600) -> Optional[np.ndarray]:
+        img = self.image(max_side)
+        return self.stage("depth", (max_side, params), lambda: estimate(img.rgb))
+
+    def invalidate(self, name: Optional[str] = None):
+        with self._lock:
+            for k in [k for k in self._stages if name is None or k[0] == name]:
+                del self._stages[k]
+
+_SESSIONS: "OrderedDict[str, MeasurementSession]" = OrderedDict()
+_LOCK = threading.Lock()
+
+def get_measurement_session(data: bytes) -> MeasurementSession:
+    """Shared session for these upload bytes; the least recently used ones are dropped."""
+    key = upload_key(data)
+    with _LOCK:
+        s = _SESSIONS.get(key)
+        if s is None:
+            s = _SESSIONS[key] = MeasurementSession(data, key)
+            while len(_SESSIONS) > MAX_SESSIONS:
+                _SESSIONS.popitem(last=False)
+        else:
+            _SESSIONS.move_to_end(key)
+        return s
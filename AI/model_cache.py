@@ -0,0 +1,123 @@
+from __future__ import annotations
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    import torch
+    import torchvision
+    TORCH_OK = True
+except Exception:
+    TORCH_OK = False
+    torch = None
+
+log = logging.getLogger("model_cache")
+
+# Process-wide cache of constructed models keyed by (architecture, weights,
+# device). Models are built lazily on first use (or eagerly with warm_up), and
+# at most MAX_RESIDENT_MODELS stay resident: the least recently used one is
+# dropped when a new one is built, which keeps low-RAM field laptops usable
+# when a script switches between Mask R-CNN, DeepLabV3 and MiDaS.
+
+MAX_RESIDENT_MODELS = int(os.environ.get("ARBOR_MAX_RESIDENT_MODELS", "3"))
+
+Key = Tuple[str, str, str]
+Builder = Callable[[str, str], Any]   # (weights, device) -> model
+
+def _tv_model(fn_name: str, module) -> Builder:
+    def build(weights: str, device: str):
+        fn = getattr(module, fn_name)
+        try:
+            model = fn(weights=weights)            # torchvision >= 0.13
+        except TypeError:
+            model = fn(pretrained=weights is not None)
+        return model.to(device).eval()
+    return build
+
+def _build_midas(weights: str, device: str):
+    """(model, transform) from the checksum-verified depth_models store; never downloads.
+
+    Raises DepthModelError when the weights are not provisioned there.
+    """
+    from depth_models import DepthModelError, build_depth_model
+    try:
+        return build_depth_model(weights, device)
+    except DepthModelError as e:
+        raise DepthModelError(f"MiDaS {weights} unavailable from the depth_models store: {e}") from e
+
+BUILDERS: Dict[str, Builder] = {}
+if TORCH_OK:
+    BUILDERS.update({
+        "maskrcnn_resnet50_fpn": _tv_model("maskrcnn_resnet50_fpn", torchvision.models.detection),
+        "midas": _build_midas,
+    })
+    # semantic segmentation backends, lightest first (see semantic_segmentation.py)
+    for _name in ("deeplabv3_mobilenet_v3_large", "lraspp_mobilenet_v3_large",
+                  "deeplabv3_resnet50", "deeplabv3_resnet101"):
+        if hasattr(torchvision.models.segmentation, _name):
+            BUILDERS[_name] = _tv_model(_name, torchvision.models.segmentation)
+
+class ModelCache:
+    def __init__(self, max_models: int = MAX_RESIDENT_MODELS):
+        self.max_models = max(1, max_models)
+        self._models: "OrderedDict[Key, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._building: Dict[Key, threading.Lock] = {}
+
+    def get(self, arch: str, weights: str = "DEFAULT", device="cpu", builder: Optional[Builder] = None):
+        key = (arch, str(weights), str(device))
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            build_lock = self._building.setdefault(key, threading.Lock())
+        with build_lock:  # one build per key; other keys are not blocked meanwhile
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+            build = builder or BUILDERS.get(arch)
+            if build is None:
+                raise KeyError(f"no builder registered for {arch}")
+            log.info(f"Building {arch} ({weights}) on {device}")
+            model = build(str(weights), str(device))
+            with self._lock:
+                self._models[key] = model
+                while len(self._models) > self.max_models:
+                    old, _ = self._models.popitem(last=False)
+                    log.info(f"Evicting {old[0]} ({old[1]}) on {old[2]}")
+                    if TORCH_OK and old[2].startswith("cuda"):
+                        torch.cuda.empty_cache()
+                self._building.pop(key, None)
+            return model
+
+    def warm_up(self, specs: Iterable[Tuple[str, str, str]]):
+        """Build (arch, weights, device) entries ahead of the first image."""
+        for arch, weights, device in specs:
+            try:
+                self.get(arch, weights, device)
+            except Exception as e:
+                log.warning(f"Warm-up of {arch} failed: {e}")
+
+    def resident(self):
+        with self._lock:
+            return list(self._models)
+
+    def evict(self, arch: Optional[str] = None):
+        with self._lock:
+            for key in [k for k in self._models if arch is None or k[0] == arch]:
+                del self._models[key]
+
+_CACHE = ModelCache()
+
+def get_model(arch: str, weights: str = "DEFAULT", device="cpu", builder: Optional[Builder] = None):
+    """Shared model for (arch, weights, device), built on first use."""
+    return _CACHE.get(arch, weights, device, builder)
+
+def warm_up(specs: Iterable[Tuple[str, str, str]]):
+    _CACHE.warm_up(specs)
+
+def model_cache() -> ModelCache:
+    return _CACHE
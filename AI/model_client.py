@@ -0,0 +1,177 @@
+from __future__ import annotations
+import logging
+import os
+import socket
+import threading
+from typing import Dict, Optional, Sequence
+import numpy as np
+
+from model_server import (
+    SOCKET_PATH, OP_PING, OP_LOAD, OP_YOLO, OP_OCR, OP_DISEASE, OP_DEPTH, STATUS_OK,
+    send_frame, recv_frame,
+)
+
+log = logging.getLogger("model_client")
+
+# Thin client for model_server.py. The proxies mimic the parts of the
+# Ultralytics / EasyOCR / Keras objects the apps use, so load_models() can
+# return them in place of in-process models. get_model_client() returns None
+# when no server is running (or ARBOR_MODEL_SERVER=0), and the apps then load
+# their models locally as before.
+
+class RemoteModelError(RuntimeError):
+    pass
+
+class ModelClient:
+    def __init__(self, path: str = SOCKET_PATH, timeout: float = 120.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()  # one connection per session thread
+
+    def _sock(self) -> socket.socket:
+        s = getattr(self._local, "sock", None)
+        if s is None:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.settimeout(self.timeout)
+            s.connect(self.path)
+            self._local.sock = s
+        return s
+
+    def _drop(self):
+        s = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if s is not None:
+            try:
+                s.close()
+            except OSError:
+                pass
+
+    def call(self, op: int, meta: Optional[dict] = None, array: Optional[np.ndarray] = None):
+        try:
+            s = self._sock()
+            send_frame(s, op, meta, array)
+            status, rmeta, rarray = recv_frame(s)
+        except OSError:
+            self._drop()
+            raise
+        if status != STATUS_OK:
+            raise RemoteModelError(rmeta.get("error", "model server error"))
+        return rmeta, rarray
+
+    def ping(self) -> dict:
+        return self.call(OP_PING)[0]
+
+    def yolo(self, name: str) -> "RemoteYOLO":
+        meta, _ = self.call(OP_LOAD, {"kind": "yolo", "name": name})
+        return RemoteYOLO(self, name, {int(k): v for k, v in meta.get("names", {}).items()})
+
+    def ocr(self, langs: Sequence[str] = ("fr",), gpu: Optional[bool] = None) -> "RemoteOCR":
+        self.call(OP_LOAD, {"kind": "ocr", "langs": list(langs), "gpu": gpu})
+        return RemoteOCR(self, langs, gpu)
+
+    def disease(self, path: str) -> "RemoteKerasModel":
+        self.call(OP_LOAD, {"kind": "disease", "name": path})
+        return RemoteKerasModel(self, path)
+
+    def depth(self, img_rgb: np.ndarray, model_type: str, device: str) -> np.ndarray:
+        """Raw MiDaS prediction resized to the image (float32)."""
+        return self.call(OP_DEPTH, {"model_type": model_type, "device": device}, img_rgb)[1]
+
+class _Box:
+    __slots__ = ("xyxy", "conf", "cls")
+
+    def __init__(self, row: np.ndarray):
+        self.xyxy = row[None, :4]
+        self.conf = row[4:5]
+        self.cls = row[5:6]
+
+class _Boxes:
+    def __init__(self, data: np.ndarray):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return (_Box(row) for row in self.data)
+
+    @property
+    def xyxy(self):
+        return self.data[:, :4]
+
+    @property
+    def conf(self):
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+        return self.data[:, 5]
+
+class RemoteResult:
+    def __init__(self, data: np.ndarray, names: Dict[int, str]):
+        self.boxes = _Boxes(data)
+        self.names = names
+
+class RemoteYOLO:
+    def __init__(self, client: ModelClient, name: str, names: Dict[int, str]):
+        self.client = client
+        self.name = name
+        self.names = names
+
+    def predict(self, source, **kwargs):
+        """source: BGR frame (see yolo_inference.to_bgr)."""
+        _, data = self.client.call(OP_YOLO, {"name": self.name, "kwargs": kwargs}, np.asarray(source))
+        return [RemoteResult(data, self.names)]
+
+    __call__ = predict
+
+class RemoteOCR:
+    def __init__(self, client: ModelClient, langs: Sequence[str], gpu: Optional[bool]):
+        self.client = client
+        self.langs = tuple(langs)
+        self.gpu = gpu
+
+    def _call(self, method: str, image, kwargs):
+        meta = {"langs": list(self.langs), "gpu": self.gpu, "method": method, "kwargs": kwargs}
+        return self.client.call(OP_OCR, meta, np.asarray(image))[0]["result"]
+
+    def readtext(self, image, **kwargs):
+        return [tuple(r) if isinstance(r, list) else r for r in self._call("readtext", image, kwargs)]
+
+    def detect(self, image, **kwargs):
+        horizontal, free = self._call("detect", image, kwargs)
+        return horizontal, free
+
+    def recognize(self, image_grey, **kwargs):
+        return [tuple(r) for r in self._call("recognize", image_grey, kwargs)]
+
+class RemoteKerasModel:
+    def __init__(self, client: ModelClient, path: str):
+        self.client = client
+        self.path = path
+
+    def predict(self, x, **kwargs):
+        return self.client.call(OP_DISEASE, {"name": self.path}, np.asarray(x, dtype=np.float32))[1]
+
+_CLIENT: Optional[ModelClient] = None
+_LOCK = threading.Lock()
+
+def get_model_client(path: str = SOCKET_PATH) -> Optional[ModelClient]:
+    """Connected client when a model server is listening, else None."""
+    global _CLIENT
+    if os.environ.get("ARBOR_MODEL_SERVER", "1").strip().lower() in ("0", "false", "no"):
+        return None
+    with _LOCK:
+        if _CLIENT is not None and _CLIENT.path == path:
+            return _CLIENT
+        if not os.path.exists(path):
+            return None
+        client = ModelClient(path)
+        try:
+            info = client.ping()
+        except (OSError, RemoteModelError) as e:
+            log.info(f"Model server at {path} not reachable ({e}); using in-process models")
+            return None
+        log.info(f"Using model server at {path} (pid {info.get('pid')})")
+        _CLIENT = client
+        return client
@@ -0,0 +1,303 @@
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+log = logging.getLogger("model_server")
+
+# Local model server shared by the Streamlit front-ends. One daemon holds YOLO,
+# EasyOCR, the Keras disease model and MiDaS; the apps talk to it over a Unix
+# socket (see model_client.py) and fall back to in-process models when it is
+# not running. YOLO and disease requests arriving from different clients within
+# a few milliseconds are run as one batch.
+#
+# Wire format, both directions: header, JSON metadata, raw array payload.
+#   header  = magic b"ARBV", op or status (u8), meta length (u32), payload length (u32), big endian
+#   payload = C-contiguous array bytes; dtype and shape travel in meta["array"]
+
+SOCKET_PATH = os.environ.get("ARBOR_MODEL_SOCKET", os.path.join(tempfile.gettempdir(), "arborvision_models.sock"))
+MAX_BATCH = int(os.environ.get("ARBOR_MODEL_MAX_BATCH", "8"))
+BATCH_WINDOW_S = float(os.environ.get("ARBOR_MODEL_BATCH_MS", "5")) / 1000.0
+
+MAGIC = b"ARBV"
+HEADER = struct.Struct("!4sBII")
+OP_PING, OP_LOAD, OP_YOLO, OP_OCR, OP_DISEASE, OP_DEPTH = range(6)
+STATUS_OK, STATUS_ERROR = 0, 1
+OCR_METHODS = ("readtext", "detect", "recognize")
+
+class ProtocolError(RuntimeError):
+    pass
+
+def _json_default(o):
+    if isinstance(o, np.integer):
+        return int(o)
+    if isinstance(o, np.floating):
+        return float(o)
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    raise TypeError(f"not JSON serialisable: {type(o).__name__}")
+
+def _recv_exact(sock: socket.socket, n: int) -> bytearray:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:], n - got)
+        if k == 0:
+            raise ConnectionError("connection closed")
+        got += k
+    return buf
+
+def send_frame(sock: socket.socket, op: int, meta: Optional[dict] = None, array: Optional[np.ndarray] = None):
+    meta = dict(meta or {})
+    payload = b""
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        meta["array"] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+        payload = array.reshape(-1).view(np.uint8)
+    mb = json.dumps(meta, separators=(",", ":"), default=_json_default).encode("utf-8")
+    sock.sendall(HEADER.pack(MAGIC, op, len(mb), len(payload)) + mb)
+    if len(payload):
+        sock.sendall(payload)
+
+def recv_frame(sock: socket.socket) -> Tuple[int, dict, Optional[np.ndarray]]:
+    magic, op, n_meta, n_payload = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if magic != MAGIC:
+        raise ProtocolError(f"bad magic {magic!r}")
+    meta = json.loads(_recv_exact(sock, n_meta).decode("utf-8")) if n_meta else {}
+    array = None
+    spec = meta.pop("array", None)
+    if spec is not None:
+        array = np.frombuffer(_recv_exact(sock, n_payload), dtype=np.dtype(spec["dtype"])).reshape(spec["shape"])
+    elif n_payload:
+        _recv_exact(sock, n_payload)
+    return op, meta, array
+
+class _Batcher:
+    """Runs fn(key, items) on groups of items gathered from concurrent callers."""
+    def __init__(self, name: str, fn: Callable[[Any, List[Any]], List[Any]],
+                 max_batch: int = MAX_BATCH, window_s: float = BATCH_WINDOW_S):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.window_s = window_s
+        self._q: "queue.Queue" = queue.Queue()
+        threading.Thread(target=self._loop, name=f"batch-{name}", daemon=True).start()
+
+    def submit(self, key, item):
+        fut: Future = Future()
+        self._q.put((key, item, fut))
+        return fut.result()
+
+    def _loop(self):
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.window_s
+            while len(batch) < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=left))
+                except queue.Empty:
+                    break
+            groups: Dict[Any, list] = {}
+            for key, item, fut in batch:
+                groups.setdefault(key, []).append((item, fut))
+            for key, entries in groups.items():
+                try:
+                    outs = self.fn(key, [item for item, _ in entries])
+                    for (_, fut), out in zip(entries, outs):
+                        fut.set_result(out)
+                except Exception as e:
+                    for _, fut in entries:
+                        fut.set_exception(e)
+
+class ModelHost:
+    """Models loaded once per daemon, keyed like the in-process caches."""
+    def __init__(self):
+        self._models: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+        self._depth_lock = threading.Lock()
+        self._yolo = _Batcher("yolo", self._run_yolo)
+        self._disease = _Batcher("disease", self._run_disease)
+
+    def _get(self, key: tuple, load: Callable[[], Any]):
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                log.info(f"Loading {key[0]} {key[1:]}")
+                model = self._models[key] = load()
+            return model
+
+    # heavy frameworks are imported on first use, so the daemon only needs the ones it serves
+    def yolo(self, name: str):
+        def load():
+            from ultralytics import YOLO
+            return YOLO(name)
+        return self._get(("yolo", name), load)
+
+    def ocr(self, langs, gpu):
+        def load():
+            from ocr_engine import get_ocr_engine
+            engine = get_ocr_engine(tuple(langs), gpu=gpu)
+            if engine is None:
+                raise RuntimeError("EasyOCR is not installed on the model server")
+            return engine
+        return self._get(("ocr", tuple(langs), gpu), load)
+
+    def disease(self, path: str):
+        def load():
+            from tensorflow.keras.models import load_model
+            return load_model(path)
+        return self._get(("disease", path), load)
+
+    def depth(self, model_type: str, device: str):
+        def load():
+            from depth_models import get_depth_model
+            return get_depth_model(model_type, device)
+        return self._get(("depth", model_type, device), load)
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return [":".join(str(k) for k in key) for key in self._models]
+
+    # batched runners
+    def _run_yolo(self, key, frames: List[np.ndarray]) -> List[np.ndarray]:
+        name, kwargs = key
+        results = self.yolo(name).predict(frames, **json.loads(kwargs))
+        out = []
+        for r in results:
+            b = r.boxes
+            if b is None or len(b) == 0:
+                out.append(np.zeros((0, 6), np.float32))
+            else:
+                out.append(np.column_stack([b.xyxy.cpu().numpy(), b.conf.cpu().numpy(), b.cls.cpu().numpy()]).astype(np.float32))
+        return out
+
+    def _run_disease(self, path, arrays: List[np.ndarray]) -> List[np.ndarray]:
+        model = self.disease(path)
+        if all(a.shape[1:] == arrays[0].shape[1:] for a in arrays):
+            preds = np.asarray(model.predict(np.concatenate(arrays, axis=0), verbose=0))
+            return np.split(preds, np.cumsum([len(a) for a in arrays])[:-1])
+        return [np.asarray(model.predict(a, verbose=0)) for a in arrays]
+
+    def _run_depth(self, img_rgb: np.ndarray, model_type: str, device: str) -> np.ndarray:
+        import torch
+        model, transform = self.depth(model_type, device)
+        with self._depth_lock, torch.no_grad():
+            pred = model(transform(img_rgb).to(device))
+            pred = torch.nn.functional.interpolate(pred.unsqueeze(1), size=img_rgb.shape[:2],
+                                                   mode="bicubic", align_corners=False).squeeze()
+        return pred.cpu().numpy().astype(np.float32)
+
+    def dispatch(self, op: int, meta: dict, array: Optional[np.ndarray]) -> Tuple[dict, Optional[np.ndarray]]:
+        if op == OP_PING:
+            return {"pid": os.getpid(), "loaded": self.loaded()}, None
+        if op == OP_LOAD:
+            kind = meta.get("kind")
+            if kind == "yolo":
+                names = getattr(self.yolo(meta["name"]), "names", {}) or {}
+                return {"names": {str(k): v for k, v in dict(names).items()}}, None
+            if kind == "ocr":
+                self.ocr(meta.get("langs", ["fr"]), meta.get("gpu"))
+            elif kind == "disease":
+                self.disease(meta["name"])
+            elif kind == "depth":
+                self.depth(meta["model_type"], meta["device"])
+            else:
+                raise ValueError(f"unknown model kind {kind!r}")
+            return {}, None
+        if array is None:
+            raise ProtocolError("request without image payload")
+        if op == OP_YOLO:
+            kwargs = json.dumps(meta.get("kwargs", {}), sort_keys=True)
+            return {}, self._yolo.submit((meta["name"], kwargs), array)
+        if op == OP_DISEASE:
+            return {}, self._disease.submit(meta["name"], array)
+        if op == OP_OCR:
+            method = meta.get("method", "readtext")
+            if method not in OCR_METHODS:
+                raise ValueError(f"unknown OCR method {method!r}")
+            engine = self.ocr(meta.get("langs", ["fr"]), meta.get("gpu"))
+            return {"result": getattr(engine, method)(array, **meta.get("kwargs", {}))}, None
+        if op == OP_DEPTH:
+            return {}, self._run_depth(array, meta["model_type"], meta["device"])
+        raise ProtocolError(f"unknown op {op}")
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        host: ModelHost = self.server.host
+        while True:
+            try:
+                op, meta, array = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            except ProtocolError as e:
+                log.warning(f"Dropping client: {e}")
+                return
+            try:
+                rmeta, rarray = host.dispatch(op, meta, array)
+                send_frame(self.request, STATUS_OK, rmeta, rarray)
+            except Exception as e:
+                log.warning(f"Request op={op} failed: {e}")
+                try:
+                    send_frame(self.request, STATUS_ERROR, {"error": f"{type(e).__name__}: {e}"})
+                except OSError:
+                    return
+
+class ModelServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str = SOCKET_PATH, host: Optional[ModelHost] = None):
+        self.host = host or ModelHost()
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+def _socket_alive(path: str) -> bool:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(1.0)
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+def serve(path: str = SOCKET_PATH, preload: Tuple[str, ...] = ()):
+    if os.path.exists(path):
+        if _socket_alive(path):
+            raise RuntimeError(f"a model server is already listening on {path}")
+        os.unlink(path)
+    server = ModelServer(path)
+    for name in preload:
+        server.host.yolo(name)
+    log.info(f"Model server listening on {path} (batch <= {MAX_BATCH}, window {BATCH_WINDOW_S * 1000:.0f} ms)")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+def main():
+    ap = argparse.ArgumentParser(description="Shared model server for the ArborVision Streamlit apps")
+    ap.add_argument("--socket", default=SOCKET_PATH)
+    ap.add_argument("--preload-yolo", nargs="*", default=[], help="YOLO weights to load at startup")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    serve(args.socket, tuple(args.preload_yolo))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import logging
+import os
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+
+try:
+    import easyocr
+    EASYOCR_OK = True
+except Exception:
+    EASYOCR_OK = False
+
+log = logging.getLogger("ocr_engine")
+
+# Process-wide EasyOCR engines: detector/recognizer weights are loaded once per
+# (languages, device) and shared by every caller (all Streamlit sessions run in
+# the same process). A bounded semaphore caps concurrent recognitions so a burst
+# of taps cannot oversubscribe the CPU or GPU memory.
+
+OCR_MAX_CONCURRENCY = int(os.environ.get("ARBOR_OCR_CONCURRENCY", "1"))
+
+def _default_gpu() -> bool:
+    env = os.environ.get("ARBOR_OCR_GPU")
+    if env is not None:
+        return env.strip().lower() in ("1", "true", "yes")
+    try:
+        import torch
+        return bool(torch.cuda.is_available())
+    except Exception:
+        return False
+
+class OCREngine:
+    def __init__(self, langs: Sequence[str], gpu: bool, max_concurrency: int = OCR_MAX_CONCURRENCY):
+        self.langs = tuple(langs)
+        self.gpu = gpu
+        self.reader = easyocr.Reader(list(self.langs), gpu=gpu)
+        self._sem = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def warm_up(self):
+        """Run one tiny recognition so the first real tap does not pay lazy initialisation."""
+        blank = np.full((32, 96, 3), 255, dtype=np.uint8)
+        self.readtext(blank)
+
+    # same signatures as easyocr.Reader, so the engine can stand in for a reader
+    def readtext(self, image, **kwargs):
+        with self._sem:
+            return self.reader.readtext(image, **kwargs)
+
+    def detect(self, image, **kwargs):
+        with self._sem:
+            return self.reader.detect(image, **kwargs)
+
+    def recognize(self, image_grey, **kwargs):
+        with self._sem:
+            return self.reader.recognize(image_grey, **kwargs)
+
+_ENGINES: Dict[Tuple[Tuple[str, ...], bool], OCREngine] = {}
+_LOCK = threading.Lock()
+
+def get_ocr_engine(langs: Sequence[str] = ("fr",), gpu: Optional[bool] = None, warm: bool = True) -> Optional[OCREngine]:
+    """Shared engine for (langs, device); None when EasyOCR is not installed."""
+    if not EASYOCR_OK:
+        return None
+    gpu = _default_gpu() if gpu is None else gpu
+    key = (tuple(langs), gpu)
+    with _LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            log.info(f"Loading EasyOCR {list(key[0])} ({'gpu' if gpu else 'cpu'})")
+            engine = OCREngine(key[0], gpu)
+            if warm:
+                try:
+                    engine.warm_up()
+                except Exception as e:
+                    log.warning(f"OCR warm-up failed: {e}")
+            _ENGINES[key] = engine
+        return engine
@@ -0,0 +1,67 @@
+from __future__ import annotations
+import logging
+import os
+from typing import Iterable, Optional
+import numpy as np
+import cv2
+
+try:
+    import torch
+    TORCH_OK = True
+except Exception:
+    TORCH_OK = False
+
+from model_cache import BUILDERS, get_model
+
+log = logging.getLogger("semantic_segmentation")
+
+# Semantic fallback for the tree mask. The scripts used to run
+# deeplabv3_resnet101 at 520x520 for a single class; the default here is the
+# MobileNetV3 DeepLabV3 at half that resolution, which is roughly an order of
+# magnitude cheaper on CPU. The mask is computed from the wanted class channels
+# only (class c wins where its logit equals the per-pixel max) and brought back
+# to image size with nearest-neighbour, so it stays binary.
+#
+# ARBOR_SEG_MODEL: one of SEG_MODELS; ARBOR_SEG_SIZE: short side of the input.
+
+SEG_MODELS = (
+    "deeplabv3_mobilenet_v3_large",
+    "lraspp_mobilenet_v3_large",
+    "deeplabv3_resnet50",
+    "deeplabv3_resnet101",
+)
+DEFAULT_SEG_MODEL = os.environ.get("ARBOR_SEG_MODEL", "deeplabv3_mobilenet_v3_large")
+DEFAULT_SEG_SIZE = int(os.environ.get("ARBOR_SEG_SIZE", "260"))
+VEGETATION_CLASSES = (15,)   # PASCAL VOC index used by the scripts so far
+
+_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+def _input_tensor(img_rgb: np.ndarray, size: int, device):
+    h, w = img_rgb.shape[:2]
+    scale = size / min(h, w)
+    small = cv2.resize(img_rgb, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    x = (small.astype(np.float32) / 255.0 - _MEAN) / _STD
+    return torch.from_numpy(np.ascontiguousarray(x.transpose(2, 0, 1))).unsqueeze(0).to(device)
+
+def semantic_mask(img_rgb: np.ndarray, device="cpu", model: Optional[str] = None,
+                  size: Optional[int] = None, classes: Iterable[int] = VEGETATION_CLASSES) -> Optional[np.ndarray]:
+    """Boolean mask of the pixels labelled as one of `classes`, or None when there are none."""
+    if not TORCH_OK:
+        return None
+    arch = model or DEFAULT_SEG_MODEL
+    if arch not in BUILDERS:
+        raise ValueError(f"unknown segmentation model {arch!r} (available: {', '.join(SEG_MODELS)})")
+    net = get_model(arch, "DEFAULT", device)
+    x = _input_tensor(img_rgb, size or DEFAULT_SEG_SIZE, device)
+    with torch.inference_mode():
+        out = net(x)["out"][0]
+        best = out.max(0).values
+        hit = torch.zeros_like(best, dtype=torch.bool)
+        for c in classes:
+            hit |= out[c] >= best
+    small = hit.to(torch.uint8).cpu().numpy()
+    if not small.any():
+        return None
+    h, w = img_rgb.shape[:2]
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST).astype(bool)
@@ -0,0 +1,214 @@
+from __future__ import annotations
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+import numpy as np
+
+try:
+    import RPi.GPIO as GPIO
+    RPI_GPIO_OK = True
+except Exception:
+    RPI_GPIO_OK = False
+
+log = logging.getLogger("sensor_sampler")
+
+# Background sampling of the laser gate and the HC-SR04 ultrasonic sensor.
+# One thread samples at a fixed rate into a ring buffer (single writer, readers
+# never take a lock); latest() returns the median of the recent valid readings
+# after MAD outlier rejection, so the UI never waits on GPIO and never sees a
+# single noisy echo.
+#
+# ARBOR_SENSOR_BACKEND: "gpio" (default when RPi.GPIO is importable), "sim"
+# for the simulated backend, "none" to disable.
+
+TRIG_PIN = 23
+ECHO_PIN = 24
+LASER_PIN = 2
+SPEED_OF_SOUND_M_S = 343.0
+
+SAMPLE_RATE_HZ = float(os.environ.get("ARBOR_SENSOR_RATE_HZ", "10"))
+RING_CAPACITY = 256
+WINDOW_S = 1.5          # readings older than this are ignored by latest()
+MIN_SAMPLES = 3
+
+class GPIOBackend:
+    """RPi.GPIO backend; edges are awaited with wait_for_edge instead of spinning."""
+    def __init__(self, trig: int = TRIG_PIN, echo: int = ECHO_PIN, laser: int = LASER_PIN):
+        self.trig, self.echo, self.laser = trig, echo, laser
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(trig, GPIO.OUT)
+        GPIO.setup(echo, GPIO.IN)
+        GPIO.setup(laser, GPIO.IN)
+        GPIO.output(trig, False)
+        time.sleep(0.1)
+
+    def laser_active(self) -> bool:
+        return bool(GPIO.input(self.laser))
+
+    def echo_time(self, timeout_s: float = 0.03) -> Optional[float]:
+        GPIO.output(self.trig, True)
+        time.sleep(0.00001)
+        GPIO.output(self.trig, False)
+        ms = max(1, int(timeout_s * 1000))
+        if GPIO.input(self.echo) == 0 and GPIO.wait_for_edge(self.echo, GPIO.RISING, timeout=ms) is None:
+            return None
+        start = time.perf_counter()
+        if GPIO.wait_for_edge(self.echo, GPIO.FALLING, timeout=ms) is None:
+            return None
+        return time.perf_counter() - start
+
+    def close(self):
+        try:
+            GPIO.cleanup()
+        except Exception:
+            pass
+
+class SimulatedBackend:
+    """Noisy sensor at a settable distance, with occasional outliers and missed echoes."""
+    def __init__(self, distance_m: float = 3.0, noise_m: float = 0.02, outlier_rate: float = 0.05,
+                 miss_rate: float = 0.02, laser: bool = True, seed: Optional[int] = None):
+        self.distance_m = distance_m
+        self.noise_m = noise_m
+        self.outlier_rate = outlier_rate
+        self.miss_rate = miss_rate
+        self.laser = laser
+        self._rng = random.Random(seed)
+
+    def laser_active(self) -> bool:
+        return self.laser
+
+    def echo_time(self, timeout_s: float = 0.03) -> Optional[float]:
+        r = self._rng.random()
+        if r < self.miss_rate:
+            return None
+        d = self.distance_m + self._rng.gauss(0.0, self.noise_m)
+        if r < self.miss_rate + self.outlier_rate:
+            d = self._rng.uniform(0.02, 4.0 * self.distance_m)   # multipath / crosstalk
+        t = 2.0 * max(d, 0.0) / SPEED_OF_SOUND_M_S
+        return t if t <= timeout_s else None
+
+    def close(self):
+        pass
+
+def robust_median(values: np.ndarray, k: float = 3.0) -> Optional[tuple]:
+    """(median of inliers, inlier count, MAD spread) with |x - median| <= k * 1.4826 * MAD."""
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return None
+    med = float(np.median(values))
+    mad = 1.4826 * float(np.median(np.abs(values - med)))
+    tol = k * max(mad, 0.005)  # 5 mm floor so identical readings are not all rejected
+    inliers = values[np.abs(values - med) <= tol]
+    return float(np.median(inliers)), int(inliers.size), mad
+
+class SensorSampler:
+    def __init__(self, backend, rate_hz: float = SAMPLE_RATE_HZ, capacity: int = RING_CAPACITY,
+                 window_s: float = WINDOW_S, min_samples: int = MIN_SAMPLES):
+        self.backend = backend
+        self.period = 1.0 / rate_hz
+        self.window_s = window_s
+        self.min_samples = min_samples
+        self._t = np.zeros(capacity, np.float64)        # monotonic timestamps
+        self._dist = np.full(capacity, np.nan, np.float64)
+        self._laser = np.zeros(capacity, np.bool_)
+        self._n = 0   # total samples written; the writer bumps it after filling the slot
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sensor-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self.backend.close()
+
+    def sample_once(self):
+        """Take one reading into the ring (the thread calls this at the fixed rate)."""
+        try:
+            laser = self.backend.laser_active()
+            dist = np.nan
+            if laser:
+                # as before, the ultrasonic sensor is only fired while the laser gate is active
+                t = self.backend.echo_time()
+                if t is not None:
+                    dist = t * SPEED_OF_SOUND_M_S / 2.0
+        except Exception as e:
+            log.debug(f"sensor read failed: {e}")
+            laser, dist = False, np.nan
+        i = self._n % len(self._t)
+        self._t[i] = time.monotonic()
+        self._dist[i] = dist
+        self._laser[i] = laser
+        self._n += 1
+
+    def _run(self):
+        next_t = time.monotonic()
+        while not self._stop.is_set():
+            self.sample_once()
+            next_t += self.period
+            delay = next_t - time.monotonic()
+            if delay < 0:             # overran: skip missed slots instead of bursting
+                next_t = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def snapshot(self, window_s: Optional[float] = None):
+        """(timestamps, distances, laser) of the readings inside the window, oldest first."""
+        n = self._n
+        cap = len(self._t)
+        # slot n % cap may be half-written by the sampler (t before distance): leave it out
+        count = min(n, cap - 1)
+        idx = (np.arange(n - count, n) % cap) if count else np.zeros(0, np.intp)
+        t, d, l = self._t[idx], self._dist[idx], self._laser[idx]
+        keep = t >= time.monotonic() - (self.window_s if window_s is None else window_s)
+        return t[keep], d[keep], l[keep]
+
+    def latest(self) -> Dict[str, Optional[float]]:
+        """Filtered reading in the read_sensors_real format; never blocks."""
+        t, d, laser = self.snapshot()
+        out = {'ultrasound_m': None, 'laser_m': None, 'samples': 0, 'spread_m': None}
+        if t.size == 0 or not laser[-1]:
+            return out
+        est = robust_median(d[laser])
+        if est is None or est[1] < self.min_samples:
+            return out
+        dist = round(est[0], 2)
+        out.update({'ultrasound_m': dist, 'laser_m': dist, 'samples': est[1], 'spread_m': round(est[2], 3)})
+        return out
+
+_SAMPLER: Optional[SensorSampler] = None
+_LOCK = threading.Lock()
+
+def make_backend(kind: Optional[str] = None):
+    kind = (kind or os.environ.get("ARBOR_SENSOR_BACKEND") or ("gpio" if RPI_GPIO_OK else "none")).lower()
+    if kind == "gpio" and RPI_GPIO_OK:
+        return GPIOBackend()
+    if kind == "sim":
+        return SimulatedBackend(distance_m=float(os.environ.get("ARBOR_SENSOR_SIM_DISTANCE", "3.0")))
+    return None
+
+def get_sensor_sampler() -> Optional[SensorSampler]:
+    """Process-wide running sampler, or None when no sensor backend is available."""
+    global _SAMPLER
+    with _LOCK:
+        if _SAMPLER is None:
+            try:
+                backend = make_backend()
+            except Exception as e:
+                log.warning(f"Sensor backend unavailable: {e}")
+                backend = None
+            if backend is None:
+                return None
+            _SAMPLER = SensorSampler(backend).start()
+            atexit.register(_SAMPLER.stop)
+        return _SAMPLER
@@ -0,0 +1,183 @@
+from __future__ import annotations
+import io
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+log = logging.getLogger("tree_db")
+
+# Embedded tree database (SQLite, WAL). One row per tree in `trees`, keyed by
+# tree_id, plus one row per saved measurement in `measurements`. Saving a tree
+# is a single upsert + insert in one transaction, independent of how many trees
+# the orchard has. Record fields are stored as JSON so each app keeps its own
+# column set; Excel is only an explicit import/export format.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trees (
+    tree_id    TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL,
+    fields     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    tree_id     TEXT NOT NULL,
+    measured_at TEXT NOT NULL,
+    fields      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_measurements_tree ON measurements (tree_id, measured_at);
+"""
+
+def _json_default(o):
+    if hasattr(o, "item"):      # numpy scalars
+        return o.item()
+    if hasattr(o, "isoformat"):  # datetime / Timestamp
+        return o.isoformat()
+    return str(o)
+
+def _dumps(fields: Dict[str, Any]) -> str:
+    return json.dumps(fields, ensure_ascii=False, default=_json_default)
+
+def tree_id_str(value) -> Optional[str]:
+    """Tree ID as text; integral floats (pandas reads an ID column with blanks as float) lose
+    their ".0", and missing or blank IDs give None."""
+    if value is None:
+        return None
+    if isinstance(value, float) or (hasattr(value, "item") and isinstance(value.item(), float)):
+        value = float(value)
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            value = int(value)
+    tid = str(value).strip()
+    return tid or None
+
+class TreeDB:
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()  # sqlite3 connections are per thread
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, tree_id: str, fields: Dict[str, Any], merge: bool = True, history: bool = True) -> Dict[str, Any]:
+        """Insert or update one tree atomically; merge=False replaces the stored fields."""
+        tree_id = str(tree_id)
+        now = datetime.now().isoformat(timespec="seconds")
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT fields FROM trees WHERE tree_id = ?", (tree_id,)).fetchone() if merge else None
+            record = {**json.loads(row[0]), **fields} if row else dict(fields)
+            conn.execute(
+                "INSERT INTO trees (tree_id, updated_at, fields) VALUES (?, ?, ?) "
+                "ON CONFLICT(tree_id) DO UPDATE SET updated_at = excluded.updated_at, fields = excluded.fields",
+                (tree_id, now, _dumps(record)))
+            if history:
+                conn.execute("INSERT INTO measurements (tree_id, measured_at, fields) VALUES (?, ?, ?)",
+                             (tree_id, now, _dumps(fields)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return record
+
+    def get(self, tree_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT fields FROM trees WHERE tree_id = ?", (str(tree_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM trees").fetchone()[0]
+
+    def trees(self) -> Dict[str, Dict[str, Any]]:
+        rows = self._conn().execute("SELECT tree_id, fields FROM trees ORDER BY rowid").fetchall()
+        return {tid: json.loads(f) for tid, f in rows}
+
+    def history(self, tree_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT measured_at, fields FROM measurements WHERE tree_id = ? ORDER BY measured_at, id",
+            (str(tree_id),)).fetchall()
+        return [{"measured_at": at, **json.loads(f)} for at, f in rows]
+
+    def data_version(self) -> int:
+        """Changes whenever another connection commits (cheap cache key)."""
+        return self._conn().execute("PRAGMA data_version").fetchone()[0]
+
+    # Excel import / export
+    def to_dataframe(self, id_column: str = "tree_id", columns: Optional[Iterable[str]] = None):
+        import pandas as pd
+        records = [{id_column: tid, **f} for tid, f in self.trees().items()]
+        df = pd.DataFrame(records)
+        if columns is not None:
+            df = df.reindex(columns=list(columns))
+        return df
+
+    def export_excel(self, target=None, id_column: str = "tree_id", columns: Optional[Iterable[str]] = None):
+        """Write all trees to an .xlsx path, or return the workbook bytes when target is None."""
+        df = self.to_dataframe(id_column, columns)
+        if target is None:
+            buf = io.BytesIO()
+            df.to_excel(buf, index=False)
+            return buf.getvalue()
+        df.to_excel(target, index=False)
+        return target
+
+    def import_excel(self, source, id_column: str = "tree_id", history: bool = False) -> int:
+        """Upsert every row of a workbook in one transaction; returns the number of trees."""
+        import pandas as pd
+        df = pd.read_excel(source)
+        if id_column not in df.columns:
+            raise ValueError(f"column '{id_column}' not found in workbook")
+        df = df[df[id_column].notna()]
+        df = df.astype(object).where(df.notna(), None)
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = []
+        for rec in df.to_dict("records"):
+            tid = tree_id_str(rec.pop(id_column))
+            if tid is None:
+                continue
+            rows.append((tid, now, _dumps(rec)))
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO trees (tree_id, updated_at, fields) VALUES (?, ?, ?) "
+                "ON CONFLICT(tree_id) DO UPDATE SET updated_at = excluded.updated_at, fields = excluded.fields", rows)
+            if history:
+                conn.executemany("INSERT INTO measurements (tree_id, measured_at, fields) VALUES (?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+_DBS: Dict[str, TreeDB] = {}
+_LOCK = threading.Lock()
+
+def get_tree_db(path: str, legacy_excel: Optional[str] = None, id_column: str = "tree_id") -> TreeDB:
+    """Shared TreeDB for path; on first creation, imports legacy_excel if the database is empty."""
+    key = os.path.abspath(path)
+    with _LOCK:
+        db = _DBS.get(key)
+        if db is None:
+            db = _DBS[key] = TreeDB(path)
+            if legacy_excel and os.path.exists(legacy_excel) and db.count() == 0:
+                try:
+                    n = db.import_excel(legacy_excel, id_column=id_column)
+                    log.info(f"Imported {n} trees from {legacy_excel} into {path}")
+                except Exception as e:
+                    log.warning(f"Could not import {legacy_excel}: {e}")
+        return db
@@ -0,0 +1,159 @@
+from __future__ import annotations
+import bisect
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# In-memory index over tree IDs, shared by all sessions of an app.
+#
+# IDs are folded to a canonical form (upper case, no separators, and the OCR
+# confusions O->0, I/L->1, S->5, B->8, Z->2) so that "arb-0O1" finds "ARB001".
+# Prefix lookup bisects a sorted list of canonical IDs; fuzzy lookup uses a
+# deletion index (every canonical ID with up to `max_distance` characters
+# removed), so a query only touches IDs sharing a deletion variant, and the
+# candidates are then checked with a real edit distance.
+
+_OCR_FOLD = str.maketrans({"O": "0", "I": "1", "L": "1", "S": "5", "B": "8", "Z": "2"})
+
+def canonical_id(tree_id) -> str:
+    s = "".join(ch for ch in str(tree_id).upper() if ch.isalnum())
+    return s.translate(_OCR_FOLD)
+
+def _deletes(s: str, depth: int) -> set:
+    out, frontier = {s}, {s}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+def edit_distance(a: str, b: str, limit: Optional[int] = None) -> int:
+    """Levenshtein distance; stops early once every cell of a row exceeds limit."""
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if limit is not None and min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+class TreeRegistry:
+    def __init__(self, records: Dict[str, dict], max_distance: int = 2):
+        self.records = records
+        self.max_distance = max_distance
+        self._by_canon: Dict[str, List[str]] = {}
+        for tid in records:
+            self._by_canon.setdefault(canonical_id(tid), []).append(tid)
+        self._sorted = sorted(self._by_canon)
+        self._deletes: Dict[str, set] = {}
+        for canon in self._by_canon:
+            for d in _deletes(canon, max_distance):
+                self._deletes.setdefault(d, set()).add(canon)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, tree_id):
+        return tree_id in self.records
+
+    def get(self, tree_id, default=None):
+        return self.records.get(tree_id, default)
+
+    def exact(self, query) -> Optional[str]:
+        """ID equal to query, or equal up to case / separators / OCR confusions."""
+        if query in self.records:
+            return query
+        ids = self._by_canon.get(canonical_id(query))
+        return ids[0] if ids else None
+
+    def prefix(self, query, limit: int = 10) -> List[str]:
+        canon = canonical_id(query)
+        if not canon:
+            return []
+        out = []
+        i = bisect.bisect_left(self._sorted, canon)
+        while i < len(self._sorted) and self._sorted[i].startswith(canon) and len(out) < limit:
+            out.extend(self._by_canon[self._sorted[i]])
+            i += 1
+        return out[:limit]
+
+    def fuzzy(self, query, max_distance: Optional[int] = None, limit: int = 5) -> List[Tuple[str, int]]:
+        """(id, distance) within max_distance edits of the canonical query, closest first."""
+        k = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        canon = canonical_id(query)
+        if not canon:
+            return []
+        candidates = set()
+        for d in _deletes(canon, k):
+            candidates |= self._deletes.get(d, set())
+        scored = []
+        for c in candidates:
+            dist = edit_distance(canon, c, k)
+            if dist <= k:
+                scored.extend((tid, dist) for tid in self._by_canon[c])
+        scored.sort(key=lambda t: (t[1], t[0]))
+        return scored[:limit]
+
+    def resolve(self, query, limit: int = 3) -> List[str]:
+        """Best matches for an ID read by OCR: exact, else fuzzy (1 then 2 edits), else prefix."""
+        hit = self.exact(query)
+        if hit is not None:
+            return [hit]
+        close = self.fuzzy(query, max_distance=1, limit=limit) or self.fuzzy(query, limit=limit)
+        if close:
+            return [tid for tid, _ in close]
+        return self.prefix(query, limit=limit)
+
+def records_from_dataframe(df, id_column: str = "tree_id", fields: Optional[Dict[str, object]] = None) -> Dict[str, dict]:
+    """{id: record} from a DataFrame without iterrows; fields maps column -> default."""
+    if id_column not in df.columns:
+        return {}
+    df = df[df[id_column].notna()]
+    ids = df[id_column].astype(str).str.strip()
+    keep = ids != ""
+    df, ids = df[keep], ids[keep]
+    if fields is None:
+        fields = {c: None for c in df.columns if c != id_column}
+    cols = {}
+    for col, default in fields.items():
+        if col in df.columns:
+            cols[col] = df[col].astype(object).where(df[col].notna(), default).tolist()
+        else:
+            cols[col] = [default] * len(df)
+    names = list(cols)
+    records = {}
+    for tid, values in zip(ids.tolist(), zip(*[cols[n] for n in names]) if names else [()] * len(ids)):
+        rec = {id_column: tid}
+        rec.update(zip(names, values))
+        records[tid] = rec
+    return records
+
+def file_signature(*paths: str) -> Tuple:
+    """(mtime_ns, size) of each path, None for missing ones; changes whenever a file is written."""
+    sig = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+_CACHE: Dict[str, Tuple[Tuple, TreeRegistry]] = {}
+_LOCK = threading.Lock()
+
+def get_tree_registry(path: str, load: Callable[[], Dict[str, dict]], extra_paths: Iterable[str] = ()) -> TreeRegistry:
+    """Registry for path, rebuilt only when the file (or extra_paths, e.g. a WAL) changes."""
+    key = os.path.abspath(path)
+    sig = file_signature(path, *extra_paths)
+    with _LOCK:
+        hit = _CACHE.get(key)
+        if hit is not None and hit[0] == sig:
+            return hit[1]
+    registry = TreeRegistry(load())
+    with _LOCK:
+        _CACHE[key] = (sig, registry)
+    return registry
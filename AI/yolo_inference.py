@@ -0,0 +1,44 @@
+from __future__ import annotations
+import threading
+from typing import Dict
+import numpy as np
+import cv2
+
+try:
+    from PIL import Image
+    PIL_OK = True
+except Exception:
+    PIL_OK = False
+
+# In-memory YOLO inference for the Streamlit apps. Frames are handed to
+# Ultralytics as NumPy arrays (BGR, as for cv2.imread), so there is no JPEG
+# encode / disk write / decode round-trip and no shared temp file name between
+# sessions. All sessions share one process, so calls on the same model are
+# serialised by a per-model lock.
+
+_LOCKS: Dict[int, threading.Lock] = {}
+_LOCK = threading.Lock()
+
+def _model_lock(model) -> threading.Lock:
+    with _LOCK:
+        lock = _LOCKS.get(id(model))
+        if lock is None:
+            lock = _LOCKS[id(model)] = threading.Lock()
+        return lock
+
+def to_bgr(image, rgb: bool = True) -> np.ndarray:
+    """uint8 HxWx3 BGR array from a PIL image or an RGB (rgb=True) / BGR array."""
+    if PIL_OK and isinstance(image, Image.Image):
+        return cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    arr = np.asarray(image)
+    if arr.ndim == 2:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
+    if arr.shape[2] == 4:
+        return cv2.cvtColor(arr, cv2.COLOR_RGBA2BGR if rgb else cv2.COLOR_BGRA2BGR)
+    return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR) if rgb else np.ascontiguousarray(arr)
+
+def yolo_predict(model, image, rgb: bool = True, **kwargs):
+    """model.predict on an in-memory image; same return value as Ultralytics."""
+    frame = to_bgr(image, rgb=rgb)
+    with _model_lock(model):
+        return model.predict(frame, **kwargs)